@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+import config
+import render_cache
+import ffmpeg_runner
+from ffmpeg_runner import get_ffmpeg_command
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Индекс энергии звука для выбора клипов: декодируется только аудиодорожка в моно PCM низкой
+# частоты (видео не декодируется), по ней считаются огибающие громкости и нарастаний (onset).
+# Огибающие кэшируются по отпечатку содержимого источника, повторный анализ не нужен
+
+# Сколько секунд звука читать из pipe за раз
+CHUNK_SECONDS = 60
+
+def is_available():
+    """Анализ возможен: включен в config и установлен numpy"""
+    if not config.AUDIO_ANALYSIS['enabled']:
+        return False
+    if np is None:
+        logging.warning("numpy не установлен - клипы выбираются случайно (pip install numpy)")
+        return False
+    return True
+
+def get_cache_path(input_path):
+    """Файл кэша огибающих: отпечаток источника и параметры анализа"""
+    analysis = config.AUDIO_ANALYSIS
+    fingerprint = render_cache.source_fingerprint(input_path)
+    return analysis['cache_dir'] / f"{fingerprint}_{analysis['sample_rate']}_{analysis['hop_seconds']}.npz"
+
+def decode_energy(input_path):
+    """Средняя энергия звука по окнам hop_seconds: ffmpeg -> float32 моно через pipe, счет по кускам"""
+    analysis = config.AUDIO_ANALYSIS
+    hop_samples = max(1, int(round(analysis['sample_rate'] * analysis['hop_seconds'])))
+    cmd = [
+        get_ffmpeg_command(),
+        '-v', 'error',
+        '-vn', '-sn', '-dn',
+        '-i', str(input_path),
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(analysis['sample_rate']),
+        '-f', 'f32le',
+        'pipe:1'
+    ]
+
+    energies = []
+
+    def handle_chunk(data):
+        samples = np.frombuffer(data, dtype=np.float32)
+        whole = len(samples) // hop_samples * hop_samples
+        if whole:
+            energies.append(np.square(samples[:whole]).reshape(-1, hop_samples).mean(axis=1))
+        if whole < len(samples):
+            # Хвост файла короче окна
+            energies.append(np.square(samples[whole:]).mean(keepdims=True))
+
+    # Кусок - целое число окон, чтобы окно не разрывалось между чтениями
+    chunk_bytes = hop_samples * max(1, int(CHUNK_SECONDS / analysis['hop_seconds'])) * 4
+    result = ffmpeg_runner.run(cmd, description="Анализ звука", progress=True,
+                               stdout_handler=handle_chunk, stdout_chunk_size=chunk_bytes)
+    if result['returncode'] != 0:
+        logging.error(f"Ошибка декодирования звука {input_path}: {result['timed_out'] or result['stderr'].strip()}")
+        return None
+    if not energies:
+        return None
+    return np.concatenate(energies)
+
+def compute_envelopes(energy):
+    """Огибающие по энергии окон: громкость (дБ) и нарастание громкости (onset)"""
+    loudness = 10 * np.log10(energy + 1e-10)
+    # Onset - положительная часть прироста громкости: удары, выкрики, смех
+    onset = np.maximum(np.diff(loudness, prepend=loudness[:1]), 0)
+    return loudness.astype(np.float32), onset.astype(np.float32)
+
+def get_envelopes(input_path):
+    """Огибающие громкости и onset источника (из кэша или через анализ); None - звука нет или ошибка"""
+    cache_path = get_cache_path(input_path)
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                return cached['loudness'], cached['onset']
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Кэш анализа звука поврежден, анализируем заново: {cache_path}: {e}")
+
+    logging.info(f"Анализ звука: {input_path}")
+    analysis_start = time.monotonic()
+    energy = decode_energy(input_path)
+    if energy is None:
+        return None
+    loudness, onset = compute_envelopes(energy)
+
+    elapsed = time.monotonic() - analysis_start
+    audio_seconds = len(energy) * config.AUDIO_ANALYSIS['hop_seconds']
+    logging.info(
+        f"Анализ звука: {audio_seconds:.0f}с звука за {elapsed:.2f}с "
+        f"({audio_seconds / max(elapsed, 1e-6):.0f}x реального времени)"
+    )
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, loudness=loudness, onset=onset)
+    os.replace(temp_path, cache_path)
+    return loudness, onset
+
+def normalize(values):
+    """Приведение к нулевому среднему и единичному разбросу (сравнимые веса громкости и onset)"""
+    spread = values.std()
+    return (values - values.mean()) / spread if spread > 0 else np.zeros_like(values)
+
+def pick_highlight_windows(input_path, total_duration, num_clips, clip_duration, usable=None):
+    """Старты до num_clips непересекающихся окон с наибольшей энергией звука (по убыванию оценки)
+
+    usable - функция (массив стартов) -> массив bool: какие окна вообще можно брать.
+    None - анализ недоступен. Окон может быть меньше num_clips, если больше не помещается.
+    """
+    if not is_available():
+        return None
+    envelopes = get_envelopes(input_path)
+    if envelopes is None:
+        return None
+    loudness, onset = envelopes
+
+    hop = config.AUDIO_ANALYSIS['hop_seconds']
+    window_hops = max(1, int(round(clip_duration / hop)))
+    last_start = int((total_duration - clip_duration) / hop)
+    if len(loudness) < window_hops or last_start < 0:
+        return None
+
+    scores = normalize(loudness) + config.AUDIO_ANALYSIS['onset_weight'] * normalize(onset)
+    # Средняя оценка каждого окна длиной клипа - одна разность накопленных сумм
+    cumulative = np.concatenate(([0.0], np.cumsum(scores, dtype=np.float64)))
+    window_scores = (cumulative[window_hops:] - cumulative[:-window_hops]) / window_hops
+    window_scores = window_scores[:last_start + 1]
+
+    start_hops = []
+    available = np.ones(len(window_scores), dtype=bool)
+    if usable is not None:
+        available &= usable(np.arange(len(window_scores)) * hop)
+    while len(start_hops) < num_clips and available.any():
+        best = int(np.argmax(np.where(available, window_scores, -np.inf)))
+        start_hops.append(best)
+        # Окна, пересекающиеся с выбранным, больше не кандидаты
+        available[max(0, best - window_hops + 1):best + window_hops] = False
+
+    return [round(start_hop * hop, 3) for start_hop in start_hops]
@@ -0,0 +1,291 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime
+import config
+import utils
+import planner
+import layouts
+import scheduler
+import process_video
+
+# Пакетная обработка без интерактивного меню: задачи из манифеста (JSON или JSONL),
+# все клипы всех задач идут через один общий пул планировщика
+
+MODES = ('test', 'clips', 'full')
+LAYOUTS = ('main', 'clip')
+
+# Раскладка по умолчанию - как в интерактивном меню
+DEFAULT_LAYOUT = {'test': 'main', 'clips': 'clip', 'full': 'main'}
+
+def load_manifest(manifest_path):
+    """Задачи из манифеста: JSON-список, JSON {"jobs": [...]} или JSONL (задача на строку)"""
+    text = Path(manifest_path).read_text(encoding='utf-8')
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data.get('jobs', [data])
+    return data
+
+def normalize_job(raw_job, index):
+    """Проверка задачи и заполнение значений по умолчанию; при ошибке - ValueError"""
+    if not isinstance(raw_job, dict) or 'source' not in raw_job:
+        raise ValueError("у задачи нет поля source")
+
+    mode = raw_job.get('mode', 'test')
+    if mode not in MODES:
+        raise ValueError(f"неизвестный режим {mode} (допустимо: {', '.join(MODES)})")
+
+    layout = raw_job.get('layout', DEFAULT_LAYOUT[mode])
+    if layout not in LAYOUTS:
+        raise ValueError(f"неизвестная раскладка {layout} (допустимо: {', '.join(LAYOUTS)})")
+    if layout == 'clip' and mode != 'clips':
+        # Тестовый фрагмент и полное видео рендерятся только в основной раскладке
+        raise ValueError(f"раскладка clip поддерживается только в режиме clips, не в {mode}")
+
+    source = Path(raw_job['source']).expanduser().resolve()
+    if not source.exists():
+        raise ValueError(f"источник не найден: {source}")
+
+    job = {
+        'id': str(raw_job.get('id', f"job{index + 1:03d}")),
+        'index': index,
+        'source': str(source),
+        'mode': mode,
+        'layout': layout
+    }
+    if mode == 'clips':
+        start_times = raw_job.get('start_times')
+        job['clip_duration'] = float(raw_job.get('clip_duration', 15))
+        if start_times:
+            job['start_times'] = sorted(float(start_time) for start_time in start_times)
+            job['num_clips'] = len(job['start_times'])
+        else:
+            job['num_clips'] = int(raw_job.get('num_clips', 20))
+            job['seed'] = raw_job.get('seed')
+    elif mode == 'test':
+        start_time = raw_job.get('start_time')
+        job['start_time'] = float(start_time) if start_time is not None else None
+        job['seed'] = raw_job.get('seed')
+
+    for start_time in job.get('start_times', []) + [job.get('start_time')]:
+        if start_time is not None and start_time < 0:
+            raise ValueError(f"отрицательный старт {start_time}с")
+    return job
+
+def check_start_times(job, video_info):
+    """Явные старты задачи внутри видео; при ошибке - ValueError"""
+    total_duration = video_info['duration']
+    for start_time in job.get('start_times', []) + [job.get('start_time')]:
+        if start_time is not None and start_time >= total_duration:
+            raise ValueError(f"старт {start_time}с вне видео (длительность {total_duration:.2f}с)")
+
+def job_key(job):
+    """Ключ одинаковых задач: все поля, кроме id"""
+    return json.dumps({key: value for key, value in job.items() if key not in ('id', 'index')}, sort_keys=True)
+
+def plan_windows(job, video_info):
+    """Окна (старт, длительность) задачи"""
+    total_duration = video_info['duration']
+    if job['mode'] == 'full':
+        return [(0, total_duration)]
+
+    if job.get('seed') is not None:
+        random.seed(job['seed'])
+
+    if job['mode'] == 'test':
+        duration = min(config.TEST_FRAGMENT['duration'], total_duration)
+        if job['start_time'] is not None:
+            return [(job['start_time'], min(duration, total_duration - job['start_time']))]
+        start_time = utils.calculate_test_fragment_time(total_duration)
+        start_time = planner.snap_start_times(job['source'], [start_time], duration, total_duration)[0]
+        return [(start_time, duration)]
+
+    if 'start_times' in job:
+        # Явные старты не сдвигаются на ключевые кадры
+        start_times = job['start_times']
+    else:
+        start_times = planner.plan_clip_windows(job['source'], video_info, job['num_clips'], job['clip_duration'])
+    # Клип у конца видео короче clip_duration: в окне (и в результатах) - его настоящая длительность
+    return [(start_time, min(job['clip_duration'], total_duration - start_time)) for start_time in start_times]
+
+def build_units(job, video_info, windows):
+    """Задачи планировщика для клипов одной задачи манифеста: (задача, индексы окон)"""
+    source = job['source']
+    output_paths = job['output_paths']
+    has_audio = video_info.get('has_audio', True)
+
+    if job['layout'] == 'clip' and config.RENDER['mode'] == 'single_pass' and config.MULTI_CLIP['single_decode']:
+        groups = process_video.group_clip_windows(windows)
+    else:
+        groups = [[index] for index in range(len(windows))]
+
+    units = []
+    for group in groups:
+        if job['layout'] == 'clip':
+            unit = {
+                'func': process_video.render_clip_group,
+                'args': (source, [windows[i] for i in group], [output_paths[i] for i in group]),
+                'kwargs': {'has_audio': has_audio}
+            }
+        else:
+            start, duration = windows[group[0]]
+            unit = {
+                'func': render_single,
+                'args': (source, output_paths[group[0]], start, duration),
+                'kwargs': {}
+            }
+        unit['name'] = f"{job['id']}: окна {', '.join(str(i + 1) for i in group)} из {len(windows)}"
+        unit['output_seconds'] = sum(windows[i][1] for i in group)
+        units.append((unit, group))
+    return units
+
+def render_single(input_path, output_path, start_time, duration, threads=None):
+    """Один фрагмент в основной раскладке (результат - список, как у render_clip_group)"""
+    return [process_video.render_fragment(input_path, output_path, start_time, duration, threads=threads)]
+
+def run_manifest(manifest_path, results_path=None, max_workers=None):
+    """Выполнение всех задач манифеста; возвращает сводку (она же пишется в файл результатов)"""
+    raw_jobs = load_manifest(manifest_path)
+    logging.info(f"Манифест {manifest_path}: {len(raw_jobs)} задач")
+    batch_start = time.monotonic()
+
+    # Записи результатов - в порядке манифеста
+    records = [None] * len(raw_jobs)
+    jobs = []
+    unique = {}
+    for index, raw_job in enumerate(raw_jobs):
+        try:
+            job = normalize_job(raw_job, index)
+        except (ValueError, TypeError) as e:
+            logging.error(f"Задача {index + 1} пропущена: {e}")
+            job_id = raw_job.get('id', index + 1) if isinstance(raw_job, dict) else index + 1
+            records[index] = {'id': str(job_id), 'status': 'invalid', 'error': str(e)}
+            continue
+
+        key = job_key(job)
+        if key in unique:
+            logging.info(f"Задача {job['id']} совпадает с {unique[key]['id']} - не рендерится повторно")
+            records[index] = {'id': job['id'], 'status': 'duplicate', 'duplicate_of': unique[key]['id']}
+            continue
+        unique[key] = job
+        jobs.append(job)
+
+    # Задачи одного источника подряд: каталог, индекс ключевых кадров, фон и кэш страниц
+    # используются повторно, а близкие клипы попадают в общие проходы декодирования
+    jobs.sort(key=lambda job: (job['source'], MODES.index(job['mode'])))
+
+    video_infos = {}
+    pool_units = []
+    full_jobs = []
+    for job in jobs:
+        source = job['source']
+        if source not in video_infos:
+            video_info = utils.get_video_info(source)
+            if video_info and not utils.validate_crop_coordinates(video_info['width'], video_info['height']):
+                video_info = None
+            if video_info and not all(layouts.validate_template(name, video_info['width'], video_info['height'])
+                                      for name in ('main', 'clip')):
+                video_info = None
+            video_infos[source] = video_info
+        video_info = video_infos[source]
+        if not video_info:
+            job['error'] = "не удалось получить информацию о видео или некорректный кроп"
+            continue
+        try:
+            check_start_times(job, video_info)
+        except ValueError as e:
+            logging.error(f"Задача {job['id']} пропущена: {e}")
+            job['error'] = str(e)
+            job['invalid'] = True
+            continue
+
+        job['windows'] = plan_windows(job, video_info)
+        suffix = {'test': 'test', 'full': ''}.get(job['mode'])
+        if suffix is None:
+            job['output_paths'] = [
+                utils.generate_output_filename(source, suffix=f"{job['id']}_clip_{i:02d}")
+                for i in range(1, len(job['windows']) + 1)
+            ]
+        else:
+            job['output_paths'] = [utils.generate_output_filename(source, suffix=f"{job['id']}_{suffix}".rstrip('_'))]
+        job['results'] = [False] * len(job['windows'])
+
+        if job['mode'] == 'full':
+            # Полное видео само делится на сегменты и занимает весь пул - идет отдельно
+            full_jobs.append(job)
+        else:
+            pool_units.extend((job, unit, group) for unit, group in build_units(job, video_info, job['windows']))
+
+    # Клипы и тестовые фрагменты всех задач - через один общий пул
+    results = scheduler.run_jobs([unit for _, unit, _ in pool_units], max_workers=max_workers)
+    for (job, _, group), result in zip(pool_units, results):
+        for index, clip_result in zip(group, result or [False] * len(group)):
+            job['results'][index] = bool(clip_result)
+
+    for job in full_jobs:
+        job['results'] = [process_video.render_full_video(job['source'], job['output_paths'][0], job['windows'][0][1])]
+
+    for job in jobs:
+        records[job['index']] = make_record(job)
+    # Дубликатам - результаты исходной задачи
+    by_id = {job['id']: records[job['index']] for job in jobs}
+    for record in records:
+        if record['status'] == 'duplicate':
+            record['outputs'] = by_id[record['duplicate_of']].get('outputs', [])
+
+    results_path = Path(results_path) if results_path else \
+        config.OUTPUT_DIR / f"batch_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    summary = {
+        'manifest': str(Path(manifest_path).resolve()),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'wall_seconds': round(time.monotonic() - batch_start, 3),
+        'jobs': records
+    }
+    results_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    done = sum(1 for record in records if record['status'] == 'ok')
+    logging.info(f"Пакет завершен: успешно {done}/{len(records)} задач, результаты: {results_path}")
+    return summary
+
+def make_record(job):
+    """Запись задачи для файла результатов"""
+    if 'error' in job:
+        return {'id': job['id'], 'source': job['source'], 'mode': job['mode'],
+                'status': 'invalid' if job.get('invalid') else 'failed', 'error': job['error']}
+
+    outputs = [
+        {'path': str(output_path), 'start': round(start, 3), 'duration': round(duration, 3), 'ok': result}
+        for output_path, (start, duration), result in zip(job['output_paths'], job['windows'], job['results'])
+    ]
+    if all(job['results']):
+        status = 'ok'
+    elif any(job['results']):
+        status = 'partial'
+    else:
+        status = 'failed'
+    return {'id': job['id'], 'source': job['source'], 'mode': job['mode'], 'layout': job['layout'],
+            'status': status, 'outputs': outputs}
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная обработка видео по манифесту")
+    parser.add_argument('manifest', type=Path, help="Манифест задач (JSON или JSONL)")
+    parser.add_argument('--results', type=Path, help="Куда записать результаты (JSON)")
+    parser.add_argument('--max-workers', type=int, help="Максимум одновременных ffmpeg")
+    args = parser.parse_args()
+
+    utils.setup_logging()
+    utils.create_directories()
+    summary = run_manifest(args.manifest, args.results, args.max_workers)
+    # Ненулевой код - для cron и планировщиков: хоть одна задача не выполнена полностью
+    if any(record['status'] not in ('ok', 'duplicate') for record in summary['jobs']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
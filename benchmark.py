@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+import config
+import ffmpeg_runner
+
+# Воспроизводимый замер скорости рендера: синтетический источник из lavfi (testsrc2 + sine)
+# с отдельными картинками в областях игры, камеры и субтитров; каждый режим запускается
+# в отдельном процессе, чтобы CPU и память дочерних ffmpeg считались только для него
+
+MODES = ('test_clip', 'clips', 'full')
+# Способы рендера для сравнения (--render-modes)
+RENDER_MODES = ('single_pass', 'multi_step', 'compositor')
+
+# Метрики для сравнения с эталоном: True - чем больше, тем лучше
+COMPARED_METRICS = {
+    'realtime_factor': True,
+    'cpu_per_output_second': False,
+    'peak_rss_bytes': False,
+    'temp_peak_bytes': False
+}
+
+def get_source_path(duration):
+    """Путь к синтетическому источнику заданной длительности"""
+    return config.BENCHMARK['work_dir'] / 'sources' / f"synthetic_1280x720_{duration}s.mp4"
+
+def generate_source(duration):
+    """Генерация детерминированного источника 1280x720 (если его еще нет)"""
+    source_path = get_source_path(duration)
+    if source_path.exists():
+        return source_path
+    source_path.parent.mkdir(parents=True, exist_ok=True)
+
+    fps = config.OUTPUT_VIDEO['fps']
+    # Каждая область - свой тестовый узор точно по координатам из config
+    areas = [
+        (config.GAME_AREA, 'testsrc'),
+        (config.CAMERA_AREA, 'smptehdbars'),
+        (config.SUBTITLES_AREA, 'rgbtestsrc')
+    ]
+
+    cmd = [
+        'ffmpeg', '-hide_banner',
+        '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate={fps}:duration={duration}"
+    ]
+    for area, pattern in areas:
+        cmd.extend(['-f', 'lavfi', '-i', f"{pattern}=size={area['width']}x{area['height']}:rate={fps}"])
+    cmd.extend(['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}"])
+
+    parts = []
+    previous = '0:v'
+    for index, (area, _) in enumerate(areas, 1):
+        parts.append(f"[{previous}][{index}:v]overlay=x={area['x']}:y={area['y']}:shortest=1[layer{index}]")
+        previous = f"layer{index}"
+
+    temp_path = source_path.with_suffix('.tmp.mp4')
+    cmd.extend([
+        '-filter_complex', ';'.join(parts),
+        '-map', f"[{previous}]",
+        '-map', f"{len(areas) + 1}:a",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p',
+        # Фиксированный GOP, как у записи стрима
+        '-g', str(fps * 2), '-keyint_min', str(fps * 2), '-sc_threshold', '0',
+        '-c:a', 'aac',
+        '-t', str(duration),
+        '-fflags', '+bitexact',
+        '-y', str(temp_path)
+    ])
+
+    logging.info(f"Генерация синтетического источника {duration}с: {source_path}")
+    result = ffmpeg_runner.run(cmd, description="Синтетический источник")
+    if result['returncode'] != 0:
+        logging.error(f"Ошибка генерации источника: {result['stderr']}")
+        return None
+    temp_path.replace(source_path)
+    return source_path
+
+def directory_size(path):
+    """Суммарный размер файлов в папке"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class PeakUsage:
+    """Фоновый замер пикового объема временных файлов"""
+
+    def __init__(self, paths, interval=0.25):
+        self.paths = [Path(path) for path in paths]
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, sum(directory_size(path) for path in self.paths if path.exists()))
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+def run_mode(mode, source_path, duration, render_mode=None):
+    """Запуск одного режима в текущем процессе (вызывается в дочернем процессе)"""
+    import process_video
+
+    if render_mode:
+        config.RENDER['mode'] = render_mode
+    work_dir = config.BENCHMARK['work_dir']
+    temp_dir = work_dir / 'tmp'
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+    # Все артефакты замера - в его рабочей папке, чтобы не трогать input/output и каталог
+    tempfile.tempdir = str(temp_dir)
+    config.OUTPUT_DIR = work_dir / 'output' / get_result_name(mode, render_mode)
+    config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    config.CATALOG['db_path'] = work_dir / 'catalog.sqlite'
+    config.METRICS['metrics_file'] = work_dir / f"metrics_{get_result_name(mode, render_mode)}.jsonl"
+    # Замер рендера, а не копий из кэша: кэш рендеров выключен, кэши анализа и журнал сегментов -
+    # свои у каждого запуска и пустые, поэтому каждый режим считает все с нуля
+    cache_dir = work_dir / 'cache' / get_result_name(mode, render_mode)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    config.RENDER_CACHE['enabled'] = False
+    config.RENDER_CACHE['dir'] = cache_dir / 'renders'
+    config.JOURNAL['work_dir'] = cache_dir / 'journal'
+    for settings, name in ((config.AUDIO_ANALYSIS, 'audio'), (config.SCENE_INDEX, 'scenes'),
+                           (config.REGION_DETECTION, 'regions'), (config.CAMERA_TRACKING, 'tracks')):
+        settings['cache_dir'] = cache_dir / name
+    random.seed(config.BENCHMARK['seed'])
+
+    if mode == 'test_clip':
+        output_seconds = min(config.TEST_FRAGMENT['duration'], duration)
+        action = lambda: process_video.process_video(source_path, test_mode=True)
+    elif mode == 'clips':
+        num_clips = config.BENCHMARK['num_clips']
+        clip_duration = config.BENCHMARK['clip_duration']
+        output_seconds = num_clips * clip_duration
+        action = lambda: process_video.create_multiple_clips(source_path, num_clips, clip_duration)
+    else:
+        output_seconds = duration
+        action = lambda: process_video.process_video(source_path)
+
+    with PeakUsage([temp_dir, config.INTERMEDIATE['ram_dir']]) as usage:
+        start = time.monotonic()
+        ok = bool(action())
+        wall_seconds = time.monotonic() - start
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = children.ru_utime + children.ru_stime + own.ru_utime + own.ru_stime
+
+    return {
+        'ok': ok,
+        'wall_seconds': round(wall_seconds, 3),
+        'output_seconds': output_seconds,
+        'realtime_factor': round(output_seconds / wall_seconds, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'cpu_per_output_second': round(cpu_seconds / output_seconds, 3),
+        # ru_maxrss в килобайтах; для детей - самый большой из процессов ffmpeg
+        'peak_rss_bytes': max(children.ru_maxrss, own.ru_maxrss) * 1024,
+        'temp_peak_bytes': usage.peak,
+        'output_bytes': directory_size(config.OUTPUT_DIR)
+    }
+
+def get_result_name(mode, render_mode=None):
+    """Имя результата: режим, а при сравнении способов рендера - режим/способ"""
+    return f"{mode}_{render_mode}" if render_mode else mode
+
+def run_mode_process(mode, source_path, duration, render_mode=None):
+    """Запуск режима в отдельном процессе python"""
+    name = get_result_name(mode, render_mode)
+    result_path = config.BENCHMARK['work_dir'] / f"result_{name}.json"
+    result_path.unlink(missing_ok=True)
+
+    cmd = [sys.executable, str(Path(__file__).resolve()), '--child', mode,
+           '--source', str(source_path), '--duration', str(duration), '--result', str(result_path)]
+    if render_mode:
+        cmd.extend(['--render-mode', render_mode])
+    logging.info(f"Замер режима: {name}")
+    completed = subprocess.run(cmd)
+    if completed.returncode != 0 or not result_path.exists():
+        logging.error(f"Режим {name} завершился с ошибкой (код {completed.returncode})")
+        return {'ok': False}
+
+    return json.loads(result_path.read_text())
+
+def get_ffmpeg_version():
+    """Первая строка ffmpeg -version"""
+    result = ffmpeg_runner.run(['ffmpeg', '-version'], description="ffmpeg -version", capture_stdout=True)
+    if result['returncode'] != 0:
+        return None
+    return result['stdout'].decode(errors='replace').splitlines()[0]
+
+def collect_environment():
+    """Настройки и машина, от которых зависят цифры"""
+    return {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': get_ffmpeg_version(),
+        'render_mode': config.RENDER['mode'],
+        'intermediate_transport': config.INTERMEDIATE['transport'],
+        'cutting_mode': config.CUTTING['mode'],
+        'single_decode': config.MULTI_CLIP['single_decode'],
+        'cpu_budget': config.PARALLEL['cpu_budget'],
+        'ffmpeg_params': config.FFMPEG_PARAMS
+    }
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Сравнение с эталоном: список регрессий (режим, метрика, было, стало)"""
+    regressions = []
+    for mode, current in results['modes'].items():
+        reference = baseline.get('modes', {}).get(mode)
+        if not reference or not current.get('ok') or not reference.get('ok'):
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before = reference.get(metric)
+            after = current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append((mode, metric, before, after))
+    return regressions
+
+def log_report(results):
+    """Сводка замера в лог"""
+    for mode, result in results['modes'].items():
+        if not result.get('ok'):
+            logging.info(f"{mode}: ошибка")
+            continue
+        logging.info(
+            f"{mode}: {result['wall_seconds']:.1f}с, {result['realtime_factor']:.2f}x реального времени, "
+            f"CPU {result['cpu_per_output_second']:.2f}с на секунду результата, "
+            f"память {result['peak_rss_bytes'] / 1024 ** 2:.0f}МБ, "
+            f"временные файлы {result['temp_peak_bytes'] / 1024 ** 2:.0f}МБ"
+        )
+
+def main():
+    benchmark = config.BENCHMARK
+    parser = argparse.ArgumentParser(description="Замер скорости рендера на синтетическом видео")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help="Какие режимы замерять")
+    parser.add_argument('--render-modes', nargs='+', choices=RENDER_MODES,
+                        help="Сравнить способы рендера (RENDER['mode']): каждый режим замеряется с каждым")
+    parser.add_argument('--duration', type=int, default=benchmark['source_duration'], help="Длительность источника, сек")
+    parser.add_argument('--output', type=Path, help="Куда сохранить результаты (JSON)")
+    parser.add_argument('--baseline', type=Path, default=benchmark['baseline_file'], help="Эталон для сравнения")
+    parser.add_argument('--save-baseline', action='store_true', help="Сохранить результаты как новый эталон")
+    parser.add_argument('--tolerance', type=float, default=benchmark['tolerance'], help="Допустимое ухудшение (доля)")
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--source', type=Path, help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=Path, help=argparse.SUPPRESS)
+    parser.add_argument('--render-mode', choices=RENDER_MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.child:
+        result = run_mode(args.child, args.source, args.duration, args.render_mode)
+        args.result.write_text(json.dumps(result))
+        return
+
+    source_path = generate_source(args.duration)
+    if not source_path:
+        sys.exit(1)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'source': {'path': str(source_path), 'duration': args.duration, 'width': 1280, 'height': 720},
+        'environment': collect_environment(),
+        'modes': {
+            get_result_name(mode, render_mode): run_mode_process(mode, source_path, args.duration, render_mode)
+            for mode in args.modes for render_mode in (args.render_modes or [None])
+        }
+    }
+    log_report(results)
+
+    output_path = args.output or benchmark['work_dir'] / f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_path.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    logging.info(f"Результаты: {output_path}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+        logging.info(f"Эталон сохранен: {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        logging.info("Эталона нет - сравнение пропущено (сохранить: --save-baseline)")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get('source', {}).get('duration') != args.duration:
+        logging.warning("Эталон снят на источнике другой длительности - сравнение может быть некорректным")
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for mode, metric, before, after in regressions:
+        logging.error(f"Регрессия {mode}: {metric} {before} -> {after}")
+    if regressions:
+        sys.exit(1)
+    logging.info(f"Регрессий нет (допуск {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import os
+import time
+import logging
+import config
+import render_cache
+import ffmpeg_runner
+from ffmpeg_runner import get_ffmpeg_command
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Слежение за лицом в области камеры: ffmpeg отдает через pipe уменьшенные кадры CAMERA_AREA
+# с низкой частотой, по ним ищется лицо (OpenCV) или центр движения (numpy). Траектория всего
+# источника кэшируется по отпечатку содержимого, сглаживается целиком (сегменты и клипы стыкуются
+# без скачков) и превращается в команды sendcmd для кропа камеры: окно кропа двигается за лицом
+
+# Кадров анализа за одно чтение из pipe (и окно фона для детектора движения)
+CHUNK_FRAMES = 300
+# Разница с фоном меньше - шум кодека, не движение
+MOTION_NOISE = 8
+# Кадр без движения: средняя разница с фоном (после вычета шума) меньше
+MIN_MOTION = 0.5
+# Голова - верх движущейся фигуры: y - эта доля движения по высоте сверху
+HEAD_QUANTILE = 0.3
+
+def is_available():
+    """Слежение возможно: включено в config и установлен numpy"""
+    if not config.CAMERA_TRACKING['enabled']:
+        return False
+    if np is None:
+        logging.warning("numpy не установлен - кроп камеры неподвижный (pip install numpy)")
+        return False
+    return True
+
+def get_detector():
+    """Детектор: 'face' (нужен OpenCV) или 'motion'"""
+    detector = config.CAMERA_TRACKING['detector']
+    if detector == 'auto':
+        return 'face' if cv2 is not None else 'motion'
+    if detector == 'face' and cv2 is None:
+        logging.warning("OpenCV не установлен - слежение по движению (pip install opencv-python-headless)")
+        return 'motion'
+    return detector
+
+def get_settings():
+    """Настройки слежения для ключа кэша рендера; None - слежение выключено"""
+    if not is_available():
+        return None
+    return [config.CAMERA_TRACKING, get_detector()]
+
+def get_cache_path(input_path):
+    """Файл кэша траектории: отпечаток источника, область камеры и параметры анализа"""
+    tracking = config.CAMERA_TRACKING
+    area = config.CAMERA_AREA
+    fingerprint = render_cache.source_fingerprint(input_path)
+    return tracking['cache_dir'] / (
+        f"{fingerprint}_{area['x']}_{area['y']}_{area['width']}x{area['height']}"
+        f"_{get_detector()}_{tracking['width']}_{tracking['fps']}.npz"
+    )
+
+def get_window_size():
+    """Размер окна кропа: доля zoom от CAMERA_AREA, четный"""
+    area = config.CAMERA_AREA
+    zoom = config.CAMERA_TRACKING['zoom']
+    return int(area['width'] * zoom) // 2 * 2, int(area['height'] * zoom) // 2 * 2
+
+def detect_faces(frames):
+    """Центры самого большого лица в каждом кадре (доли ширины и высоты), NaN - лица нет"""
+    height, width = frames.shape[1:]
+    classifier = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    min_size = max(8, width // 10)
+    centers = np.full((len(frames), 2), np.nan, dtype=np.float32)
+    for index, frame in enumerate(frames):
+        faces = classifier.detectMultiScale(frame, scaleFactor=1.1, minNeighbors=4, minSize=(min_size, min_size))
+        if len(faces):
+            x, y, face_width, face_height = max(faces, key=lambda face: face[2] * face[3])
+            centers[index] = ((x + face_width / 2) / width, (y + face_height / 2) / height)
+    return centers
+
+def detect_motion(frames):
+    """Центры движения в каждом кадре (доли ширины и высоты), NaN - движения нет
+
+    Фон - медиана пачки кадров, движение - разница с фоном сверх шума. x - центр масс движения,
+    y - верх фигуры (HEAD_QUANTILE), где обычно голова.
+    """
+    height, width = frames.shape[1:]
+    background = np.median(frames, axis=0)
+    motion = np.maximum(np.abs(frames.astype(np.float32) - background) - MOTION_NOISE, 0)
+
+    columns = motion.sum(axis=1)
+    rows = motion.sum(axis=2)
+    total = columns.sum(axis=1)
+    valid = total / (width * height) >= MIN_MOTION
+    total = np.maximum(total, 1e-6)
+
+    center_x = (columns @ (np.arange(width) + 0.5)) / total / width
+    head_row = np.argmax(np.cumsum(rows, axis=1) >= HEAD_QUANTILE * total[:, None], axis=1)
+    center_y = (head_row + 0.5) / height
+    centers = np.stack((center_x, center_y), axis=1).astype(np.float32)
+    centers[~valid] = np.nan
+    return centers
+
+def build_track(input_path):
+    """Центры лица по кадрам анализа через ffmpeg -> rawvideo gray в pipe; None - ошибка"""
+    tracking = config.CAMERA_TRACKING
+    area = config.CAMERA_AREA
+    width = tracking['width']
+    height = int(width * area['height'] / area['width']) // 2 * 2
+    cmd = [
+        get_ffmpeg_command(),
+        '-v', 'error',
+        # Для картинки шириной в сотню пикселей деблокинг и кадры без ссылок не нужны
+        '-skip_loop_filter', 'all',
+        '-skip_frame', 'noref',
+        '-an', '-sn', '-dn',
+        '-i', str(input_path),
+        '-map', '0:v:0',
+        '-vf', (
+            f"crop={area['width']}:{area['height']}:{area['x']}:{area['y']},fps={tracking['fps']},"
+            f"scale={width}:{height}:flags=area,format=gray"
+        ),
+        '-f', 'rawvideo',
+        'pipe:1'
+    ]
+
+    detect = detect_faces if get_detector() == 'face' else detect_motion
+    frame_bytes = width * height
+    centers = []
+
+    def handle_chunk(data):
+        count = len(data) // frame_bytes
+        if count:
+            centers.append(detect(np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, height, width)))
+
+    result = ffmpeg_runner.run(cmd, description="Слежение за камерой", progress=True,
+                               stdout_handler=handle_chunk, stdout_chunk_size=frame_bytes * CHUNK_FRAMES)
+    if result['returncode'] != 0 or not centers:
+        logging.error(f"Ошибка слежения за камерой {input_path}: {result['timed_out'] or result['stderr'].strip()}")
+        return None
+    return np.concatenate(centers)
+
+def get_track(input_path):
+    """Центры лица источника по кадрам анализа (из кэша или через ffmpeg); None - недоступно"""
+    cache_path = get_cache_path(input_path)
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                return cached['centers']
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Кэш слежения за камерой поврежден, считаем заново: {cache_path}: {e}")
+
+    logging.info(f"Слежение за камерой ({get_detector()}): {input_path}")
+    track_start = time.monotonic()
+    centers = build_track(input_path)
+    if centers is None:
+        return None
+
+    elapsed = time.monotonic() - track_start
+    video_seconds = len(centers) / config.CAMERA_TRACKING['fps']
+    found = np.isfinite(centers[:, 0]).mean()
+    logging.info(
+        f"Слежение за камерой: {video_seconds:.0f}с видео за {elapsed:.2f}с "
+        f"({video_seconds / max(elapsed, 1e-6):.0f}x реального времени), лицо найдено в {found:.0%} кадров"
+    )
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, centers=centers)
+    os.replace(temp_path, cache_path)
+    return centers
+
+def smooth_track(centers):
+    """Траектория без пропусков и дрожания: пропуски - интерполяция, затем гауссово сглаживание
+
+    None - лицо не найдено ни в одном кадре.
+    """
+    found = np.flatnonzero(np.isfinite(centers[:, 0]))
+    if not len(found):
+        return None
+    indices = np.arange(len(centers))
+    filled = np.stack([np.interp(indices, found, centers[found, axis]) for axis in range(2)], axis=1)
+
+    sigma = config.CAMERA_TRACKING['smoothing'] * config.CAMERA_TRACKING['fps']
+    if sigma <= 0:
+        return filled
+    radius = int(3 * sigma)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    # Края продлеваются последним значением: в начале и конце окно не тянется к нулю
+    padded = np.pad(filled, ((radius, radius), (0, 0)), mode='edge')
+    return np.stack([np.convolve(padded[:, axis], kernel, mode='valid') for axis in range(2)], axis=1)
+
+def get_crop_positions(input_path, start_time, duration):
+    """Положения окна кропа (время от start_time, x, y) с частотой вывода, только при смене; None - слежения нет"""
+    if not is_available():
+        return None
+    centers = get_track(input_path)
+    if centers is None:
+        return None
+    track = smooth_track(centers)
+    if track is None:
+        logging.warning(f"Лицо в области камеры не найдено, кроп неподвижный: {input_path}")
+        return None
+
+    area = config.CAMERA_AREA
+    window_width, window_height = get_window_size()
+    times = np.arange(0, duration, 1 / config.OUTPUT_VIDEO['fps'])
+    track_times = (np.arange(len(track)) + 0.5) / config.CAMERA_TRACKING['fps']
+    center_x = np.interp(start_time + times, track_times, track[:, 0]) * area['width']
+    center_y = np.interp(start_time + times, track_times, track[:, 1]) * area['height']
+    # Окно не выходит за CAMERA_AREA; четные координаты - без сдвига цветности в yuv420p
+    xs = area['x'] + np.clip(center_x - window_width / 2, 0, area['width'] - window_width).astype(np.int64) // 2 * 2
+    ys = area['y'] + np.clip(center_y - window_height / 2, 0, area['height'] - window_height).astype(np.int64) // 2 * 2
+
+    changed = np.concatenate(([True], (np.diff(xs) != 0) | (np.diff(ys) != 0)))
+    return [(float(time_point), int(x), int(y)) for time_point, x, y in zip(times[changed], xs[changed], ys[changed])]
+
+def write_commands(commands_path, target, positions):
+    """Файл sendcmd: в момент каждой смены положения - новые x и y фильтра crop@target"""
+    commands_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = commands_path.with_name(f".{commands_path.name}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as commands_file:
+        for time_point, x, y in positions:
+            commands_file.write(f"{time_point:.3f} crop@{target} x {x}, crop@{target} y {y};\n")
+    os.replace(temp_path, commands_path)
+
+def track_geometry(geometry, input_path, start_time, duration, label_prefix=''):
+    """Геометрия, где область камеры - движущееся окно кропа (area - окно в первом кадре,
+    commands - файл sendcmd для фильтра crop@<label_prefix><имя>); без слежения - та же геометрия
+
+    Время команд отсчитывается от start_time: в графе кроп стоит после seek или trim.
+    """
+    positions = get_crop_positions(input_path, start_time, duration)
+    if not positions:
+        return geometry
+    window_width, window_height = get_window_size()
+    tracked = []
+    for region in geometry:
+        if region['area'] == config.CAMERA_AREA:
+            target = f"{label_prefix}{region['name']}"
+            commands_path = config.CAMERA_TRACKING['cache_dir'] / (
+                f"{get_cache_path(input_path).stem}_{start_time:.3f}_{duration:.3f}_{target}.cmd"
+            )
+            write_commands(commands_path, target, positions)
+            _, x, y = positions[0]
+            region = dict(region, area={'x': x, 'y': y, 'width': window_width, 'height': window_height},
+                          commands=commands_path)
+        tracked.append(region)
+    return tracked
+
+def get_crop_filter(region, label_prefix=''):
+    """Фильтры кропа области: неподвижный crop или sendcmd и crop@<имя>, который двигают команды"""
+    area = region['area']
+    crop = f"crop={area['width']}:{area['height']}:{area['x']}:{area['y']}"
+    if 'commands' not in region:
+        return crop
+    return f"sendcmd=f='{region['commands']}',crop@{label_prefix}{region['name']}={crop[len('crop='):]}"
@@ -0,0 +1,246 @@
+import os
+import time
+import json
+import asyncio
+import logging
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+import config
+import ffmpeg_runner
+
+# Каталог медиафайлов: метаданные ffprobe хранятся в SQLite и берутся оттуда,
+# пока у файла не изменились размер и время изменения
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    fps TEXT,
+    codec TEXT,
+    keyframe_interval REAL,
+    has_audio INTEGER,
+    probed_at REAL
+);
+CREATE INDEX IF NOT EXISTS media_directory ON media (directory, mtime_ns);
+CREATE TABLE IF NOT EXISTS keyframes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    times TEXT NOT NULL
+);
+"""
+
+@contextmanager
+def connect():
+    """Подключение к базе каталога на блок with: в конце commit (при ошибке - rollback) и закрытие
+
+    Внутри блока не должно быть долгих вызовов (ffprobe): после первой записи база заблокирована
+    для остальных процессов до commit.
+    """
+    connection = sqlite3.connect(config.CATALOG['db_path'], timeout=30)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def get_ffprobe_command():
+    """Используем локальный ffprobe если он есть"""
+    ffprobe_path = Path(__file__).parent / 'ffprobe'
+    if ffprobe_path.exists():
+        return str(ffprobe_path)
+    return 'ffprobe'
+
+async def probe_keyframe_times_async(video_path, read_seconds=None):
+    """Времена ключевых кадров видео по пакетам ffprobe (без декодирования)"""
+    cmd = [
+        get_ffprobe_command(),
+        '-v', 'quiet',
+        '-select_streams', 'v:0',
+    ]
+    if read_seconds:
+        cmd.extend(['-read_intervals', f"%+{read_seconds}"])
+    cmd.extend([
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        str(video_path)
+    ])
+
+    try:
+        result = await ffmpeg_runner.run_async(cmd, f"Ключевые кадры: {video_path}", capture_stdout=True)
+    except Exception as e:
+        logging.error(f"Ошибка получения ключевых кадров {video_path}: {e}")
+        return None
+    if result['returncode'] != 0:
+        return None
+
+    keyframe_times = []
+    for line in result['stdout'].decode(errors='replace').splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframe_times.append(float(pts_time))
+
+    return sorted(keyframe_times)
+
+def probe_keyframe_times(video_path, read_seconds=None):
+    """Синхронная версия probe_keyframe_times_async"""
+    return asyncio.run(probe_keyframe_times_async(video_path, read_seconds))
+
+async def probe_keyframe_interval(video_path):
+    """Средний интервал между ключевыми кадрами по первым секундам видео"""
+    keyframe_times = await probe_keyframe_times_async(video_path, config.CATALOG['keyframe_probe_seconds'])
+    if not keyframe_times or len(keyframe_times) < 2:
+        return None
+    return (keyframe_times[-1] - keyframe_times[0]) / (len(keyframe_times) - 1)
+
+async def probe_video_async(video_path):
+    """Получение информации о видео через ffprobe"""
+    try:
+        cmd = [
+            get_ffprobe_command(),
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format',
+            '-show_streams',
+            str(video_path)
+        ]
+
+        result = await ffmpeg_runner.run_async(cmd, f"ffprobe: {video_path}", capture_stdout=True)
+        if result['returncode'] != 0:
+            logging.error(f"Ошибка ffprobe: {result['stderr']}")
+            return None
+
+        info = json.loads(result['stdout'])
+
+        # Ищем видео поток
+        video_stream = None
+        for stream in info['streams']:
+            if stream['codec_type'] == 'video':
+                video_stream = stream
+                break
+
+        if not video_stream:
+            logging.error(f"Видео поток не найден: {video_path}")
+            return None
+
+        return {
+            'duration': float(info['format']['duration']),
+            'width': int(video_stream['width']),
+            'height': int(video_stream['height']),
+            'fps': video_stream.get('r_frame_rate', '30/1'),
+            'has_audio': any(stream['codec_type'] == 'audio' for stream in info['streams']),
+            'codec': video_stream.get('codec_name'),
+            'keyframe_interval': await probe_keyframe_interval(video_path)
+        }
+
+    except Exception as e:
+        logging.error(f"Ошибка получения информации о видео {video_path}: {e}")
+        return None
+
+def probe_video(video_path):
+    """Синхронная версия probe_video_async"""
+    return asyncio.run(probe_video_async(video_path))
+
+async def probe_many(video_paths):
+    """Параллельные ffprobe из одного event loop, не больше CATALOG['probe_workers'] одновременно"""
+    semaphore = asyncio.Semaphore(config.CATALOG['probe_workers'])
+
+    async def probe_one(video_path):
+        async with semaphore:
+            return await probe_video_async(video_path)
+
+    return await asyncio.gather(*(probe_one(video_path) for video_path in video_paths))
+
+def row_to_info(row):
+    """Запись каталога в словарь, совместимый с utils.get_video_info"""
+    return {
+        'duration': row['duration'],
+        'width': row['width'],
+        'height': row['height'],
+        'fps': row['fps'],
+        'has_audio': bool(row['has_audio']),
+        'codec': row['codec'],
+        'keyframe_interval': row['keyframe_interval'],
+        'size': row['size']
+    }
+
+def store(connection, video_path, stat, info):
+    """Сохранение результата ffprobe в каталог"""
+    video_path = Path(video_path).resolve()
+    connection.execute(
+        """INSERT OR REPLACE INTO media
+           (path, directory, name, size, mtime_ns, duration, width, height, fps, codec,
+            keyframe_interval, has_audio, probed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (str(video_path), str(video_path.parent), video_path.name, stat.st_size, stat.st_mtime_ns,
+         info['duration'], info['width'], info['height'], info['fps'], info['codec'],
+         info['keyframe_interval'], int(info['has_audio']), time.time())
+    )
+
+def get_video_info(video_path):
+    """Информация о видео из каталога; ffprobe вызывается только для новых или измененных файлов"""
+    video_path = Path(video_path).resolve()
+    stat = video_path.stat()
+
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT * FROM media WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (str(video_path), stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+    if row:
+        return row_to_info(row)
+
+    info = probe_video(video_path)
+    if info:
+        with connect() as connection:
+            store(connection, video_path, stat, info)
+        info['size'] = stat.st_size
+    return info
+
+def sync_directory(directory):
+    """Инкрементальное обновление каталога папки: новые и измененные файлы пробуются параллельно,
+    удаленные - убираются. Возвращает список (путь, mtime_ns) видео в папке"""
+    directory = Path(directory).resolve()
+    if not directory.exists():
+        return []
+
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and Path(entry.name).suffix.lower() in config.SUPPORTED_FORMATS:
+                found[entry.path] = entry.stat()
+
+    with connect() as connection:
+        known = {
+            row['path']: (row['size'], row['mtime_ns'])
+            for row in connection.execute("SELECT path, size, mtime_ns FROM media WHERE directory = ?", (str(directory),))
+        }
+
+        missing = [path for path in known if path not in found]
+        if missing:
+            connection.executemany("DELETE FROM media WHERE path = ?", [(path,) for path in missing])
+
+    changed = [
+        path for path, stat in found.items()
+        if known.get(path) != (stat.st_size, stat.st_mtime_ns)
+    ]
+
+    if changed:
+        # ffprobe - без открытой транзакции, результаты пишутся одной короткой транзакцией
+        logging.info(f"Каталог: {len(changed)} новых/измененных файлов в {directory}, пробуем параллельно")
+        infos = asyncio.run(probe_many(changed))
+        with connect() as connection:
+            for path, info in zip(changed, infos):
+                if info:
+                    store(connection, path, found[path], info)
+
+    return [(Path(path), stat.st_mtime_ns) for path, stat in found.items()]
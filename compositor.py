@@ -0,0 +1,170 @@
+import os
+import queue
+import logging
+import importlib
+import threading
+import config
+import camera_tracking
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Компоновка вертикального кадра в Python вместо цепочки overlay: декодер отдает все области
+# одним кадром-атласом (области друг под другом) в rawvideo, они копируются в заранее выделенный
+# кадр результата, и он уходит в pipe энкодера. Фон кладется в кадр один раз: области каждый раз
+# перезаписывают одни и те же места, поэтому за кадр копируются только пиксели областей.
+# Свои эффекты раскладки - подкласс Compositor с другим compose (COMPOSITOR['engine'])
+
+# Формат кадров в pipe: три плоскости полного размера, области можно ставить на любые координаты
+PIXEL_FORMAT = 'yuv444p'
+PLANES = 3
+
+def is_available():
+    """Компоновщик возможен: установлен numpy"""
+    if np is None:
+        logging.warning("numpy не установлен - рендер через компоновщик недоступен (pip install numpy)")
+        return False
+    return True
+
+def get_atlas_layout(geometry):
+    """Места областей в атласе: {имя: y}, и размер атласа (ширина, высота)"""
+    width = max(region['size'][0] for region in geometry)
+    offsets = {}
+    height = 0
+    for region in geometry:
+        offsets[region['name']] = height
+        height += region['size'][1]
+    return offsets, (width, height)
+
+def build_atlas_filter(geometry, source_input, fps):
+    """filter_complex декодера: кроп и масштаб каждой области, все области друг под другом -> [atlas]"""
+    _, (atlas_width, _) = get_atlas_layout(geometry)
+    # Частота выравнивается до split: после vstack фильтр fps теряет последний кадр
+    parts = [f"[{source_input}]fps={fps},split={len(geometry)}" + ''.join(f"[{region['name']}_src]" for region in geometry)]
+    for region in geometry:
+        width, height = region['size']
+        chain = f"[{region['name']}_src]{camera_tracking.get_crop_filter(region)},scale={width}:{height}"
+        if width < atlas_width:
+            chain += f",pad={atlas_width}:{height}:0:0"
+        parts.append(f"{chain}[{region['name']}]")
+    inputs = ''.join(f"[{region['name']}]" for region in geometry)
+    stack = f"{inputs}vstack=inputs={len(geometry)}" if len(geometry) > 1 else f"{inputs}null"
+    parts.append(f"{stack},format={PIXEL_FORMAT}[atlas]")
+    return ';'.join(parts)
+
+class Compositor:
+    """Базовый компоновщик: области кладутся на фон как есть (как overlay без прозрачности)
+
+    frame - кадр результата (плоскости, высота, ширина), выделяется один раз.
+    Подкласс может переопределить compose: кадр нужно собрать в self.frame без новых буферов.
+    """
+
+    def __init__(self, geometry, canvas, background):
+        width, height = canvas
+        self.geometry = geometry
+        self.frame = np.empty((PLANES, height, width), dtype=np.uint8)
+        np.copyto(self.frame, background)
+        offsets, _ = get_atlas_layout(geometry)
+
+        # Прямоугольники копирования: часть области, попадающая в кадр (как обрезает overlay)
+        self.placements = []
+        for region in geometry:
+            region_width, region_height = region['size']
+            x, y = region['position']['x'], region['position']['y']
+            left, top = max(0, x), max(0, y)
+            right, bottom = min(width, x + region_width), min(height, y + region_height)
+            if left >= right or top >= bottom:
+                continue
+            atlas_y = offsets[region['name']]
+            self.placements.append((
+                (slice(None), slice(top, bottom), slice(left, right)),
+                (slice(None), slice(atlas_y + top - y, atlas_y + bottom - y), slice(left - x, right - x))
+            ))
+        # Представления для каждого буфера атласа считаются один раз
+        self.views = {}
+
+    def get_views(self, atlas):
+        """Пары (куда, откуда) для буфера атласа"""
+        views = self.views.get(id(atlas))
+        if views is None:
+            views = [(self.frame[target], atlas[source]) for target, source in self.placements]
+            self.views[id(atlas)] = views
+        return views
+
+    def compose(self, atlas, frame_index):
+        """Сборка кадра результата из кадра-атласа"""
+        for target, source in self.get_views(atlas):
+            np.copyto(target, source)
+
+def load_engine():
+    """Класс компоновщика из COMPOSITOR['engine'] ('модуль.Класс')"""
+    module_name, _, class_name = config.COMPOSITOR['engine'].rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+def read_exact(source, buffer):
+    """Заполнить буфер из pipe целиком; False - поток закончился"""
+    view = memoryview(buffer).cast('B')
+    filled = 0
+    while filled < len(view):
+        count = source.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+def write_all(target, buffer):
+    """Записать буфер в pipe целиком"""
+    view = memoryview(buffer).cast('B')
+    written = 0
+    while written < len(view):
+        written += target.write(view[written:])
+
+def run_compose_loop(read_fd, write_fd, atlas_size, compositor):
+    """Чтение атласов из read_fd, сборка и запись кадров в write_fd; возвращает число кадров
+
+    Чтение идет в отдельном потоке в кольцо из COMPOSITOR['buffers'] буферов: декодер,
+    компоновка и энкодер работают одновременно, новые буферы на кадр не выделяются.
+    """
+    atlas_width, atlas_height = atlas_size
+    buffers = [np.empty((PLANES, atlas_height, atlas_width), dtype=np.uint8) for _ in range(config.COMPOSITOR['buffers'])]
+    free = queue.Queue()
+    filled = queue.Queue()
+    for index in range(len(buffers)):
+        free.put(index)
+    stop = threading.Event()
+
+    source = os.fdopen(read_fd, 'rb', buffering=0)
+    target = os.fdopen(write_fd, 'wb', buffering=0)
+
+    def read_frames():
+        try:
+            while not stop.is_set():
+                index = free.get()
+                if index is None or not read_exact(source, buffers[index]):
+                    break
+                filled.put(index)
+        finally:
+            filled.put(None)
+
+    reader = threading.Thread(target=read_frames, daemon=True)
+    reader.start()
+    frames = 0
+    try:
+        while True:
+            index = filled.get()
+            if index is None:
+                break
+            compositor.compose(buffers[index], frames)
+            free.put(index)
+            write_all(target, compositor.frame)
+            frames += 1
+    finally:
+        # Энкодер получает EOF; поток чтения останавливается, после чего декодер получает EPIPE
+        target.close()
+        stop.set()
+        free.put(None)
+        reader.join()
+        source.close()
+    return frames
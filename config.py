@@ -6,6 +6,7 @@ PROJECT_ROOT = Path(__file__).parent
 INPUT_DIR = PROJECT_ROOT / "input"
 OUTPUT_DIR = PROJECT_ROOT / "output"
 TEST_DIR = PROJECT_ROOT / "test"
+CACHE_DIR = PROJECT_ROOT / "cache"  # Кэши: подготовленные фоны и т.п.
 
 # Области для обрезки из горизонтального видео
 GAME_AREA = {
@@ -35,6 +36,34 @@ LAYOUT = {
     'subtitles_position': {'x': 0, 'y': 1051}  # Субтитры внизу (596 + 455)
 }
 
+# Шаблоны раскладки: какие области источника (source: game, camera, subtitles) куда и какого размера
+# ставить в кадр результата. arrange: 'absolute' - по position; 'stack' - друг под другом по ширине кадра.
+# width: число, 'canvas' (ширина кадра) или размер кропа; height: число, 'area' (высота кропа) или по
+# пропорциям кропа. z - порядок наложения (больше - выше), при равенстве - порядок в списке
+LAYOUT_TEMPLATES = {
+    # Основное видео: камера по ширине кадра, игра в исходном размере, субтитры растянуты по ширине
+    'main': {
+        'arrange': 'absolute',
+        'regions': [
+            {'source': 'camera', 'position': LAYOUT['camera_position'], 'width': 'canvas'},
+            {'source': 'subtitles', 'position': LAYOUT['subtitles_position'], 'width': 'canvas', 'height': 'area'},
+            {'source': 'game', 'position': LAYOUT['game_position'], 'z': 1}
+        ]
+    },
+    # Клипы: камера, игра и субтитры по ширине кадра без искажения пропорций
+    'clip': {
+        'arrange': 'stack',
+        'align': 'center',
+        'regions': [{'source': 'camera'}, {'source': 'game'}, {'source': 'subtitles'}]
+    },
+    # Для профилей других форматов (OUTPUT_PROFILES)
+    'stack': {
+        'arrange': 'stack',
+        'align': 'center',
+        'regions': [{'source': 'camera'}, {'source': 'game'}, {'source': 'subtitles'}]
+    }
+}
+
 # Параметры FFmpeg
 FFMPEG_PARAMS = {
     'preset': 'ultrafast',
@@ -42,12 +71,237 @@ FFMPEG_PARAMS = {
     'codec': 'libx264'
 }
 
+# Режим рендера: 'single_pass' - один ffmpeg, кроп областей внутри filter_complex,
+# 'multi_step' - старый путь через временные файлы (фрагмент -> три кропа -> склейка),
+# 'compositor' - области собираются в кадр в Python (compositor.py, нужен numpy)
+RENDER = {
+    'mode': 'single_pass',
+    'fallback_to_multi_step': True,  # При ошибке однопроходного рендера пробовать старый путь
+    'profiles': None                 # Список профилей из OUTPUT_PROFILES - все форматы одним ffmpeg
+                                     # (например ['vertical', 'feed', 'square']); None - только OUTPUT_VIDEO
+}
+
+# Компоновщик кадров (RENDER['mode'] = 'compositor')
+COMPOSITOR = {
+    'engine': 'compositor.Compositor',  # Класс компоновки 'модуль.Класс' - подкласс Compositor для своих эффектов
+    'buffers': 3                        # Сколько кадров-атласов декодер может опережать компоновку
+}
+
+# Форматы вывода для рендера в несколько форматов сразу.
+# layout: шаблон из LAYOUT_TEMPLATES, собранный под размер профиля ('stack' - области друг под другом);
+# 'default' - раскладка основного видео или клипов (рассчитана на размер OUTPUT_VIDEO)
+OUTPUT_PROFILES = {
+    'vertical': {'width': 1080, 'height': 1920, 'layout': 'default'},  # 9:16 - Shorts, TikTok
+    'feed': {'width': 1080, 'height': 1350, 'layout': 'stack'},        # 4:5 - лента Instagram
+    'square': {'width': 1080, 'height': 1080, 'layout': 'stack'}       # 1:1
+}
+
+# Параллельный рендер клипов
+PARALLEL = {
+    'cpu_budget': None,       # Сколько ядер отдавать под рендер (None - все доступные процессу)
+    'max_workers': None,      # Максимум одновременных ffmpeg (None - по бюджету ядер)
+    'min_threads_per_job': 3, # Минимум потоков ffmpeg на одну задачу (декодер, фильтры и энкодер - хотя бы по одному)
+    # Как потоки сверх минимума делятся между декодированием, графом фильтров и кодированием
+    'thread_shares': {'decoder': 1, 'filter': 1, 'encoder': 2}
+}
+
+# Несколько клипов за одно декодирование источника (в режиме single_pass)
+MULTI_CLIP = {
+    'single_decode': True,     # Резать близкие клипы из одного прохода по источнику
+    'max_gap': 60,             # Максимальный разрыв между клипами в одном проходе, сек (дальше - новый seek)
+    'max_clips_per_pass': 8    # Сколько клипов максимум кодируется одним процессом ffmpeg
+}
+
+# Параллельный рендер полного видео по сегментам (границы - ключевые кадры)
+# Только для RENDER['mode'] = 'single_pass': в других режимах полное видео рендерится целиком
+SEGMENTED = {
+    'enabled': True,
+    'min_duration': 300,      # Резать на сегменты видео не короче, сек
+    'segment_duration': 60    # Целевая длина сегмента, сек (граница сдвигается на ключевой кадр)
+}
+
+# Журнал рендера по сегментам: после падения повторный запуск продолжает с готовых сегментов
+JOURNAL = {
+    'work_dir': OUTPUT_DIR / ".work",  # Сегменты и журнал незавершенных рендеров
+    'verify_checksums': True           # Проверять sha256 готовых сегментов перед повторным использованием
+}
+
+# Промежуточные данные многошагового рендера
+INTERMEDIATE = {
+    'transport': 'pipe',                  # 'pipe' - кропы идут в склейку через NUT по stdout, без файлов;
+                                          # 'ram' - временные файлы в RAM-папке в пределах бюджета;
+                                          # 'disk' - временные файлы в системной временной папке
+    'ram_dir': Path('/dev/shm/video_voronka'),  # RAM-папка (tmpfs); также запасной вариант для 'pipe'
+    'ram_budget_bytes': 4 * 1024 ** 3,    # Сколько RAM-папки могут занять все задачи вместе
+    'size_estimate_factor': 10            # Во сколько раз кропы crf 0 больше фрагмента (для оценки бюджета)
+}
+
+# Кэш готовых рендеров и кропов по содержимому источника и настройкам
+RENDER_CACHE = {
+    'enabled': True,
+    'dir': CACHE_DIR / "renders",
+    'max_bytes': 50 * 1024 ** 3,  # Больше - вытесняются давно не использованные записи
+    'max_entry_fraction': 0.1,    # Запись больше этой доли max_bytes не сохраняется (вытеснила бы весь кэш)
+    'max_crop_seconds': 120       # Кропы многошагового рендера кэшируются только для фрагментов не длиннее, сек
+                                  # (кропы полного видео в crf 0 огромны и повторно почти не нужны)
+}
+
+# Дополнительные файлы клипа из того же прохода рендера (ветки графа фильтров, без повторного декодирования)
+SIDECARS = {
+    'enabled': False,
+    'poster': {
+        'enabled': True,
+        'time': 1.0          # Секунда клипа для постера (<имя>_poster.jpg)
+    },
+    'preview': {
+        'enabled': True,
+        'format': 'webp',    # 'webp' (libwebp_anim) или 'gif' (палитра по самому превью)
+        'width': 270,
+        'fps': 10,
+        'duration': 3,       # Секунд из середины клипа (<имя>_preview.webp)
+        'quality': 60        # Качество webp (0-100)
+    },
+    'contact_sheet': {
+        'enabled': True,
+        'columns': 4,        # Кадры равномерно по клипу, сетка columns x rows (<имя>_sheet.jpg)
+        'rows': 3,
+        'width': 270         # Ширина одного кадра сетки
+    }
+}
+
+# Слежение за лицом: окно кропа камеры двигается внутри CAMERA_AREA за лицом (camera_tracking.py, нужен numpy).
+# Работает в однопроходном рендере, клипах за одно декодирование и компоновщике; в многошаговом - кроп неподвижный
+CAMERA_TRACKING = {
+    'enabled': False,
+    'detector': 'auto',      # 'face' - лицо (OpenCV), 'motion' - центр движения (numpy), 'auto' - лицо, если есть OpenCV
+    'zoom': 0.75,            # Окно кропа - такая доля CAMERA_AREA с теми же пропорциями
+    'fps': 5,                # Частота кадров анализа
+    'width': 160,            # Ширина кадров анализа
+    'smoothing': 1.0,        # Сглаживание траектории (сигма гауссова окна), сек
+    'cache_dir': CACHE_DIR / "tracks"
+}
+
+# Быстрое превью для подбора областей кропа (preview.py): кадр с ключевого кадра или короткий клип
+PREVIEW = {
+    'dir': OUTPUT_DIR / "preview",
+    'scale': 4,              # Раскладка в 1/scale размера OUTPUT_VIDEO
+    'clip_duration': 2,      # Длительность превью-клипа, сек
+    'crf': 28,
+    'line_width': 4,         # Толщина рамок областей на кадре источника
+    'colors': {'game': 'lime', 'camera': 'red', 'subtitles': 'yellow'}
+}
+
+# Поиск областей кропа по кадрам источника (detect_regions.py, нужен numpy)
+REGION_DETECTION = {
+    'enabled': True,
+    'on_ingest': True,          # Демон ищет области у каждого нового файла и предупреждает о расхождении с config
+    'samples': 20,              # Кадров по всему видео (один ffmpeg, seek на ключевые кадры)
+    'width': 640,               # Ширина кадров анализа (высота - по пропорциям источника)
+    'active_std': 4.0,          # Разброс яркости пикселя по кадрам выше - содержимое меняется
+    'corr_threshold': 0.5,      # Корреляция соседних пикселей по кадрам ниже - граница областей
+    'edge_threshold': 24,       # Медианный по кадрам перепад яркости выше - постоянная рамка
+    'cut_coverage': 0.7,        # Доля линии, которая должна быть границей, чтобы по ней резать
+    'min_region': 0.08,         # Минимальная сторона области (доля ширины/высоты кадра)
+    'subtitles_aspect': 2.5,    # Область шире этого отношения сторон - субтитры/чат
+    'match_iou': 0.8,           # Совпадение с областью из config ниже - предупреждение
+    'cache_dir': CACHE_DIR / "regions"
+}
+
+# Выбор клипов по звуку: окна с наибольшей громкостью и числом нарастаний (нужен numpy)
+AUDIO_ANALYSIS = {
+    'enabled': True,
+    'sample_rate': 8000,     # Звук декодируется в моно с этой частотой - для огибающей громкости хватает
+    'hop_seconds': 0.1,      # Шаг огибающих
+    'onset_weight': 0.5,     # Вес нарастаний громкости относительно самой громкости
+    'cache_dir': CACHE_DIR / "audio"
+}
+
+# Индекс сцен: склейки, черные и статичные куски по кадрам 64x36 (нужен numpy)
+SCENE_INDEX = {
+    'enabled': True,
+    'width': 64,
+    'height': 36,
+    'fps': 10,                  # Кадров в секунду для выборки (точность границ - 1/fps)
+    'cut_threshold': 0.35,      # Расстояние гистограмм соседних кадров (0-1), выше - склейка
+    'black_luma': 20,           # Средняя яркость ниже - черный кадр
+    'static_diff': 1.0,         # Средняя разница с предыдущим кадром ниже - статичный кадр
+    'max_dead_fraction': 0.2,   # Окно с большей долей черных/статичных кадров не берется
+    'max_snap_shift': 2.0,      # Максимальный сдвиг окна к склейке, сек
+    'cache_dir': CACHE_DIR / "scenes"
+}
+
+# Резка по ключевым кадрам (GOP)
+CUTTING = {
+    'mode': 'copy',         # 'copy' - копирование, старт прилипает к предыдущему ключевому кадру;
+                            # 'smart' - экспериментально: перекодируется только неполный первый GOP, остальное
+                            # копируется. Стык пока неисправен (разные SPS в одной дорожке, немонотонный dts,
+                            # разрыв AAC), поэтому по умолчанию не используется
+    'snap_starts': True,    # Сдвигать старты клипов на ближайший ключевой кадр
+    'max_snap_shift': 2.0   # Максимальный сдвиг старта, сек
+}
+
+# Запуск ffmpeg/ffprobe
+FFMPEG_RUNNER = {
+    'timeout': None,        # Максимальное время одной команды, сек (None - без ограничения)
+    'stall_timeout': 300,   # Останавливать процесс, если он столько секунд ничего не выводит
+    'stderr_lines': 200,    # Сколько последних строк stderr хранить для лога ошибок
+    'kill_grace': 10        # Сколько ждать после SIGTERM перед SIGKILL, сек
+}
+
+# Прогресс и метрики рендера (ffmpeg -progress + ресурсы процесса из os.wait4, живые - из /proc)
+METRICS = {
+    'enabled': True,                                   # Писать метрики этапов и задач
+    'metrics_file': PROJECT_ROOT / "metrics.jsonl",    # JSON-строка на каждый этап и задачу
+    'progress_log_interval': 10                        # Как часто писать прогресс в лог, сек (0 - не писать)
+}
+
+# Демон папки input/ (watcher.py)
+WATCHER = {
+    'mode': 'clips',            # Что делать с новым файлом: 'test', 'clips' или 'full'
+    'num_clips': 20,            # Режим clips: сколько клипов
+    'clip_duration': 15,        # Режим clips: длительность клипа, сек
+    'stable_seconds': 30,       # Файл дописан, если размер и mtime не менялись столько секунд
+    'poll_interval': 5,         # Период опроса папки без inotify, сек
+    'use_inotify': True,        # inotify на Linux; иначе или при ошибке - опрос папки
+    'max_jobs': 1,              # Сколько файлов рендерить одновременно (каждый сам использует все ядра)
+    'default_priority': 10,     # Приоритет файла (меньше - раньше); при равном - старые раньше
+    'priority_patterns': {}     # Приоритет по шаблону имени, например {'*_urgent*': 0}
+}
+
+# Очередь задач для нескольких воркеров (workqueue.py); база должна лежать в общей для воркеров папке
+WORKQUEUE = {
+    'db_path': PROJECT_ROOT / "workqueue.sqlite",
+    'lease_seconds': 120,       # На сколько воркер берет задачу; без heartbeat аренда истекает
+    'heartbeat_interval': 30,   # Как часто воркер продлевает аренду, сек
+    'heartbeat_retry': 5,       # Повтор продления после ошибки базы (занята, сеть), сек
+    'max_attempts': 3,          # После стольких неудачных попыток задача уходит в dead
+    'idle_sleep': 5             # Пауза воркера при пустой очереди, сек
+}
+
+# Замер скорости рендера (benchmark.py)
+BENCHMARK = {
+    'work_dir': PROJECT_ROOT / "benchmark",                   # Источники, результаты и временные файлы
+    'baseline_file': PROJECT_ROOT / "benchmark_baseline.json",  # Эталон для поиска регрессий
+    'source_duration': 120,   # Длительность синтетического источника, сек
+    'num_clips': 20,          # Режим clips: сколько клипов
+    'clip_duration': 15,      # Режим clips: длительность клипа, сек
+    'seed': 42,               # Зерно random: одинаковые старты клипов от запуска к запуску
+    'tolerance': 0.10         # Допустимое ухудшение метрики относительно эталона (доля)
+}
+
 # Для тестов - берем фрагмент из случайного места
 TEST_FRAGMENT = {
     'duration': 15,  # 15 секунд
     'start_offset': 'random'  # начать со случайного места
 }
 
+# Каталог медиафайлов с кэшем ffprobe
+CATALOG = {
+    'db_path': PROJECT_ROOT / 'catalog.sqlite',
+    'probe_workers': 4,              # Сколько ffprobe запускать параллельно при появлении новых файлов
+    'keyframe_probe_seconds': 60     # По скольким первым секундам оценивать интервал ключевых кадров
+}
+
 # Поддерживаемые форматы
 SUPPORTED_FORMATS = ['.mov', '.mp4', '.avi', '.mkv']
 
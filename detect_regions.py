@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+import config
+import utils
+import render_cache
+import ffmpeg_runner
+from ffmpeg_runner import get_ffmpeg_command
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Поиск областей кропа по кадрам источника: один ffmpeg делает seek на ключевые кадры в samples
+# точках видео и отдает уменьшенные кадры в оттенках серого через pipe. По кадрам пакетно считаются
+# разброс яркости каждого пикселя и корреляция соседних пикселей во времени: внутри одной области
+# (игра, камера, субтитры) соседние пиксели меняются согласованно, на границе источников - нет.
+# Кадр режется по линиям, где граница идет почти по всей длине (XY-разрез), куски классифицируются
+# по размеру и пропорциям. Результат кэшируется по отпечатку содержимого источника
+
+# Глубина XY-разреза: кусков не больше 2^MAX_DEPTH
+MAX_DEPTH = 4
+# Кусок с меньшей долей кадра - не область (логотип, иконка)
+MIN_AREA_FRACTION = 0.02
+# Игра меньше этой доли кадра - раскладка не распознана (например, почти неподвижное видео)
+MIN_GAME_FRACTION = 0.15
+# Строка/столбец, где меняется меньше этой доли пикселей, обрезается с краев куска
+MIN_FILL = 0.1
+
+NAMES = ('game', 'camera', 'subtitles')
+
+def is_available():
+    """Поиск возможен: включен в config и установлен numpy"""
+    if not config.REGION_DETECTION['enabled']:
+        return False
+    if np is None:
+        logging.warning("numpy не установлен - поиск областей недоступен (pip install numpy)")
+        return False
+    return True
+
+def get_cache_path(input_path):
+    """Файл кэша областей: отпечаток источника и параметры выборки кадров"""
+    detection = config.REGION_DETECTION
+    fingerprint = render_cache.source_fingerprint(input_path)
+    return detection['cache_dir'] / f"{fingerprint}_{detection['samples']}_{detection['width']}.json"
+
+def get_sample_size(video_info):
+    """Размер кадров анализа: ширина из config, высота по пропорциям источника"""
+    width = config.REGION_DETECTION['width']
+    return width, int(width * video_info['height'] / video_info['width']) // 2 * 2
+
+def sample_frames(input_path, video_info):
+    """Кадры (N, H, W) из samples точек видео одним ffmpeg; None - ошибка"""
+    samples = config.REGION_DETECTION['samples']
+    width, height = get_sample_size(video_info)
+    cmd = [get_ffmpeg_command(), '-v', 'error']
+    parts = []
+    for index in range(samples):
+        # Точки равномерно по видео, по середине своих отрезков (мимо заставок в начале и конце)
+        time_point = video_info['duration'] * (index + 0.5) / samples
+        # Каждая точка - свой вход: seek по индексу контейнера, декодируется только ключевой кадр
+        cmd.extend(['-skip_frame', 'nokey', '-noaccurate_seek', '-ss', f"{time_point:.3f}",
+                    '-an', '-sn', '-dn', '-i', str(input_path)])
+        # Без сглаживания при уменьшении: граница областей не размывается на соседние пиксели
+        parts.append(f"[{index}:v]setpts=PTS-STARTPTS,trim=end_frame=1,scale={width}:{height}:flags=neighbor,format=gray,setsar=1[f{index}]")
+    parts.append(''.join(f"[f{index}]" for index in range(samples)) + f"concat=n={samples}:v=1:a=0[frames]")
+    cmd.extend(['-filter_complex', ';'.join(parts), '-map', '[frames]',
+                '-fps_mode', 'passthrough', '-f', 'rawvideo', 'pipe:1'])
+
+    result = ffmpeg_runner.run(cmd, description="Выборка кадров", capture_stdout=True)
+    frame_bytes = width * height
+    count = len(result['stdout']) // frame_bytes
+    if result['returncode'] != 0 or count < 2:
+        logging.error(f"Ошибка выборки кадров {input_path}: {result['timed_out'] or result['stderr'].strip()}")
+        return None
+    return np.frombuffer(result['stdout'][:count * frame_bytes], dtype=np.uint8).reshape(count, height, width)
+
+def boundary_maps(frames):
+    """Карты по кадрам: меняющиеся пиксели (H, W) и границы между соседними строками/столбцами
+
+    Граница между соседними пикселями - низкая корреляция их яркости по кадрам (разные источники)
+    или постоянный перепад яркости (рамка вокруг камеры). Возвращает (active, breaks_y, breaks_x,
+    either_y, either_x): either - хотя бы один из пары пикселей меняется.
+    """
+    detection = config.REGION_DETECTION
+    values = frames.astype(np.float32)
+    spread = values.std(axis=0)
+    active = spread > detection['active_std']
+    # У неизменных пикселей нормированное отклонение 0: корреляция с любым соседом 0
+    normalized = (values - values.mean(axis=0)) / np.where(active, spread, 1) * active
+
+    corr_y = (normalized[:, 1:] * normalized[:, :-1]).mean(axis=0)
+    corr_x = (normalized[:, :, 1:] * normalized[:, :, :-1]).mean(axis=0)
+    edge_y = np.median(np.abs(np.diff(values, axis=1)), axis=0) > detection['edge_threshold']
+    edge_x = np.median(np.abs(np.diff(values, axis=2)), axis=0) > detection['edge_threshold']
+
+    either_y = active[1:] | active[:-1]
+    either_x = active[:, 1:] | active[:, :-1]
+    breaks_y = ((corr_y < detection['corr_threshold']) | edge_y) & either_y
+    breaks_x = ((corr_x < detection['corr_threshold']) | edge_x) & either_x
+    return active, breaks_y, breaks_x, either_y, either_x
+
+def trim_rect(active, rect):
+    """Кусок (y0, y1, x0, x1) без неизменных строк и столбцов по краям; None - в куске ничего не меняется"""
+    y0, y1, x0, x1 = rect
+    block = active[y0:y1, x0:x1]
+    rows = np.flatnonzero(block.mean(axis=1) >= MIN_FILL)
+    columns = np.flatnonzero(block.mean(axis=0) >= MIN_FILL)
+    if not len(rows) or not len(columns):
+        return None
+    return y0 + rows[0], y0 + rows[-1] + 1, x0 + columns[0], x0 + columns[-1] + 1
+
+def best_cut(breaks, either, rect, min_size):
+    """Лучшая горизонтальная линия разреза куска: (доля границы по линии, y разреза)
+
+    Линия, где в куске ничего не меняется, - промежуток между областями, доля 1.
+    Части по обе стороны разреза должны быть не меньше min_size.
+    """
+    y0, y1, x0, x1 = rect
+    if y1 - y0 < 2 * min_size:
+        return 0.0, None
+    counts = either[y0:y1 - 1, x0:x1].sum(axis=1)
+    coverage = np.where(counts > 0, breaks[y0:y1 - 1, x0:x1].sum(axis=1) / np.maximum(counts, 1), 1.0)
+    sizes = np.arange(1, y1 - y0)
+    coverage[(sizes < min_size) | (y1 - y0 - sizes < min_size)] = 0
+    index = int(np.argmax(coverage))
+    return float(coverage[index]), y0 + index + 1
+
+def split_regions(maps, rect, min_size, depth=0):
+    """Рекурсивный XY-разрез: прямоугольники (y0, y1, x0, x1) с согласованно меняющимся содержимым"""
+    active, breaks_y, breaks_x, either_y, either_x = maps
+    rect = trim_rect(active, rect)
+    if rect is None:
+        return []
+    y0, y1, x0, x1 = rect
+    if depth < MAX_DEPTH:
+        score_y, cut_y = best_cut(breaks_y, either_y, rect, min_size[1])
+        # Вертикальный разрез - тот же поиск по транспонированным картам
+        score_x, cut_x = best_cut(breaks_x.T, either_x.T, (x0, x1, y0, y1), min_size[0])
+        if max(score_y, score_x) >= config.REGION_DETECTION['cut_coverage']:
+            if score_y >= score_x:
+                parts = [(y0, cut_y, x0, x1), (cut_y, y1, x0, x1)]
+            else:
+                parts = [(y0, y1, x0, cut_x), (y0, y1, cut_x, x1)]
+            return [region for part in parts for region in split_regions(maps, part, min_size, depth + 1)]
+    return [rect]
+
+def classify_regions(rects, frame_size):
+    """Куски -> {'game', 'camera', 'subtitles'}: игра - самый большой, субтитры - самый вытянутый
+    по ширине (шире subtitles_aspect), камера - самый большой из оставшихся. Нет куска - None"""
+    width, height = frame_size
+    rects = [rect for rect in rects if (rect[1] - rect[0]) * (rect[3] - rect[2]) >= MIN_AREA_FRACTION * width * height]
+    rects.sort(key=lambda rect: (rect[1] - rect[0]) * (rect[3] - rect[2]), reverse=True)
+    found = dict.fromkeys(NAMES)
+    if not rects or (rects[0][1] - rects[0][0]) * (rects[0][3] - rects[0][2]) < MIN_GAME_FRACTION * width * height:
+        return found
+    found['game'] = rects.pop(0)
+
+    aspects = [(rect[3] - rect[2]) / (rect[1] - rect[0]) for rect in rects]
+    if aspects and max(aspects) >= config.REGION_DETECTION['subtitles_aspect']:
+        found['subtitles'] = rects.pop(aspects.index(max(aspects)))
+    if rects:
+        found['camera'] = rects[0]
+    return found
+
+def to_source_edges(start, end, size, source_size):
+    """Отрезок кадра анализа [start, end) -> отрезок источника
+
+    Кадр анализа берет пиксели источника без сглаживания: пиксель i - это пиксель источника
+    floor((i + 0.5) * scale). Края берутся по крайним пикселям отрезка, чтобы в область не попал
+    пиксель соседней области; края кадра остаются краями кадра.
+    """
+    scale = source_size / size
+    source_start = 0 if start == 0 else int((start + 0.5) * scale)
+    source_end = source_size if end == size else int((end - 0.5) * scale) + 1
+    return source_start, source_end
+
+def to_source_area(rect, frame_size, video_info):
+    """Прямоугольник кадра анализа -> область в координатах источника"""
+    y0, y1, x0, x1 = rect
+    x, x_end = to_source_edges(x0, x1, frame_size[0], video_info['width'])
+    y, y_end = to_source_edges(y0, y1, frame_size[1], video_info['height'])
+    return {'x': x, 'y': y, 'width': x_end - x, 'height': y_end - y}
+
+def detect(input_path, video_info):
+    """Области источника {'game', 'camera', 'subtitles'} (не найденная - None) без кэша; None - ошибка"""
+    frames = sample_frames(input_path, video_info)
+    if frames is None:
+        return None
+    height, width = frames.shape[1:]
+    min_size = (max(1, int(width * config.REGION_DETECTION['min_region'])),
+                max(1, int(height * config.REGION_DETECTION['min_region'])))
+    rects = split_regions(boundary_maps(frames), (0, height, 0, width), min_size)
+    return {
+        name: to_source_area(rect, (width, height), video_info) if rect else None
+        for name, rect in classify_regions(rects, (width, height)).items()
+    }
+
+def get_regions(input_path, video_info=None):
+    """Найденные области источника (из кэша или поиском), проверенные по размеру видео; None - не найдены"""
+    if not is_available():
+        return None
+    video_info = video_info or utils.get_video_info(input_path)
+    if not video_info:
+        return None
+
+    cache_path = get_cache_path(input_path)
+    regions = None
+    if cache_path.exists():
+        try:
+            regions = json.loads(cache_path.read_text(encoding='utf-8'))
+        except ValueError as e:
+            logging.warning(f"Кэш областей поврежден, ищем заново: {cache_path}: {e}")
+
+    if regions is None:
+        detect_start = time.monotonic()
+        regions = detect(input_path, video_info)
+        if regions is None:
+            return None
+        found = {name: area for name, area in regions.items() if area}
+        if found and not utils.validate_crop_coordinates(video_info['width'], video_info['height'], found):
+            regions = dict.fromkeys(NAMES)
+        logging.info(
+            f"Поиск областей: найдено {sum(1 for area in regions.values() if area)} из {len(regions)} "
+            f"за {time.monotonic() - detect_start:.2f}с"
+        )
+        # Кэшируется и неудача: для того же файла поиск не повторяется
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+        temp_path.write_text(json.dumps(regions), encoding='utf-8')
+        os.replace(temp_path, cache_path)
+
+    if not any(regions.values()):
+        logging.warning(f"Области не найдены: {input_path}")
+        return None
+    return regions
+
+def get_config_areas():
+    """Области из config.py"""
+    return {'game': config.GAME_AREA, 'camera': config.CAMERA_AREA, 'subtitles': config.SUBTITLES_AREA}
+
+def intersection_over_union(first, second):
+    """Доля пересечения двух областей от их объединения"""
+    width = min(first['x'] + first['width'], second['x'] + second['width']) - max(first['x'], second['x'])
+    height = min(first['y'] + first['height'], second['y'] + second['height']) - max(first['y'], second['y'])
+    intersection = max(0, width) * max(0, height)
+    union = first['width'] * first['height'] + second['width'] * second['height'] - intersection
+    return intersection / union if union else 0.0
+
+def format_regions(regions):
+    """Найденные области строками для config.py"""
+    config_names = {'game': 'GAME_AREA', 'camera': 'CAMERA_AREA', 'subtitles': 'SUBTITLES_AREA'}
+    return '\n'.join(
+        f"{config_names[name]} = {{'x': {area['x']}, 'y': {area['y']}, 'width': {area['width']}, 'height': {area['height']}}}"
+        for name, area in regions.items() if area
+    )
+
+def check_regions(input_path, video_info=None):
+    """Сравнение найденных областей с config.py: True - совпадают (или поиск недоступен)"""
+    regions = get_regions(input_path, video_info)
+    if not regions:
+        return True
+    differs = [
+        name for name, area in regions.items()
+        if area and intersection_over_union(area, get_config_areas()[name]) < config.REGION_DETECTION['match_iou']
+    ]
+    if differs:
+        logging.warning(
+            f"Области в config.py не совпадают с найденными в {input_path} ({', '.join(differs)}), "
+            f"предлагаемые:\n{format_regions(regions)}"
+        )
+        return False
+    logging.info(f"Области в config.py совпадают с найденными в {input_path}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск областей кропа по кадрам видео")
+    parser.add_argument('--input', type=Path, help="Исходное видео (по умолчанию - последнее в input/)")
+    args = parser.parse_args()
+
+    utils.setup_logging()
+    video_path = args.input or utils.find_latest_video()
+    if not video_path:
+        logging.error("Видео для обработки не найдено")
+        sys.exit(1)
+    regions = get_regions(video_path)
+    if not regions:
+        sys.exit(1)
+    print(format_regions(regions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from pathlib import Path
+import config
+import metrics
+
+# Асинхронный запуск ffmpeg/ffprobe: stderr читается потоком в ограниченный буфер,
+# зависшие и слишком долгие процессы убиваются, много задач можно вести из одного event loop.
+# Процесс забирается через os.wait4 - вместе с кодом возврата точные ресурсы за все время работы
+
+LINE_SPLIT = re.compile(rb'[\r\n]+')
+
+# Остановка всех процессов этого воркера (например, аренда задачи очереди потеряна): причина или None
+_stop_reason = None
+_stop_lock = threading.Lock()
+
+def stop_all(reason):
+    """Остановить текущие процессы и сразу останавливать новые, пока не вызван resume_all()"""
+    global _stop_reason
+    with _stop_lock:
+        _stop_reason = reason
+
+def resume_all():
+    """Снова разрешить запуск процессов после stop_all()"""
+    global _stop_reason
+    with _stop_lock:
+        _stop_reason = None
+
+def get_ffmpeg_command():
+    """Используем локальный ffmpeg если он есть"""
+    ffmpeg_path = Path(__file__).parent / 'ffmpeg'
+    if ffmpeg_path.exists():
+        return str(ffmpeg_path)
+    return 'ffmpeg'
+
+async def read_lines(stream, lines, activity):
+    """Чтение потока по строкам (ffmpeg обновляет статистику через \\r) в кольцевой буфер"""
+    pending = b''
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        activity['last'] = asyncio.get_running_loop().time()
+        *complete, pending = LINE_SPLIT.split(pending + chunk)
+        for line in complete:
+            if line:
+                lines.append(line.decode(errors='replace'))
+    if pending:
+        lines.append(pending.decode(errors='replace'))
+
+async def read_all(stream, chunks, activity):
+    """Чтение stdout целиком (для ffprobe)"""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        activity['last'] = asyncio.get_running_loop().time()
+        chunks.append(chunk)
+
+async def read_chunks(stream, chunk_size, handle_chunk, activity, errors):
+    """Чтение stdout кусками по chunk_size байт (последний - остаток) в handle_chunk по мере вывода
+
+    Ошибка обработчика запоминается в errors, а pipe дочитывается: иначе ffmpeg встанет на полном pipe.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    while True:
+        data = await stream.read(65536)
+        activity['last'] = loop.time()
+        buffer += data
+        while buffer and (len(buffer) >= chunk_size or not data):
+            chunk = bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+            if not errors:
+                try:
+                    handle_chunk(chunk)
+                except Exception as e:
+                    errors.append(e)
+            # Обработка (например numpy) может идти долго - это не зависание ffmpeg
+            activity['last'] = loop.time()
+        if not data:
+            break
+
+def parse_progress(block):
+    """Блок -progress ffmpeg (key=value) в числа"""
+    def number(key, suffix=''):
+        value = block.get(key, 'N/A').strip()
+        if suffix and value.endswith(suffix):
+            value = value[:-len(suffix)]
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    out_time_us = number('out_time_us')
+    return {
+        'frame': int(number('frame') or 0),
+        'fps': number('fps'),
+        'speed': number('speed', 'x'),
+        'bitrate_kbps': number('bitrate', 'kbits/s'),
+        'total_size': int(number('total_size') or 0),
+        'out_seconds': out_time_us / 1_000_000 if out_time_us and out_time_us > 0 else None,
+        'finished': block.get('progress') == 'end'
+    }
+
+def format_progress(description, state, expected_duration, live_stats=None):
+    """Строка прогресса для лога: кадр, fps, скорость, оставшееся время и текущие ресурсы процесса"""
+    text = f"Прогресс ({description}): кадр {state['frame']}"
+    if state['fps'] is not None:
+        text += f", {state['fps']:.1f} fps"
+    if state['speed']:
+        text += f", скорость {state['speed']:.2f}x"
+    if expected_duration:
+        percent = min(100.0, state['out_seconds'] * 100 / expected_duration)
+        text += f", {state['out_seconds']:.1f}/{expected_duration:.1f}с ({percent:.0f}%)"
+        if state['speed']:
+            eta = max(0.0, expected_duration - state['out_seconds']) / state['speed']
+            text += f", осталось ~{eta:.0f}с"
+    if live_stats and 'cpu_seconds' in live_stats:
+        text += f", CPU {live_stats['cpu_seconds']:.1f}с"
+    if live_stats and 'peak_rss_bytes' in live_stats:
+        text += f", память {live_stats['peak_rss_bytes'] / 1024 ** 2:.0f} МБ"
+    return text
+
+async def open_reader(pipe):
+    """asyncio-поток чтения поверх pipe (файловый объект); транспорт закрывает pipe"""
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    return reader, transport
+
+async def read_stream(pipe, read, *args):
+    """read(reader, *args) над pipe процесса с закрытием pipe в конце"""
+    reader, transport = await open_reader(pipe)
+    try:
+        await read(reader, *args)
+    finally:
+        transport.close()
+
+async def read_progress(read_fd, state, activity, description, expected_duration, live_stats):
+    """Чтение -progress из отдельного pipe: живой прогресс в лог и итог для метрик"""
+    loop = asyncio.get_running_loop()
+    reader, transport = await open_reader(os.fdopen(read_fd, 'rb', 0))
+    log_interval = config.METRICS['progress_log_interval']
+    last_logged = loop.time()
+    block = {}
+    try:
+        async for raw_line in reader:
+            key, _, value = raw_line.decode(errors='replace').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            # N/A в последнем блоке (бывает при нескольких выходах) не затирает известные значения
+            state.update({key: value for key, value in parse_progress(block).items() if value is not None})
+            block = {}
+            activity['last'] = loop.time()
+            if log_interval and loop.time() - last_logged >= log_interval:
+                last_logged = loop.time()
+                logging.info(format_progress(description, state, expected_duration, live_stats))
+    finally:
+        transport.close()
+
+def start_reaper(pid):
+    """Поток, ждущий выхода процесса через os.wait4; future -> (код возврата, rusage)
+
+    Ресурсы из wait4 точные за все время работы процесса, в отличие от снимков /proc,
+    которые у коротких этапов не успевают сняться ни разу.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def reap():
+        _, status, rusage = os.wait4(pid, 0)
+        loop.call_soon_threadsafe(set_result, (os.waitstatus_to_exitcode(status), rusage))
+
+    threading.Thread(target=reap, name=f"wait4-{pid}", daemon=True).start()
+    return future
+
+def send_signal(process, waiter, signum):
+    """Сигнал процессу, пока он не забран (после wait4 pid может занять другой процесс)"""
+    if waiter.done():
+        return
+    try:
+        os.kill(process.pid, signum)
+    except ProcessLookupError:
+        pass
+
+async def stop_process(process, waiter):
+    """Мягкая остановка: SIGTERM (ffmpeg успевает закрыть файл), затем SIGKILL"""
+    send_signal(process, waiter, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(asyncio.shield(waiter), timeout=config.FFMPEG_RUNNER['kill_grace'])
+    except asyncio.TimeoutError:
+        send_signal(process, waiter, signal.SIGKILL)
+        await waiter
+
+async def run_async(cmd, description="", stdin=None, stdout=None, capture_stdout=False,
+                    timeout=None, stall_timeout=None, progress=False, expected_duration=None,
+                    stdout_handler=None, stdout_chunk_size=65536):
+    """Запуск команды с таймаутами и потоковым чтением вывода
+
+    stdin/stdout - файловые дескрипторы для связки процессов через pipe; они закрываются
+    в родителе сразу после запуска, чтобы соседний процесс получил EOF.
+    stdout_handler - обработка stdout по ходу работы кусками по stdout_chunk_size байт (например
+    целыми кадрами rawvideo) без накопления всего вывода в памяти; его ошибка выбрасывается после
+    завершения процесса.
+    progress - запустить ffmpeg с -progress: живой прогресс в лог и запись метрик этапа
+    (expected_duration - ожидаемая длительность результата для процента и ETA).
+    Возвращает словарь: returncode, stdout (bytes при capture_stdout), stderr (последние строки),
+    timed_out, progress (последний блок -progress), stats (ресурсы процесса из os.wait4).
+    """
+    settings = config.FFMPEG_RUNNER
+    timeout = timeout if timeout is not None else settings['timeout']
+    stall_timeout = stall_timeout if stall_timeout is not None else settings['stall_timeout']
+
+    progress_read_fd = progress_write_fd = None
+    if progress:
+        # Отдельный pipe под -progress, чтобы stdout оставался свободным (например для NUT)
+        progress_read_fd, progress_write_fd = os.pipe()
+        cmd = [cmd[0], '-progress', f"pipe:{progress_write_fd}", *cmd[1:]]
+
+    if capture_stdout or stdout_handler:
+        stdout_target = subprocess.PIPE
+    else:
+        stdout_target = stdout if stdout is not None else subprocess.DEVNULL
+    wall_start = time.monotonic()
+    try:
+        # Процесс забирает свой поток через os.wait4, а не asyncio (тот забирает через waitpid без ресурсов);
+        # поэтому методы Popen, которые сами вызывают waitpid (poll, wait, terminate), не используются
+        process = subprocess.Popen(
+            cmd,
+            stdin=stdin if stdin is not None else subprocess.DEVNULL,
+            stdout=stdout_target,
+            stderr=subprocess.PIPE,
+            pass_fds=(progress_write_fd,) if progress else (),
+            bufsize=0
+        )
+    except Exception:
+        if progress:
+            os.close(progress_read_fd)
+        raise
+    finally:
+        for fd in (stdin, stdout, progress_write_fd):
+            if isinstance(fd, int):
+                os.close(fd)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    activity = {'last': started}
+    stderr_lines = deque(maxlen=settings['stderr_lines'])
+    stdout_chunks = []
+    progress_state = {'frame': 0, 'fps': None, 'speed': None, 'bitrate_kbps': None,
+                      'total_size': 0, 'out_seconds': 0.0, 'finished': False}
+    # Снимки /proc - только для живого прогресса; итог для метрик - из os.wait4
+    live_stats = {}
+
+    waiter = start_reaper(process.pid)
+    readers = [asyncio.create_task(read_stream(process.stderr, read_lines, stderr_lines, activity))]
+    if capture_stdout:
+        readers.append(asyncio.create_task(read_stream(process.stdout, read_all, stdout_chunks, activity)))
+    handler_errors = []
+    if stdout_handler:
+        readers.append(asyncio.create_task(read_stream(
+            process.stdout, read_chunks, stdout_chunk_size, stdout_handler, activity, handler_errors
+        )))
+    if progress:
+        readers.append(asyncio.create_task(
+            read_progress(progress_read_fd, progress_state, activity, description, expected_duration, live_stats)
+        ))
+
+    timed_out = None
+    try:
+        while not waiter.done():
+            if progress:
+                live_stats.update(metrics.sample_process(process.pid))
+            await asyncio.wait({waiter}, timeout=0.5)
+            now = loop.time()
+            if timeout and now - started > timeout:
+                timed_out = f"превышено время выполнения {timeout}с"
+            elif stall_timeout and now - activity['last'] > stall_timeout:
+                timed_out = f"нет вывода {stall_timeout}с"
+            elif _stop_reason:
+                timed_out = _stop_reason
+            if timed_out and not waiter.done():
+                logging.error(f"Остановка ffmpeg ({description}): {timed_out}")
+                await stop_process(process, waiter)
+                break
+        returncode, rusage = await waiter
+        if timed_out:
+            # Вывод остановленного процесса дочитывать не нужно (pipe мог остаться у его потомков)
+            for reader in readers:
+                reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+    except asyncio.CancelledError:
+        logging.warning(f"Отмена: {description}")
+        await stop_process(process, waiter)
+        process.returncode = waiter.result()[0]
+        for reader in readers:
+            reader.cancel()
+        raise
+
+    # Popen не должен сам искать уже забранный процесс
+    process.returncode = returncode
+    stats = metrics.rusage_stats(rusage)
+    if progress:
+        # rchar/wchar (весь ввод-вывод, не только диск) есть только в /proc - последний снимок
+        for key in ('io_read_bytes', 'io_write_bytes'):
+            stats[key] = live_stats.get(key)
+        write_stage_metrics(description, returncode, time.monotonic() - wall_start,
+                            progress_state, stats, timed_out)
+    if handler_errors:
+        raise handler_errors[0]
+
+    return {
+        'returncode': returncode,
+        'stdout': b''.join(stdout_chunks) if capture_stdout else None,
+        'stderr': '\n'.join(stderr_lines),
+        'timed_out': timed_out,
+        'progress': progress_state,
+        'stats': stats
+    }
+
+def write_stage_metrics(description, returncode, wall_seconds, progress_state, stats, timed_out):
+    """Запись метрик одного этапа (вызова ffmpeg)"""
+    out_seconds = progress_state['out_seconds']
+    output_bitrate_kbps = None
+    if out_seconds and progress_state['total_size']:
+        output_bitrate_kbps = progress_state['total_size'] * 8 / out_seconds / 1000
+
+    metrics.write_record({
+        'type': 'stage',
+        'stage': description,
+        'returncode': returncode,
+        'timed_out': timed_out,
+        'wall_seconds': round(wall_seconds, 3),
+        'cpu_seconds': stats.get('cpu_seconds'),
+        'peak_rss_bytes': stats.get('peak_rss_bytes'),
+        'io_read_bytes': stats.get('io_read_bytes'),
+        'io_write_bytes': stats.get('io_write_bytes'),
+        'disk_read_bytes': stats.get('disk_read_bytes'),
+        'disk_write_bytes': stats.get('disk_write_bytes'),
+        'frames': progress_state['frame'],
+        'output_seconds': round(out_seconds, 3),
+        'output_bytes': progress_state['total_size'],
+        'output_bitrate_kbps': round(output_bitrate_kbps, 1) if output_bitrate_kbps else None,
+        'speed': progress_state['speed'],
+        'realtime_factor': round(out_seconds / wall_seconds, 3) if wall_seconds > 0 else None
+    })
+
+async def run_many(commands, limit=None):
+    """Несколько команд из одного event loop, не больше limit одновременно"""
+    semaphore = asyncio.Semaphore(limit or len(commands) or 1)
+
+    async def run_one(cmd, kwargs):
+        async with semaphore:
+            return await run_async(cmd, **kwargs)
+
+    return await asyncio.gather(*(run_one(cmd, kwargs) for cmd, kwargs in commands))
+
+def run(cmd, **kwargs):
+    """Синхронная обертка над run_async для кода без event loop (в т.ч. из потоков планировщика)"""
+    return asyncio.run(run_async(cmd, **kwargs))
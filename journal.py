@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+import config
+
+# Журнал длинного рендера по сегментам: какие сегменты готовы, где лежат и их sha256.
+# Рабочая папка не зависит от имени результата (в нем время запуска), поэтому перезапуск
+# той же задачи находит ее и продолжает с первого незавершенного сегмента
+
+JOURNAL_NAME = "journal.json"
+
+_journal_lock = threading.Lock()
+
+def get_work_dir(input_path, segments, settings):
+    """Рабочая папка задачи: ключ - источник (путь, размер, mtime), сегменты и настройки рендера"""
+    input_path = Path(input_path).resolve()
+    stat = input_path.stat()
+    key = json.dumps([str(input_path), stat.st_size, stat.st_mtime_ns, segments, settings], default=str)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return config.JOURNAL['work_dir'] / f"{input_path.stem}_{digest}"
+
+def file_sha256(path):
+    """sha256 файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load(work_dir):
+    """Готовые сегменты из журнала: {индекс: запись}"""
+    journal_path = Path(work_dir) / JOURNAL_NAME
+    if not journal_path.exists():
+        return {}
+    try:
+        entries = json.loads(journal_path.read_text())['segments']
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Журнал рендера поврежден, начинаем заново: {journal_path}: {e}")
+        return {}
+    return {int(index): entry for index, entry in entries.items()}
+
+def is_done(entries, index, segment_path):
+    """Сегмент готов: есть в журнале, файл на месте и контрольная сумма совпадает"""
+    entry = entries.get(index)
+    if not entry or not Path(segment_path).exists():
+        return False
+    if Path(segment_path).stat().st_size != entry['size']:
+        return False
+    if config.JOURNAL['verify_checksums'] and file_sha256(segment_path) != entry['sha256']:
+        logging.warning(f"Контрольная сумма сегмента не совпала, рендерим заново: {segment_path}")
+        return False
+    return True
+
+def mark_done(work_dir, index, segment_path):
+    """Отметить сегмент готовым (журнал перезаписывается атомарно)"""
+    entry = {
+        'path': str(segment_path),
+        'size': Path(segment_path).stat().st_size,
+        'sha256': file_sha256(segment_path)
+    }
+    journal_path = Path(work_dir) / JOURNAL_NAME
+    with _journal_lock:
+        entries = load(work_dir)
+        entries[index] = entry
+        temp_path = journal_path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps({'segments': entries}, indent=2))
+        os.replace(temp_path, journal_path)
+
+def remove(work_dir):
+    """Удалить рабочую папку после успешной склейки"""
+    shutil.rmtree(work_dir, ignore_errors=True)
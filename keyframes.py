@@ -0,0 +1,71 @@
+import json
+import logging
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+import catalog
+
+# Индекс ключевых кадров источника: строится одним проходом ffprobe по пакетам
+# и хранится в каталоге, пока у файла не изменились размер и время изменения
+
+def find_cached(connection, video_path, stat):
+    """Времена ключевых кадров из каталога, если файл с тех пор не менялся; иначе None"""
+    row = connection.execute(
+        "SELECT times FROM keyframes WHERE path = ? AND size = ? AND mtime_ns = ?",
+        (str(video_path), stat.st_size, stat.st_mtime_ns)
+    ).fetchone()
+    return json.loads(row['times']) if row else None
+
+def get_cached_keyframes(video_path):
+    """Времена ключевых кадров, только если индекс уже построен (без прохода ffprobe); иначе None"""
+    video_path = Path(video_path).resolve()
+    with catalog.connect() as connection:
+        return find_cached(connection, video_path, video_path.stat())
+
+def get_keyframes(video_path):
+    """Отсортированные времена ключевых кадров видео (из кэша или через ffprobe)"""
+    video_path = Path(video_path).resolve()
+    stat = video_path.stat()
+
+    with catalog.connect() as connection:
+        keyframe_times = find_cached(connection, video_path, stat)
+    if keyframe_times:
+        return keyframe_times
+
+    logging.info(f"Строится индекс ключевых кадров: {video_path}")
+    keyframe_times = catalog.probe_keyframe_times(video_path)
+    if not keyframe_times:
+        logging.warning(f"Не удалось построить индекс ключевых кадров: {video_path}")
+        return None
+
+    with catalog.connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO keyframes (path, size, mtime_ns, times) VALUES (?, ?, ?, ?)",
+            (str(video_path), stat.st_size, stat.st_mtime_ns, json.dumps(keyframe_times))
+        )
+    logging.info(f"Индекс ключевых кадров: {len(keyframe_times)} кадров")
+    return keyframe_times
+
+def keyframe_at_or_before(keyframe_times, time_point):
+    """Последний ключевой кадр не позже time_point"""
+    index = bisect_right(keyframe_times, time_point + 1e-3)
+    return keyframe_times[index - 1] if index else None
+
+def keyframe_after(keyframe_times, time_point):
+    """Первый ключевой кадр строго позже time_point"""
+    index = bisect_left(keyframe_times, time_point + 1e-3)
+    return keyframe_times[index] if index < len(keyframe_times) else None
+
+def snap_to_keyframe(keyframe_times, time_point, max_shift, latest=None):
+    """Ближайший к time_point ключевой кадр в пределах max_shift (и не позже latest); иначе само время"""
+    candidates = [
+        keyframe for keyframe in (keyframe_at_or_before(keyframe_times, time_point), keyframe_after(keyframe_times, time_point))
+        if keyframe is not None and abs(keyframe - time_point) <= max_shift and (latest is None or keyframe <= latest)
+    ]
+    if not candidates:
+        return time_point
+    return min(candidates, key=lambda keyframe: abs(keyframe - time_point))
+
+def is_keyframe(keyframe_times, time_point):
+    """Попадает ли время на ключевой кадр"""
+    keyframe = keyframe_at_or_before(keyframe_times, time_point)
+    return keyframe is not None and abs(keyframe - time_point) <= 1e-3
@@ -0,0 +1,140 @@
+import json
+import logging
+import functools
+import config
+
+# Шаблоны раскладки (config.LAYOUT_TEMPLATES) -> геометрия областей в кадре результата.
+# Из геометрии process_video.build_layout_filter собирает граф фильтров; скомпилированная
+# геометрия кэшируется по шаблону, областям источника и размеру кадра
+
+# Области источника, на которые ссылаются шаблоны (поле source)
+SOURCES = ('game', 'camera', 'subtitles')
+
+def get_source_area(source):
+    """Область кропа источника по имени"""
+    return {'game': config.GAME_AREA, 'camera': config.CAMERA_AREA, 'subtitles': config.SUBTITLES_AREA}[source]
+
+def even(value):
+    """Вниз до четного (размеры кадра yuv420p)"""
+    return int(value) // 2 * 2
+
+def get_region_size(region, area, canvas_width):
+    """Размер области: width - число, 'canvas' или размер кропа; height - число, 'area' или по пропорциям"""
+    width = canvas_width if region.get('width') == 'canvas' else region.get('width', area['width'])
+    height = region.get('height')
+    if height == 'area':
+        height = area['height']
+    elif height is None:
+        height = area['height'] if width == area['width'] else even(width * area['height'] / area['width'])
+    return width, height
+
+def compile_absolute(template, areas, canvas):
+    """Области на заданных позициях"""
+    geometry = []
+    for region in template['regions']:
+        area = areas[region['source']]
+        geometry.append({
+            'name': region.get('name', region['source']),
+            'area': area,
+            'position': dict(region.get('position', {'x': 0, 'y': 0})),
+            'size': get_region_size(region, area, canvas[0]),
+            'z': region.get('z', 0)
+        })
+    return geometry
+
+def compile_stack(template, areas, canvas):
+    """Области друг под другом по ширине кадра; если не помещаются по высоте - уменьшаются все одинаково"""
+    width, height = canvas
+    regions = template['regions']
+    heights = [areas[region['source']]['height'] * width / areas[region['source']]['width'] for region in regions]
+    factor = min(1.0, height / sum(heights))
+
+    # Позиции - по уже округленным размерам, чтобы области стояли вплотную (тогда хватает vstack)
+    sizes = [(even(width * factor), even(region_height * factor)) for region_height in heights]
+    y = (height - sum(size[1] for size in sizes)) // 2 if template.get('align', 'center') == 'center' else 0
+    geometry = []
+    for region, size in zip(regions, sizes):
+        geometry.append({
+            'name': region.get('name', region['source']),
+            'area': areas[region['source']],
+            'position': {'x': (width - size[0]) // 2, 'y': y},
+            'size': size,
+            'z': region.get('z', 0)
+        })
+        y += size[1]
+    return geometry
+
+@functools.lru_cache(maxsize=64)
+def compile_cached(key):
+    """Компиляция по ключу (JSON шаблона, областей источника и размера кадра)"""
+    template, areas, canvas = json.loads(key)
+    compiler = compile_stack if template.get('arrange') == 'stack' else compile_absolute
+    geometry = compiler(template, areas, tuple(canvas))
+    # Порядок наложения - по z, при равенстве - по порядку в шаблоне
+    geometry.sort(key=lambda region: region['z'])
+    for region in geometry:
+        del region['z']
+        region['size'] = tuple(region['size'])
+    return tuple(geometry)
+
+def compile_layout(name, canvas=None):
+    """Геометрия шаблона name для кадра canvas (ширина, высота); порядок списка - порядок наложения"""
+    canvas = canvas or (config.OUTPUT_VIDEO['width'], config.OUTPUT_VIDEO['height'])
+    areas = {source: get_source_area(source) for source in SOURCES}
+    key = json.dumps([config.LAYOUT_TEMPLATES[name], areas, list(canvas)], sort_keys=True)
+    return list(compile_cached(key))
+
+def scale_geometry(geometry, factor):
+    """Геометрия для кадра в factor раз меньше (области кропа не меняются)"""
+    return [
+        dict(region,
+             position={'x': region['position']['x'] // factor, 'y': region['position']['y'] // factor},
+             size=tuple(max(2, even(size / factor)) for size in region['size']))
+        for region in geometry
+    ]
+
+def get_vertical_stack(geometry, canvas):
+    """Если области стоят вплотную друг под другом одной ширины внутри кадра - (x, y) верха стопки, иначе None
+
+    Такую раскладку можно собрать через vstack и pad/один overlay вместо наложения каждой области на фон.
+    """
+    ordered = sorted(geometry, key=lambda region: region['position']['y'])
+    first = ordered[0]
+    x, y = first['position']['x'], first['position']['y']
+    bottom = y
+    for region in ordered:
+        if region['position']['x'] != x or region['size'][0] != first['size'][0] or region['position']['y'] != bottom:
+            return None
+        bottom += region['size'][1]
+    if x < 0 or y < 0 or x + first['size'][0] > canvas[0] or bottom > canvas[1]:
+        return None
+    return x, y
+
+def validate_template(name, source_width, source_height, canvas=None):
+    """Шаблон подходит к источнику: области кропа внутри кадра источника, области результата видны в кадре"""
+    canvas = canvas or (config.OUTPUT_VIDEO['width'], config.OUTPUT_VIDEO['height'])
+    valid = True
+    template = config.LAYOUT_TEMPLATES.get(name)
+    if not template:
+        logging.error(f"Шаблон раскладки {name} не найден в LAYOUT_TEMPLATES")
+        return False
+    for region in template['regions']:
+        if region.get('source') not in SOURCES:
+            logging.error(f"Шаблон {name}: неизвестная область {region.get('source')} (допустимо: {', '.join(SOURCES)})")
+            return False
+
+    for region in compile_layout(name, canvas):
+        area = region['area']
+        width, height = region['size']
+        position = region['position']
+        if area['x'] < 0 or area['y'] < 0 or area['x'] + area['width'] > source_width or area['y'] + area['height'] > source_height:
+            logging.error(f"Шаблон {name}: область {region['name']} выходит за границы видео {source_width}x{source_height}")
+            valid = False
+        if width <= 0 or height <= 0:
+            logging.error(f"Шаблон {name}: у области {region['name']} пустой размер {width}x{height}")
+            valid = False
+        elif (position['x'] >= canvas[0] or position['y'] >= canvas[1]
+              or position['x'] + width <= 0 or position['y'] + height <= 0):
+            logging.error(f"Шаблон {name}: область {region['name']} целиком вне кадра {canvas[0]}x{canvas[1]}")
+            valid = False
+    return valid
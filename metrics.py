@@ -0,0 +1,73 @@
+import os
+import json
+import threading
+import contextvars
+from datetime import datetime
+import config
+
+# Структурированные метрики рендера: одна JSON-строка на этап (вызов ffmpeg) и на задачу
+# в файле рядом с processing.log - для графиков скорости во времени
+
+# Имя текущей задачи планировщика - попадает в записи этапов
+current_job = contextvars.ContextVar('current_job', default=None)
+
+_write_lock = threading.Lock()
+
+def write_record(record):
+    """Дописать запись метрик в JSONL"""
+    if not config.METRICS['enabled']:
+        return
+    record = {'time': datetime.now().isoformat(timespec='seconds'), 'job': current_job.get(), **record}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        with open(config.METRICS['metrics_file'], 'a', encoding='utf-8') as metrics_file:
+            metrics_file.write(line + '\n')
+
+def read_proc_file(pid, name):
+    """Содержимое /proc/<pid>/<name> или None (процесс завершился / не Linux)"""
+    try:
+        with open(f"/proc/{pid}/{name}") as proc_file:
+            return proc_file.read()
+    except OSError:
+        return None
+
+def sample_process(pid):
+    """Снимок ресурсов работающего процесса из /proc: CPU, пиковая память, ввод-вывод
+
+    Для живого прогресса: снимается с интервалом опроса и после выхода процесса недоступен.
+    Итог этапа - rusage_stats по os.wait4.
+    """
+    sample = {}
+
+    stat = read_proc_file(pid, 'stat')
+    if stat:
+        # Поля после имени процесса (оно в скобках и может содержать пробелы)
+        fields = stat.rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        sample['cpu_seconds'] = (int(fields[11]) + int(fields[12])) / ticks
+
+    status = read_proc_file(pid, 'status')
+    if status:
+        for line in status.splitlines():
+            if line.startswith('VmHWM:'):
+                sample['peak_rss_bytes'] = int(line.split()[1]) * 1024
+
+    io = read_proc_file(pid, 'io')
+    if io:
+        values = dict(line.split(': ') for line in io.splitlines() if ': ' in line)
+        sample['io_read_bytes'] = int(values.get('rchar', 0))
+        sample['io_write_bytes'] = int(values.get('wchar', 0))
+        sample['disk_read_bytes'] = int(values.get('read_bytes', 0))
+        sample['disk_write_bytes'] = int(values.get('write_bytes', 0))
+
+    return sample
+
+def rusage_stats(rusage):
+    """Итог ресурсов завершенного процесса по rusage из os.wait4: CPU, пиковая память, чтение и запись диска"""
+    return {
+        'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3),
+        # ru_maxrss в Linux - в килобайтах, ru_inblock/ru_oublock - в блоках по 512 байт
+        'peak_rss_bytes': rusage.ru_maxrss * 1024,
+        'disk_read_bytes': rusage.ru_inblock * 512,
+        'disk_write_bytes': rusage.ru_oublock * 512
+    }
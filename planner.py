@@ -0,0 +1,107 @@
+import random
+import logging
+import config
+import keyframes
+import scene_index
+import audio_analysis
+
+# Выбор временных окон для клипов
+
+# Сколько раз перевыбирать случайный старт, попавший на черный или статичный кусок
+RANDOM_ATTEMPTS = 20
+
+def snap_start_times(input_path, start_times, clip_duration, total_duration):
+    """Сдвиг стартов на ключевые кадры (GOP), если сдвиг не больше CUTTING['max_snap_shift']
+
+    Старт на ключевом кадре: seek не декодирует лишние кадры, а резка копированием точная.
+    """
+    cutting = config.CUTTING
+    if not cutting['snap_starts']:
+        return start_times
+
+    keyframe_times = keyframes.get_keyframes(input_path)
+    if not keyframe_times:
+        return start_times
+
+    latest_start = max(0, total_duration - clip_duration)
+    snapped = [
+        keyframes.snap_to_keyframe(keyframe_times, start_time, cutting['max_snap_shift'], latest=latest_start)
+        for start_time in start_times
+    ]
+
+    moved = sum(1 for before, after in zip(start_times, snapped) if abs(before - after) > 1e-3)
+    logging.info(f"Старты выровнены по ключевым кадрам: {moved}/{len(start_times)}")
+    return snapped
+
+def pick_random_starts(count, max_start_time, usable=None):
+    """Случайные старты; если задан usable - с несколькими попытками найти пригодное окно"""
+    start_times = []
+    for _ in range(count):
+        start_time = random.uniform(0, max_start_time)
+        for _ in range(RANDOM_ATTEMPTS if usable else 0):
+            if usable([start_time])[0]:
+                break
+            start_time = random.uniform(0, max_start_time)
+        start_times.append(start_time)
+    return start_times
+
+def plan_clip_windows(input_path, video_info, num_clips, clip_duration):
+    """Стартовые времена клипов (отсортированные)"""
+    total_duration = video_info['duration']
+    max_start_time = total_duration - clip_duration
+
+    # Черные и статичные куски (загрузочные экраны, паузы) не берем
+    scenes = scene_index.get_scene_index(input_path)
+    usable = (lambda starts: scene_index.usable_windows(scenes, starts, clip_duration)) if scenes else None
+
+    # Самые громкие и насыщенные событиями места по звуку
+    start_times = []
+    if video_info.get('has_audio', True):
+        start_times = audio_analysis.pick_highlight_windows(
+            input_path, total_duration, num_clips, clip_duration, usable
+        ) or []
+        if start_times and len(start_times) < num_clips:
+            logging.warning(
+                f"Непересекающихся окон по {clip_duration}с только {len(start_times)}, "
+                f"остальные {num_clips - len(start_times)} клипов - случайные"
+            )
+
+    # Генерируем рандомные стартовые времена (без анализа звука или если окон не хватило)
+    start_times += pick_random_starts(num_clips - len(start_times), max_start_time, usable)
+
+    if scenes:
+        # Окна, сдвинутые на склейку, не сдвигаются на ключевые кадры: иначе в клип попадет чужая сцена
+        start_times, on_cut = scene_index.snap_to_cuts(scenes, start_times, clip_duration, total_duration)
+        free = [index for index, snapped in enumerate(on_cut) if not snapped]
+        for index, start_time in zip(free, snap_start_times(
+                input_path, [start_times[i] for i in free], clip_duration, total_duration)):
+            start_times[index] = start_time
+    else:
+        start_times = snap_start_times(input_path, start_times, clip_duration, total_duration)
+
+    # Сортируем времена для удобства
+    start_times.sort()
+    return start_times
+
+def plan_segments(input_path, total_duration):
+    """Границы сегментов параллельного рендера: [(начало, конец)], начала - на ключевых кадрах
+
+    Сегмент, начатый с ключевого кадра, декодируется с точного места, поэтому
+    стыки получаются без пропущенных и повторных кадров.
+    """
+    keyframe_times = keyframes.get_keyframes(input_path)
+    if not keyframe_times:
+        return None
+
+    segment_duration = config.SEGMENTED['segment_duration']
+    boundaries = [0.0]
+    target = segment_duration
+    # Последний сегмент не короче половины обычного
+    while target < total_duration - segment_duration / 2:
+        keyframe = keyframes.keyframe_at_or_before(keyframe_times, target)
+        if keyframe is not None and keyframe > boundaries[-1] + 1e-3:
+            boundaries.append(keyframe)
+        target += segment_duration
+    boundaries.append(total_duration)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
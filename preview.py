@@ -0,0 +1,154 @@
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+import config
+import utils
+import layouts
+import keyframes
+import process_video
+
+# Быстрое превью для подбора GAME_AREA/CAMERA_AREA/SUBTITLES_AREA: один seek на ключевой кадр,
+# декодируется только он. Из этого кадра один ffmpeg делает кадр источника
+# с рамками областей и раскладку в 1/PREVIEW['scale'] размера - вместо полного рендера 15 секунд
+
+def get_preview_paths(input_path, time_point, layout, clip=False):
+    """Файлы превью: {'regions': кадр с рамками, 'layout': раскладка} (перезаписываются при каждом запуске)"""
+    preview_dir = config.PREVIEW['dir']
+    name = f"{Path(input_path).stem}_{time_point:.1f}"
+    return {
+        'regions': preview_dir / f"{name}_regions.jpg",
+        'layout': preview_dir / f"{name}_{layout}.{'mp4' if clip else 'jpg'}"
+    }
+
+def get_seek_time(input_path, time_point):
+    """Время ключевого кадра не позже time_point, если индекс ключевых кадров уже построен; иначе само time_point
+
+    Индекс здесь не строится: полный проход ffprobe дольше самого превью, а -noaccurate_seek
+    с -skip_frame nokey и так попадают на этот ключевой кадр - индекс нужен только для имени файла.
+    """
+    keyframe_times = keyframes.get_cached_keyframes(input_path)
+    keyframe = keyframes.keyframe_at_or_before(keyframe_times, time_point) if keyframe_times else None
+    return time_point if keyframe is None else keyframe
+
+def build_regions_filter(source_label):
+    """Рамки областей кропа на кадре источника -> [regions]"""
+    preview = config.PREVIEW
+    boxes = []
+    for source in layouts.SOURCES:
+        area = layouts.get_source_area(source)
+        boxes.append(
+            f"drawbox=x={area['x']}:y={area['y']}:w={area['width']}:h={area['height']}"
+            f":color={preview['colors'][source]}:t={preview['line_width']}"
+        )
+    return f"[{source_label}]{','.join(boxes)}[regions]"
+
+def render_preview(input_path, time_point, layout='main', clip=False, with_layout=True):
+    """Превью областей и раскладки на time_point; clip - раскладка клипом PREVIEW['clip_duration'] секунд"""
+    preview = config.PREVIEW
+    output_config = config.OUTPUT_VIDEO
+    seek_time = get_seek_time(input_path, time_point)
+    paths = get_preview_paths(input_path, seek_time, layout, clip)
+    paths['regions'].parent.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        # Без точного seek декодирование начинается прямо с ключевого кадра;
+        # для кадра остальные кадры не декодируются вовсе
+        *([] if clip else ['-skip_frame', 'nokey']),
+        '-ss', str(seek_time),
+        '-noaccurate_seek',
+        '-an', '-sn', '-dn',
+        '-i', str(input_path),
+    ]
+
+    if not with_layout:
+        cmd.extend(['-filter_complex', build_regions_filter('0:v')])
+    else:
+        canvas = (output_config['width'] // preview['scale'], output_config['height'] // preview['scale'])
+        geometry = layouts.scale_geometry(process_video.get_layout_geometry(layout == 'clip'), preview['scale'])
+        # Фон в размере превью - из того же кэша подготовленных фонов
+        bg_image = process_video.get_background(*canvas)
+        if bg_image:
+            cmd.extend(['-i', str(bg_image)])
+        cmd.extend(['-filter_complex', ';'.join([
+            "[0:v]split=2[regions_src][layout_src]",
+            build_regions_filter('regions_src'),
+            process_video.build_layout_filter(
+                geometry,
+                source_input='layout_src',
+                bg_input='1:v' if bg_image else None,
+                duration=preview['clip_duration'] if clip else None,
+                bg_static=True,
+                canvas=canvas
+            )
+        ])])
+    cmd.extend(['-map', '[regions]', '-frames:v', '1', '-update', '1', '-q:v', '2', '-y', str(paths['regions'])])
+
+    if with_layout and clip:
+        cmd.extend([
+            '-map', '[final]',
+            '-c:v', config.FFMPEG_PARAMS['codec'],
+            '-preset', 'ultrafast',
+            '-crf', str(preview['crf']),
+            '-r', str(output_config['fps']),
+            '-t', str(preview['clip_duration']),
+            '-y', str(paths['layout'])
+        ])
+    elif with_layout:
+        cmd.extend(['-map', '[final]', '-frames:v', '1', '-update', '1', '-q:v', '2', '-y', str(paths['layout'])])
+    else:
+        del paths['layout']
+
+    render_start = time.monotonic()
+    if not process_video.run_ffmpeg_command(cmd, f"Превью {seek_time:.2f}с ({layout})"):
+        return False
+    logging.info(
+        f"Превью готово за {time.monotonic() - render_start:.2f}с: {', '.join(str(path) for path in paths.values())}"
+    )
+    return True
+
+def preview_video(input_path, time_points=None, layout='main', clip=False):
+    """Превью на нескольких моментах видео (по умолчанию - середина)"""
+    # Информация о видео из каталога: ffprobe только для новых файлов
+    video_info = utils.get_video_info(input_path)
+    if not video_info:
+        logging.error("Не удалось получить информацию о видео")
+        return False
+
+    # С неверными областями раскладку не собрать, но рамки показывают, что не так
+    with_layout = (utils.validate_crop_coordinates(video_info['width'], video_info['height'])
+                   and layouts.validate_template(layout, video_info['width'], video_info['height']))
+    if not with_layout:
+        logging.warning("Области кропа некорректны - превью только с рамками областей")
+
+    time_points = time_points or [video_info['duration'] / 2]
+    results = []
+    for time_point in time_points:
+        if not 0 <= time_point < video_info['duration']:
+            logging.error(f"Время {time_point}с вне видео (длительность {video_info['duration']:.2f}с)")
+            results.append(False)
+            continue
+        results.append(render_preview(input_path, time_point, layout, clip, with_layout))
+    return all(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Быстрое превью областей кропа и раскладки")
+    parser.add_argument('--input', type=Path, help="Исходное видео (по умолчанию - последнее в input/)")
+    parser.add_argument('--at', type=float, nargs='+', help="Моменты видео, сек (по умолчанию - середина)")
+    parser.add_argument('--layout', choices=['main', 'clip'], default='main', help="Шаблон раскладки")
+    parser.add_argument('--clip', action='store_true', help="Раскладка клипом вместо одного кадра")
+    args = parser.parse_args()
+
+    utils.setup_logging()
+    utils.create_directories()
+    video_path = args.input or utils.find_latest_video()
+    if not video_path:
+        logging.error("Видео для обработки не найдено")
+        sys.exit(1)
+    sys.exit(0 if preview_video(video_path, args.at, args.layout, args.clip) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,49 @@
 #!/usr/bin/env python3
-import subprocess
+import os
+import sys
+import asyncio
+import argparse
 import logging
 import tempfile
-import random
+import hashlib
+import threading
 from pathlib import Path
 import config
 import utils
+import scheduler
+import keyframes
+import planner
+import journal
+import render_cache
+import layouts
+import compositor
+import camera_tracking
+import ffmpeg_runner
+from ffmpeg_runner import get_ffmpeg_command
 
-def run_ffmpeg_command(cmd, description=""):
-    """Выполнение команды FFmpeg с логированием"""
+# Где искать фоновое изображение
+BACKGROUND_SEARCH_DIRS = [Path('.'), Path('./input'), Path('./test')]
+
+# Подготовленный фон на пакет: (состояние папок, ширина, высота) -> путь или None
+_background_cache = {}
+_background_lock = threading.Lock()
+
+def run_ffmpeg_command(cmd, description="", expected_duration=None):
+    """Выполнение команды FFmpeg с логированием, прогрессом и метриками этапа"""
     logging.info(f"Выполняется: {description}")
     
-    # Используем локальный ffmpeg если он есть
     if cmd[0] == 'ffmpeg':
-        ffmpeg_path = Path(__file__).parent / 'ffmpeg'
-        if ffmpeg_path.exists():
-            cmd[0] = str(ffmpeg_path)
+        cmd[0] = get_ffmpeg_command()
     
     logging.debug(f"Команда: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # stderr читается потоком в ограниченный буфер, зависший ffmpeg убивается по таймауту
+        result = ffmpeg_runner.run(cmd, description=description, progress=True,
+                                   expected_duration=expected_duration)
         
-        if result.returncode != 0:
-            logging.error(f"Ошибка FFmpeg: {result.stderr}")
+        if result['returncode'] != 0:
+            logging.error(f"Ошибка FFmpeg: {result['stderr']}")
             return False
         
         logging.info(f"Успешно: {description}")
@@ -33,12 +53,36 @@ def run_ffmpeg_command(cmd, description=""):
         logging.error(f"Ошибка выполнения команды: {e}")
         return False
 
+def get_thread_args(threads, inputs=1, outputs=1):
+    """Параметры ffmpeg для ограничения потоков одной задачи: (глобальные, для каждого декодера, для каждого энкодера)
+
+    Каждый декодер, граф фильтров и каждый энкодер занимают минимум один поток - меньше ffmpeg не может.
+    Потоки бюджета сверх этого минимума делятся по PARALLEL['thread_shares'] (доля декодеров - поровну
+    между inputs входами, доля энкодеров - между outputs выходами), остаток от округления - энкодерам.
+    Если бюджет не больше числа стадий, лишних потоков нет ни у одной: сумма не превышает минимума.
+    """
+    if not threads:
+        return [], [], []  # ffmpeg сам решает сколько потоков брать
+    shares = config.PARALLEL['thread_shares']
+    total = sum(shares.values())
+    spare = max(0, threads - inputs - 1 - outputs)
+    decoder_extra = spare * shares['decoder'] // total // inputs
+    filter_extra = spare * shares['filter'] // total
+    encoder_extra = (spare - decoder_extra * inputs - filter_extra) // outputs
+    decoder_threads = 1 + decoder_extra
+    filter_threads = 1 + filter_extra
+    encoder_threads = 1 + encoder_extra
+    return (
+        ['-filter_threads', str(filter_threads), '-filter_complex_threads', str(filter_threads)],
+        ['-threads', str(decoder_threads)],
+        ['-threads', str(encoder_threads)]
+    )
+
 def find_background_image():
     """Поиск фонового изображения"""
     bg_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
-    search_dirs = [Path('.'), Path('./input'), Path('./test')]
     
-    for search_dir in search_dirs:
+    for search_dir in BACKGROUND_SEARCH_DIRS:
         if not search_dir.exists():
             continue
         for file_path in search_dir.iterdir():
@@ -51,8 +95,64 @@ def find_background_image():
     logging.warning("Фоновое изображение не найдено, будет использован серый фон")
     return None
 
-def create_time_fragment(input_path, output_path, start_time, duration):
+def get_background_signature():
+    """Состояние папок поиска фона: меняется при добавлении, удалении и переименовании файлов"""
+    signature = []
+    for search_dir in BACKGROUND_SEARCH_DIRS:
+        if search_dir.exists():
+            signature.append((str(search_dir), search_dir.stat().st_mtime_ns))
+    return tuple(signature)
+
+def prescale_background(bg_image, width, height):
+    """Фон, заранее отмасштабированный под размер видео; кэш на диске по хэшу содержимого и размеру"""
+    content_hash = hashlib.sha256(Path(bg_image).read_bytes()).hexdigest()[:16]
+    cache_dir = config.CACHE_DIR / 'backgrounds'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cached_path = cache_dir / f"{content_hash}_{width}x{height}.png"
+    
+    if cached_path.exists():
+        return cached_path
+    
+    # Пишем во временный файл и переименовываем - параллельные задачи не увидят недописанный фон
+    temp_path = cache_dir / f".{content_hash}_{width}x{height}_{os.getpid()}_{threading.get_ident()}.png"
+    cmd = [
+        'ffmpeg',
+        '-i', str(bg_image),
+        '-vf', f"scale={width}:{height}",
+        '-frames:v', '1',
+        '-y',
+        str(temp_path)
+    ]
+    if not run_ffmpeg_command(cmd, f"Подготовка фона {width}x{height}"):
+        utils.cleanup_temp_files([temp_path])
+        return None
+    
+    temp_path.replace(cached_path)
+    return cached_path
+
+def get_background(width=None, height=None):
+    """Фон для рендера: поиск и масштабирование выполняются один раз на пакет, а не на каждый рендер"""
+    width = width or config.OUTPUT_VIDEO['width']
+    height = height or config.OUTPUT_VIDEO['height']
+    key = (get_background_signature(), width, height)
+    
+    with _background_lock:
+        if key not in _background_cache:
+            bg_image = find_background_image()
+            if bg_image:
+                # Если подготовить не удалось - используем исходное изображение, граф его отмасштабирует
+                bg_image = prescale_background(bg_image, width, height) or bg_image
+            _background_cache[key] = bg_image
+        return _background_cache[key]
+
+def create_time_fragment(input_path, output_path, start_time, duration, temp_dir=None):
     """Создание временного фрагмента из исходного видео"""
+    if config.CUTTING['mode'] == 'smart':
+        return create_time_fragment_smart(input_path, output_path, start_time, duration, temp_dir)
+    return create_time_fragment_copy(input_path, output_path, start_time, duration)
+
+def create_time_fragment_copy(input_path, output_path, start_time, duration):
+    """Фрагмент копированием потоков (старт прилипает к предыдущему ключевому кадру)"""
     cmd = [
         'ffmpeg',
         '-ss', str(start_time),
@@ -63,175 +163,1126 @@ def create_time_fragment(input_path, output_path, start_time, duration):
         str(output_path)
     ]
     
-    return run_ffmpeg_command(cmd, f"Создание временного фрагмента ({duration}с с {start_time:.2f}с)")
+    return run_ffmpeg_command(cmd, f"Создание временного фрагмента ({duration}с с {start_time:.2f}с)", duration)
 
-def crop_area(input_path, output_path, area_config, area_name):
+def create_time_fragment_smart(input_path, output_path, start_time, duration, temp_dir=None):
+    """Точный фрагмент без полного перекодирования: перекодируется только неполный первый GOP,
+    остальное копируется с ключевого кадра
+    
+    Экспериментально (CUTTING['mode'] = 'smart'): на стыке немонотонный dts, у начала и хвоста
+    разные SPS в одной дорожке mp4, звук частей кодируется отдельно.
+    """
+    ffmpeg_params = config.FFMPEG_PARAMS
+    keyframe_times = keyframes.get_keyframes(input_path)
+    video_info = utils.get_video_info(input_path)
+    
+    # Склейка копированием проверена только для H.264
+    if not keyframe_times or not video_info or video_info.get('codec') != 'h264':
+        logging.info("Умная резка недоступна для этого источника, режем копированием")
+        return create_time_fragment_copy(input_path, output_path, start_time, duration)
+    
+    end_time = start_time + duration
+    if keyframes.is_keyframe(keyframe_times, start_time):
+        # Старт уже на границе GOP - копирование точное
+        return create_time_fragment_copy(input_path, output_path, start_time, duration)
+    
+    encode_args = [
+        '-c:v', ffmpeg_params['codec'],
+        '-preset', ffmpeg_params['preset'],
+        '-crf', str(ffmpeg_params['crf']),
+        '-c:a', 'aac',
+    ]
+    
+    next_keyframe = keyframes.keyframe_after(keyframe_times, start_time)
+    if next_keyframe is None or next_keyframe >= end_time:
+        # Весь фрагмент внутри одного GOP - перекодируем его целиком
+        cmd = ['ffmpeg', '-ss', str(start_time), '-i', str(input_path), '-t', str(duration), *encode_args, '-y', str(output_path)]
+        return run_ffmpeg_command(cmd, f"Создание временного фрагмента ({duration}с с {start_time:.2f}с)", duration)
+    
+    temp_files = []
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as head:
+            head_path = Path(head.name)
+            temp_files.append(head_path)
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as tail:
+            tail_path = Path(tail.name)
+            temp_files.append(tail_path)
+        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w', dir=temp_dir) as concat_list:
+            concat_list.write(f"file '{head_path}'\nfile '{tail_path}'\n")
+            concat_list_path = Path(concat_list.name)
+            temp_files.append(concat_list_path)
+        
+        # Неполный первый GOP - перекодируем.
+        # h264_mp4toannexb кладет SPS/PPS в ключевые кадры, чтобы части с разными параметрами кодека склеивались копированием
+        cmd = [
+            'ffmpeg',
+            '-ss', str(start_time),
+            '-i', str(input_path),
+            '-t', str(next_keyframe - start_time),
+            *encode_args,
+            '-bsf:v', 'h264_mp4toannexb',
+            '-y',
+            str(head_path)
+        ]
+        if not run_ffmpeg_command(cmd, f"Умная резка: начало до ключевого кадра ({next_keyframe - start_time:.2f}с)",
+                                  next_keyframe - start_time):
+            return False
+        
+        # Остальное с ключевого кадра - копируем, аудио дешево перекодируем для стыковки
+        cmd = [
+            'ffmpeg',
+            '-ss', f"{next_keyframe + 0.001:.3f}",  # Чуть позже кадра, чтобы seek не ушел на предыдущий GOP
+            '-i', str(input_path),
+            '-t', str(end_time - next_keyframe),
+            '-c:v', 'copy',
+            '-bsf:v', 'h264_mp4toannexb',
+            '-c:a', 'aac',
+            '-y',
+            str(tail_path)
+        ]
+        if not run_ffmpeg_command(cmd, f"Умная резка: копирование с {next_keyframe:.2f}с"):
+            return False
+        
+        cmd = [
+            'ffmpeg',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', str(concat_list_path),
+            '-c', 'copy',
+            '-y',
+            str(output_path)
+        ]
+        return run_ffmpeg_command(cmd, f"Создание временного фрагмента ({duration}с с {start_time:.2f}с, умная резка)", duration)
+        
+    finally:
+        utils.cleanup_temp_files(temp_files)
+
+def crop_area(input_path, output_path, area_config, area_name, threads=None):
     """Обрезка области из уже временного фрагмента"""
     ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads)
     cmd = [
         'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args,
         '-i', str(input_path),
         '-filter:v', f"crop={area_config['width']}:{area_config['height']}:{area_config['x']}:{area_config['y']}",
         '-c:v', ffmpeg_params['codec'],
         '-preset', ffmpeg_params['preset'],
         '-crf', str(ffmpeg_params['crf']),
         '-c:a', 'copy',
+        *encoder_thread_args,
         '-y',
         str(output_path)
     ]
     
     return run_ffmpeg_command(cmd, f"Обрезка области: {area_name}")
 
-def create_vertical_video(game_path, camera_path, subtitles_path, output_path):
+def get_layout_geometry(clip_layout=False):
+    """Геометрия областей в вертикальном видео по шаблону 'clip' или 'main' (порядок списка - порядок наложения)"""
+    return layouts.compile_layout('clip' if clip_layout else 'main')
+
+def get_profile_geometry(profile, clip_layout=False):
+    """Геометрия профиля вывода: шаблон профиля по его размеру, 'default' - основная раскладка (или раскладка клипов)"""
+    if profile.get('layout', 'default') == 'default':
+        return get_layout_geometry(clip_layout)
+    return layouts.compile_layout(profile['layout'], (profile['width'], profile['height']))
+
+def build_layout_filter(geometry, region_inputs=None, source_input=None, bg_input=None, duration=None,
+                        bg_static=False, label_prefix='', canvas=None):
+    """Сборка filter_complex вертикального видео
+    
+    region_inputs - уже обрезанные потоки для каждой области (многошаговый рендер),
+    source_input - исходный поток, из которого области вырезаются через split/crop (однопроходный рендер).
+    bg_static - фон подан одним кадром и зацикливается внутри графа.
+    label_prefix - префикс меток, чтобы в одном графе можно было собрать несколько раскладок.
+    canvas - размер кадра (ширина, высота), по умолчанию из OUTPUT_VIDEO.
+    Результат - поток [<label_prefix>final].
+    """
+    output_config = config.OUTPUT_VIDEO
+    canvas_width, canvas_height = canvas or (output_config['width'], output_config['height'])
+    parts = []
+    
+    if source_input:
+        # Один декодированный поток раздаем на все области
+        split_outputs = ''.join(f"[{label_prefix}{region['name']}_src]" for region in geometry)
+        parts.append(f"[{source_input}]split={len(geometry)}{split_outputs}")
+    
+    for region in geometry:
+        area = region['area']
+        if source_input:
+            # Сначала кроп, потом масштаб: масштабируется только нужная область
+            filters = [camera_tracking.get_crop_filter(region, label_prefix)]
+            chain = f"[{label_prefix}{region['name']}_src]"
+        else:
+            filters = []
+            chain = f"[{region_inputs[region['name']]}]"
+        if tuple(region['size']) != (area['width'], area['height']):
+            filters.append(f"scale={region['size'][0]}:{region['size'][1]}")
+        parts.append(f"{chain}{','.join(filters) or 'null'}[{label_prefix}{region['name']}]")
+    
+    stack = layouts.get_vertical_stack(geometry, (canvas_width, canvas_height))
+    if stack and len(geometry) > 1 and not bg_input:
+        # Области вплотную друг под другом: одна стопка и pad до размера кадра вместо фона во весь кадр и наложений
+        inputs = ''.join(f"[{label_prefix}{region['name']}]"
+                         for region in sorted(geometry, key=lambda region: region['position']['y']))
+        parts.append(
+            f"{inputs}vstack=inputs={len(geometry)},"
+            # scale подгоняет размер с неквадратным SAR - он прошел бы через vstack и pad в результат
+            f"pad={canvas_width}:{canvas_height}:{stack[0]}:{stack[1]}:color=#808080,setsar=1[{label_prefix}final]"
+        )
+        return ';'.join(parts)
+    
+    if bg_input and bg_static:
+        # Один кадр фона масштабируется один раз (для подготовленного фона - без изменений)
+        # и повторяется без повторного декодирования
+        parts.append(
+            f"[{bg_input}]scale={canvas_width}:{canvas_height},"
+            f"loop=loop=-1:size=1:start=0,setpts=N/({output_config['fps']}*TB)[{label_prefix}bg]"
+        )
+    elif bg_input:
+        # С фоновым изображением пушок
+        parts.append(f"[{bg_input}]scale={canvas_width}:{canvas_height}[{label_prefix}bg]")
+    else:
+        # Без фонового изображения - серый фон
+        color = f"color=c=#808080:size={canvas_width}x{canvas_height}:rate={output_config['fps']}"
+        if duration:
+            color += f":duration={duration}"
+        parts.append(f"{color}[{label_prefix}bg]")
+    
+    if stack and len(geometry) > 1:
+        # Стопка областей ложится на фон одним наложением
+        inputs = ''.join(f"[{label_prefix}{region['name']}]"
+                         for region in sorted(geometry, key=lambda region: region['position']['y']))
+        parts.append(f"{inputs}vstack=inputs={len(geometry)}[{label_prefix}stack]")
+        parts.append(f"[{label_prefix}bg][{label_prefix}stack]overlay={stack[0]}:{stack[1]}:shortest=1[{label_prefix}final]")
+        return ';'.join(parts)
+    
+    current = f"{label_prefix}bg"
+    for index, region in enumerate(geometry):
+        position = region['position']
+        label = f"{label_prefix}final" if index == len(geometry) - 1 else f"{label_prefix}bg_{index}"
+        parts.append(f"[{current}][{label_prefix}{region['name']}]overlay={position['x']}:{position['y']}:shortest=1[{label}]")
+        current = label
+    
+    return ';'.join(parts)
+
+def create_vertical_video(game_path, camera_path, subtitles_path, output_path, threads=None):
     """Создание вертикального видео из трех частей с фоном - основная функция"""
     output_config = config.OUTPUT_VIDEO
     ffmpeg_params = config.FFMPEG_PARAMS
-    layout = config.LAYOUT
     
-    # Вычисляем правильные размеры с сохранением пропорций
-    camera_original_ratio = config.CAMERA_AREA['width'] / config.CAMERA_AREA['height']  # 479/265 = 1.81
-    camera_width = output_config['width']  # 1080px
-    camera_height = int(camera_width / camera_original_ratio)  # 596px
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads, inputs=3)
     
-    game_original_height = config.GAME_AREA['height']  # 455px
-    subtitles_height = config.SUBTITLES_AREA['height']  # 265px
-    subtitles_width = output_config['width']  # 1080px
+    # Фон: найден и отмасштабирован один раз, в граф подается одним кадром
+    bg_image = get_background()
     
-    # Ищем фоновое изображение
-    bg_image = find_background_image()
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args, '-i', str(game_path),        # Игра
+        *decoder_thread_args, '-i', str(camera_path),      # Камера
+        *decoder_thread_args, '-i', str(subtitles_path),   # Субтитры
+    ]
+    if bg_image:
+        cmd.extend(['-i', str(bg_image)])   # Один кадр фона, зацикливается внутри графа
+    
+    filter_complex = build_layout_filter(
+        get_layout_geometry(),
+        region_inputs={'game': '0:v', 'camera': '1:v', 'subtitles': '2:v'},
+        bg_input='3:v' if bg_image else None,
+        bg_static=True
+    )
     
+    cmd.extend([
+        '-filter_complex', filter_complex,
+        '-map', '[final]',
+        '-map', '0:a',  # Аудио из игрового видео
+        '-c:v', ffmpeg_params['codec'],
+        '-preset', 'fast',
+        '-crf', str(ffmpeg_params['crf']),
+        '-r', str(output_config['fps']),
+        '-avoid_negative_ts', 'make_zero',
+        '-fflags', '+genpts',
+        '-shortest',  # Заканчиваем когда кончается самое короткое видео
+        *encoder_thread_args,
+        '-y',
+        str(output_path)
+    ])
+    
+    return run_ffmpeg_command(cmd, "Создание вертикального видео с пушком")
+
+def get_sidecar_paths(output_path):
+    """Пути дополнительных файлов клипа (только включенные в SIDECARS): {вид: путь}"""
+    sidecars = config.SIDECARS
+    if not sidecars['enabled']:
+        return {}
+    output_path = Path(output_path)
+    paths = {}
+    if sidecars['poster']['enabled']:
+        paths['poster'] = output_path.with_name(f"{output_path.stem}_poster.jpg")
+    if sidecars['preview']['enabled']:
+        paths['preview'] = output_path.with_name(f"{output_path.stem}_preview.{sidecars['preview']['format']}")
+    if sidecars['contact_sheet']['enabled']:
+        paths['contact_sheet'] = output_path.with_name(f"{output_path.stem}_sheet.jpg")
+    return paths
+
+def add_sidecar_branches(parts, final_label, output_path, duration, label_prefix=''):
+    """Постер, превью и контакт-лист - ветки уже собранного кадра, без повторного декодирования результата
+    
+    Дописывает фильтры в parts. Возвращает (метка потока для основного выхода, аргументы выходов sidecar).
+    """
+    sidecar_paths = get_sidecar_paths(output_path)
+    if not sidecar_paths:
+        return final_label, []
+    
+    sidecars = config.SIDECARS
+    main_label = f"{label_prefix}main"
+    parts.append(
+        f"[{final_label}]split={len(sidecar_paths) + 1}[{main_label}_src]"
+        + ''.join(f"[{label_prefix}{kind}_src]" for kind in sidecar_paths)
+    )
+    # Формат основного выхода закреплен: иначе ветки jpeg уводят весь граф в полный диапазон yuvj420p
+    parts.append(f"[{main_label}_src]format=yuv420p[{main_label}]")
+    
+    output_args = []
+    for kind, path in sidecar_paths.items():
+        source = f"{label_prefix}{kind}_src"
+        label = f"{label_prefix}{kind}"
+        if kind == 'poster':
+            time_point = min(sidecars['poster']['time'], max(0, duration - 0.1))
+            # Перевод в полный диапазон jpeg - внутри ветки постера
+            parts.append(
+                f"[{source}]trim=start={time_point:.3f},setpts=PTS-STARTPTS,"
+                f"scale=out_range=pc,format=yuvj420p[{label}]"
+            )
+            output_args.extend(['-map', f"[{label}]", '-frames:v', '1', '-q:v', '2', '-y', str(path)])
+        elif kind == 'preview':
+            preview = sidecars['preview']
+            preview_duration = min(preview['duration'], duration)
+            # Превью - из середины клипа
+            chain = (
+                f"[{source}]trim=start={(duration - preview_duration) / 2:.3f}:duration={preview_duration:.3f},"
+                f"setpts=PTS-STARTPTS,fps={preview['fps']},scale={preview['width']}:-2"
+            )
+            if preview['format'] == 'gif':
+                parts.append(
+                    f"{chain},split[{label}_a][{label}_b];[{label}_a]palettegen[{label}_palette];"
+                    f"[{label}_b][{label}_palette]paletteuse[{label}]"
+                )
+                output_args.extend(['-map', f"[{label}]", '-loop', '0', '-y', str(path)])
+            else:
+                parts.append(f"{chain}[{label}]")
+                output_args.extend(['-map', f"[{label}]", '-c:v', 'libwebp_anim', '-loop', '0',
+                                    '-quality', str(preview['quality']), '-y', str(path)])
+        else:
+            sheet = sidecars['contact_sheet']
+            frames = sheet['columns'] * sheet['rows']
+            # Кадры равномерно по всему клипу, склеенные в одну сетку
+            parts.append(
+                f"[{source}]fps={frames}/{duration:.3f},scale={sheet['width']}:-2:out_range=pc,format=yuvj420p,"
+                f"tile={sheet['columns']}x{sheet['rows']}[{label}]"
+            )
+            output_args.extend(['-map', f"[{label}]", '-frames:v', '1', '-q:v', '3', '-y', str(path)])
+    
+    return main_label, output_args
+
+def create_vertical_video_clip(game_path, camera_path, subtitles_path, output_path, duration, threads=None):
+    """Создание вертикального видео из трех частей с фоном (для клипов)"""
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads, inputs=3)
+    
+    # Фон: найден и отмасштабирован один раз, в граф подается одним кадром
+    bg_image = get_background()
+    
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args, '-i', str(game_path),        # Игра
+        *decoder_thread_args, '-i', str(camera_path),      # Камера
+        *decoder_thread_args, '-i', str(subtitles_path),   # Субтитры
+    ]
     if bg_image:
-        # С фоновым изображением пушок
-        cmd = [
-            'ffmpeg',
-            '-loop', '1', '-i', str(bg_image),  # Фоновое изображение
-            '-i', str(game_path),               # Игра
-            '-i', str(camera_path),             # Камера
-            '-i', str(subtitles_path),          # Субтитры
-            '-filter_complex', f"""
-            [0:v]scale={output_config['width']}:{output_config['height']}:force_original_aspect_ratio=disable[bg];
-            [1:v]fps={output_config['fps']}[game];
-            [2:v]fps={output_config['fps']},scale={camera_width}:{camera_height}:force_original_aspect_ratio=disable[camera];
-            [3:v]fps={output_config['fps']},scale={subtitles_width}:{subtitles_height}:force_original_aspect_ratio=disable[subtitles];
-            [bg][camera]overlay={layout['camera_position']['x']}:{layout['camera_position']['y']}:shortest=1[bg_with_camera];
-            [bg_with_camera][subtitles]overlay={layout['subtitles_position']['x']}:{layout['subtitles_position']['y']}:shortest=1[bg_with_camera_subs];
-            [bg_with_camera_subs][game]overlay={layout['game_position']['x']}:{layout['game_position']['y']}:shortest=1[final]
-            """.strip().replace('\n', '').replace('    ', ''),
-            '-map', '[final]',
-            '-map', '1:a',  # Аудио из игрового видео
+        cmd.extend(['-i', str(bg_image)])   # Один кадр фона, зацикливается внутри графа
+    
+    parts = [build_layout_filter(
+        get_layout_geometry(clip_layout=True),
+        region_inputs={'game': '0:v', 'camera': '1:v', 'subtitles': '2:v'},
+        bg_input='3:v' if bg_image else None,
+        duration=duration,
+        bg_static=True
+    )]
+    final_label, sidecar_args = add_sidecar_branches(parts, 'final', output_path, duration)
+    
+    cmd.extend([
+        '-filter_complex', ';'.join(parts),
+        '-map', f"[{final_label}]",
+        '-map', '0:a',  # Аудио из игрового видео
+        '-c:v', ffmpeg_params['codec'],
+        '-c:a', 'aac',
+        '-preset', 'fast',
+        '-crf', str(ffmpeg_params['crf']),
+        '-r', str(output_config['fps']),
+        '-t', str(duration),
+        '-shortest',
+        *encoder_thread_args,
+        '-y',
+        str(output_path),
+        *sidecar_args
+    ])
+    
+    return run_ffmpeg_command(cmd, f"Создание вертикального видео клипа ({duration}с)", duration)
+
+def create_vertical_video_single_pass(input_path, output_path, start_time, duration, clip_layout=False, threads=None,
+                                      frames=None, include_audio=True):
+    """Создание вертикального видео за один проход: один seek, одно декодирование, кроп внутри filter_complex
+    
+    frames - точное число кадров результата вместо -t (сегменты параллельного рендера стыкуются без дрейфа),
+    include_audio - False для сегментов: звук кодируется один раз при склейке.
+    """
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads)
+    
+    # Фон: найден и отмасштабирован один раз, в граф подается одним кадром
+    bg_image = get_background()
+    
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args,
+        '-ss', str(start_time),
+        # С точным числом кадров читаем с запасом, обрезает -frames:v
+        '-t', str(duration + 1 if frames else duration),
+        '-i', str(input_path),              # Исходное видео - декодируется один раз
+    ]
+    if bg_image:
+        cmd.extend(['-i', str(bg_image)])   # Один кадр фона, зацикливается внутри графа
+    
+    # Окно кропа камеры двигается за лицом (если включено слежение)
+    geometry = camera_tracking.track_geometry(get_layout_geometry(clip_layout), input_path, start_time, duration)
+    parts = [build_layout_filter(
+        geometry,
+        source_input='0:v',
+        bg_input='1:v' if bg_image else None,
+        duration=duration,
+        bg_static=True
+    )]
+    # Постер и превью - только для клипов
+    final_label, sidecar_args = add_sidecar_branches(parts, 'final', output_path, duration) if clip_layout else ('final', [])
+    
+    cmd.extend(['-filter_complex', ';'.join(parts), '-map', f"[{final_label}]"])
+    if include_audio:
+        cmd.extend(['-map', '0:a?', '-c:a', 'aac'])  # Аудио из исходного видео, если есть
+    cmd.extend([
+        '-c:v', ffmpeg_params['codec'],
+        '-preset', 'fast',
+        '-crf', str(ffmpeg_params['crf']),
+        '-r', str(output_config['fps']),
+        *(['-frames:v', str(frames)] if frames else ['-t', str(duration)]),
+        '-avoid_negative_ts', 'make_zero',
+        *encoder_thread_args,
+        '-y',
+        str(output_path),
+        *sidecar_args
+    ])
+    
+    return run_ffmpeg_command(cmd, f"Однопроходный рендер вертикального видео ({duration:.2f}с с {start_time:.2f}с)", duration)
+
+def create_vertical_video_profiles(input_path, output_paths, start_time, duration, clip_layout=False, threads=None):
+    """Несколько форматов (профили OUTPUT_PROFILES) одним ffmpeg: одно декодирование и один кроп,
+    дальше split на раскладку каждого профиля и свой энкодер на каждый выход
+    
+    output_paths - {имя профиля: путь результата}.
+    """
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads, outputs=len(output_paths))
+    profiles = [(name, config.OUTPUT_PROFILES[name]) for name in output_paths]
+    count = len(profiles)
+    
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args,
+        '-ss', str(start_time),
+        '-t', str(duration),
+        '-i', str(input_path),
+    ]
+    # Фон под размер каждого профиля подготавливается заранее (кэш), в граф - по одному кадру
+    backgrounds = [get_background(profile['width'], profile['height']) for _, profile in profiles]
+    bg_inputs = []
+    for bg_image in backgrounds:
+        if bg_image:
+            bg_inputs.append(f"{len(bg_inputs) + 1}:v")
+            cmd.extend(['-i', str(bg_image)])
+        else:
+            bg_inputs.append(None)
+    
+    # Каждая область вырезается один раз и раздается всем профилям
+    regions = get_profile_geometry(profiles[0][1], clip_layout)
+    parts = [f"[0:v]split={len(regions)}" + ''.join(f"[{region['name']}_src]" for region in regions)]
+    for region in regions:
+        area = region['area']
+        parts.append(
+            f"[{region['name']}_src]crop={area['width']}:{area['height']}:{area['x']}:{area['y']},"
+            f"split={count}" + ''.join(f"[{region['name']}_{index}]" for index in range(count))
+        )
+    
+    for index, (name, profile) in enumerate(profiles):
+        parts.append(build_layout_filter(
+            get_profile_geometry(profile, clip_layout),
+            region_inputs={region['name']: f"{region['name']}_{index}" for region in regions},
+            bg_input=bg_inputs[index],
+            duration=duration,
+            bg_static=True,
+            label_prefix=f"p{index}",
+            canvas=(profile['width'], profile['height'])
+        ))
+    
+    cmd.extend(['-filter_complex', ';'.join(parts)])
+    for index, (name, profile) in enumerate(profiles):
+        cmd.extend([
+            '-map', f"[p{index}final]",
+            '-map', '0:a?',
             '-c:v', ffmpeg_params['codec'],
+            '-c:a', 'aac',
             '-preset', 'fast',
             '-crf', str(ffmpeg_params['crf']),
             '-r', str(output_config['fps']),
-            '-avoid_negative_ts', 'make_zero',
-            '-fflags', '+genpts',
-            '-shortest',  # Заканчиваем когда кончается самое короткое видео
+            '-t', str(duration),
+            *encoder_thread_args,
             '-y',
-            str(output_path)
-        ]
-    else:
-        # Без фонового изображения - серый фон
-        filter_complex = f"""
-        [0:v]fps={output_config['fps']}[game];
-        [1:v]fps={output_config['fps']},scale={camera_width}:{camera_height}:force_original_aspect_ratio=disable[camera];
-        [2:v]fps={output_config['fps']},scale={subtitles_width}:{subtitles_height}:force_original_aspect_ratio=disable[subtitles];
-        color=c=#808080:size={output_config['width']}x{output_config['height']}:rate={output_config['fps']}[bg];
-        [bg][camera]overlay={layout['camera_position']['x']}:{layout['camera_position']['y']}:shortest=1[bg_with_camera];
-        [bg_with_camera][subtitles]overlay={layout['subtitles_position']['x']}:{layout['subtitles_position']['y']}:shortest=1[bg_with_camera_subs];
-        [bg_with_camera_subs][game]overlay={layout['game_position']['x']}:{layout['game_position']['y']}:shortest=1[final]
-        """.strip().replace('\n', '').replace('    ', '')
-        
-        cmd = [
-            'ffmpeg',
-            '-i', str(game_path),
-            '-i', str(camera_path),
-            '-i', str(subtitles_path),
-            '-filter_complex', filter_complex,
-            '-map', '[final]',
-            '-map', '0:a',
+            str(output_paths[name])
+        ])
+    
+    return run_ffmpeg_command(
+        cmd, f"Рендер форматов {', '.join(output_paths)} ({duration:.2f}с с {start_time:.2f}с)", duration
+    )
+
+def render_fragment_profiles(input_path, output_paths, start_time, duration, clip_layout=False, threads=None):
+    """Рендер фрагмента во всех форматах из output_paths; готовые берутся из кэша. Возвращает успех по каждому"""
+    cache_keys = {
+        name: render_cache.render_key(
+            input_path, start_time, duration,
+            # Рендер форматов sidecar-файлы не пишет - SIDECARS на результат не влияют
+            [*get_render_settings(clip_layout, with_sidecars=False), config.OUTPUT_PROFILES[name],
+             get_profile_geometry(config.OUTPUT_PROFILES[name], clip_layout)]
+        )
+        for name in output_paths
+    }
+    missing = {name: path for name, path in output_paths.items() if not render_cache.fetch(cache_keys[name], path)}
+    if not missing:
+        return [True] * len(output_paths)
+    
+    if not create_vertical_video_profiles(input_path, missing, start_time, duration, clip_layout, threads):
+        return [name not in missing for name in output_paths]
+    for name, path in missing.items():
+        render_cache.store(cache_keys[name], path)
+    return [True] * len(output_paths)
+
+def render_clip_profiles(input_path, start_time, duration, output_paths, threads=None):
+    """Один клип во всех форматах (результат - список из одного значения, как у render_clip_group)"""
+    return [all(render_fragment_profiles(input_path, output_paths, start_time, duration, clip_layout=True, threads=threads))]
+
+def create_vertical_clips_single_decode(input_path, windows, output_paths, has_audio=True, threads=None):
+    """Несколько клипов за одно декодирование: источник читается один раз по порядку времени,
+    каждое окно вырезается своей веткой trim и уходит в свой энкодер
+    
+    windows - отсортированные пары (старт, длительность) в секундах.
+    """
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads, outputs=len(windows))
+    
+    pass_start = windows[0][0]
+    pass_end = max(start + duration for start, duration in windows)
+    
+    # Фон: найден и отмасштабирован один раз, в граф подается одним кадром
+    bg_image = get_background()
+    
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        *decoder_thread_args,
+        '-ss', str(pass_start),
+        '-t', str(pass_end - pass_start),
+        '-i', str(input_path),              # Исходное видео - декодируется один раз на все клипы
+    ]
+    if bg_image:
+        cmd.extend(['-i', str(bg_image)])   # Один кадр фона, зацикливается внутри графа
+    
+    count = len(windows)
+    parts = [f"[0:v]split={count}" + ''.join(f"[v{i}]" for i in range(count))]
+    if has_audio:
+        parts.append(f"[0:a]asplit={count}" + ''.join(f"[a{i}]" for i in range(count)))
+    if bg_image:
+        parts.append(f"[1:v]split={count}" + ''.join(f"[bgsrc{i}]" for i in range(count)))
+    
+    geometry = get_layout_geometry(clip_layout=True)
+    for i, (start, duration) in enumerate(windows):
+        # Время внутри прохода отсчитывается от точки seek
+        clip_start = start - pass_start
+        clip_end = clip_start + duration
+        parts.append(f"[v{i}]trim=start={clip_start:.3f}:end={clip_end:.3f},setpts=PTS-STARTPTS[c{i}src]")
+        if has_audio:
+            parts.append(f"[a{i}]atrim=start={clip_start:.3f}:end={clip_end:.3f},asetpts=PTS-STARTPTS[c{i}a]")
+        parts.append(build_layout_filter(
+            camera_tracking.track_geometry(geometry, input_path, start, duration, label_prefix=f"c{i}"),
+            source_input=f"c{i}src",
+            bg_input=f"bgsrc{i}" if bg_image else None,
+            duration=duration,
+            bg_static=True,
+            label_prefix=f"c{i}"
+        ))
+    
+    final_labels = []
+    sidecar_args = []
+    for i, ((start, duration), output_path) in enumerate(zip(windows, output_paths)):
+        final_label, clip_sidecar_args = add_sidecar_branches(parts, f"c{i}final", output_path, duration, label_prefix=f"c{i}")
+        final_labels.append(final_label)
+        sidecar_args.extend(clip_sidecar_args)
+    
+    cmd.extend(['-filter_complex', ';'.join(parts)])
+    
+    for i, output_path in enumerate(output_paths):
+        cmd.extend(['-map', f"[{final_labels[i]}]"])
+        if has_audio:
+            cmd.extend(['-map', f"[c{i}a]", '-c:a', 'aac'])
+        cmd.extend([
             '-c:v', ffmpeg_params['codec'],
             '-preset', 'fast',
             '-crf', str(ffmpeg_params['crf']),
             '-r', str(output_config['fps']),
-            '-avoid_negative_ts', 'make_zero',
-            '-fflags', '+genpts',
-            '-shortest',  # Заканчиваем когда кончается самое короткое видео
+            *encoder_thread_args,
             '-y',
             str(output_path)
-        ]
+        ])
+    cmd.extend(sidecar_args)
     
-    return run_ffmpeg_command(cmd, "Создание вертикального видео с пушком")
+    return run_ffmpeg_command(
+        cmd, f"Рендер {count} клипов за одно декодирование ({pass_start:.2f}с - {pass_end:.2f}с)",
+        pass_end - pass_start
+    )
 
-def process_video(input_path, test_mode=False):
-    """Основная функция обработки видео"""
-    logging.info(f"Начинается обработка видео: {input_path}")
+def group_clip_windows(windows):
+    """Объединение окон клипов в проходы одного декодирования
     
-    # Получаем информацию о видео
-    video_info = utils.get_video_info(input_path)
-    if not video_info:
-        logging.error("Не удалось получить информацию о видео")
-        return False
+    Окна идут в одну группу, пока разрыв до следующего не больше max_gap:
+    декодировать короткий разрыв дешевле, чем делать новый seek.
+    """
+    multi_clip = config.MULTI_CLIP
+    groups = []
     
-    # Проверяем координаты кропа
-    if not utils.validate_crop_coordinates(video_info['width'], video_info['height']):
-        logging.error("Некорректные координаты кропа")
-        return False
+    for index, (start, duration) in sorted(enumerate(windows), key=lambda item: item[1][0]):
+        if groups:
+            group = groups[-1]
+            group_end = max(windows[i][0] + windows[i][1] for i in group)
+            if start - group_end <= multi_clip['max_gap'] and len(group) < multi_clip['max_clips_per_pass']:
+                group.append(index)
+                continue
+        groups.append([index])
+    
+    return groups
+
+def render_clip_group(input_path, windows, output_paths, has_audio=True, threads=None):
+    """Рендер группы клипов одним проходом; при ошибке - каждый клип отдельно. Возвращает успех по каждому клипу
+    
+    Клипы, которые уже есть в кэше, берутся оттуда и в проход не попадают.
+    """
+    settings = get_render_settings(clip_layout=True)
+    cache_keys = [render_cache.render_key(input_path, start, duration, settings) for start, duration in windows]
+    results = [render_cache.fetch(key, output_path, get_sidecar_paths(output_path))
+               for key, output_path in zip(cache_keys, output_paths)]
+    missing = [index for index, result in enumerate(results) if not result]
     
-    # Создаем временные файлы
+    if len(missing) > 1:
+        if create_vertical_clips_single_decode(
+            input_path, [windows[i] for i in missing], [output_paths[i] for i in missing], has_audio, threads
+        ):
+            for index in missing:
+                render_cache.store(cache_keys[index], output_paths[index], get_sidecar_paths(output_paths[index]))
+            return [True] * len(windows)
+        logging.warning("Рендер за одно декодирование не удался, рендерим клипы по отдельности")
+    
+    for index in missing:
+        start, duration = windows[index]
+        results[index] = render_fragment(input_path, output_paths[index], start, duration, clip_layout=True, threads=threads)
+    return results
+
+def render_fragment_multi_step(input_path, output_path, start_time, duration, clip_layout=False, threads=None):
+    """Многошаговый рендер через временные файлы: фрагмент -> три кропа -> склейка"""
+    # Промежуточные файлы - в RAM-папке, если влезают в бюджет
+    with utils.intermediate_dir(utils.estimate_intermediate_size(input_path, duration)) as temp_dir:
+        return render_fragment_with_temp_files(input_path, output_path, start_time, duration, clip_layout, threads, temp_dir)
+
+def render_fragment_with_temp_files(input_path, output_path, start_time, duration, clip_layout, threads, temp_dir):
+    """Шаги многошагового рендера с временными файлами в temp_dir"""
     temp_files = []
     try:
         # Временный фрагмент по времени
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as time_fragment:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as time_fragment:
             time_fragment_path = Path(time_fragment.name)
             temp_files.append(time_fragment_path)
         
         # Обрезанная игровая область
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as game_temp:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as game_temp:
             game_temp_path = Path(game_temp.name)
             temp_files.append(game_temp_path)
         
         # Обрезанная область камеры
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as camera_temp:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as camera_temp:
             camera_temp_path = Path(camera_temp.name)
             temp_files.append(camera_temp_path)
         
         # Обрезанная область субтитров
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as subtitles_temp:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=temp_dir) as subtitles_temp:
             subtitles_temp_path = Path(subtitles_temp.name)
             temp_files.append(subtitles_temp_path)
         
-        # ШАГ 1: Создаем временной фрагмент из оригинального видео
-        if test_mode:
-            start_time = utils.calculate_test_fragment_time(video_info['duration'])
-            duration = config.TEST_FRAGMENT['duration']
-        else:
-            start_time = 0
-            duration = video_info['duration']
+        crops = [
+            (config.GAME_AREA, "игровая", game_temp_path),
+            (config.CAMERA_AREA, "камера", camera_temp_path),
+            (config.SUBTITLES_AREA, "субтитры", subtitles_temp_path)
+        ]
+        # Кропы не зависят от раскладки: при ее смене берутся из кэша, а не режутся заново.
+        # Кропы длинных фрагментов (полное видео) не кэшируются - огромные и повторно почти не нужны
+        cache_crops = duration <= config.RENDER_CACHE['max_crop_seconds']
+        crop_keys = [render_cache.crop_key(input_path, start_time, duration, area) for area, _, _ in crops]
+        missing = [
+            (crop, key) for crop, key in zip(crops, crop_keys)
+            if not (cache_crops and render_cache.fetch(key, crop[2]))
+        ]
         
-        if not create_time_fragment(input_path, time_fragment_path, start_time, duration):
+        # ШАГ 1: Создаем временной фрагмент из оригинального видео (только если есть что резать)
+        if missing and not create_time_fragment(input_path, time_fragment_path, start_time, duration, temp_dir):
             logging.error("Ошибка создания временного фрагмента")
             return False
         
-        # ШАГ 2: Обрезаем игровую область из временного фрагмента
-        if not crop_area(time_fragment_path, game_temp_path, config.GAME_AREA, "игровая"):
-            logging.error("Ошибка обрезки игровой области")
-            return False
+        # ШАГИ 2-4: Обрезаем игровую область, камеру и субтитры из временного фрагмента
+        for (area, area_name, crop_path), key in missing:
+            if not crop_area(time_fragment_path, crop_path, area, area_name, threads):
+                logging.error(f"Ошибка обрезки области: {area_name}")
+                return False
+            if cache_crops:
+                render_cache.store(key, crop_path)
         
-        # ШАГ 3: Обрезаем область с камерой из временного фрагмента
-        if not crop_area(time_fragment_path, camera_temp_path, config.CAMERA_AREA, "камера"):
-            logging.error("Ошибка обрезки области с камерой")
-            return False
+        # ШАГ 5: Создаем вертикальное видео из трех обрезанных частей
+        if clip_layout:
+            return create_vertical_video_clip(game_temp_path, camera_temp_path, subtitles_temp_path, output_path, duration, threads)
+        return create_vertical_video(game_temp_path, camera_temp_path, subtitles_temp_path, output_path, threads)
         
-        # ШАГ 4: Обрезаем область субтитров из временного фрагмента
-        if not crop_area(time_fragment_path, subtitles_temp_path, config.SUBTITLES_AREA, "субтитры"):
-            logging.error("Ошибка обрезки области субтитров")
+    finally:
+        # Очищаем временные файлы
+        utils.cleanup_temp_files(temp_files)
+
+def render_fragment_piped(input_path, output_path, start_time, duration, clip_layout=False, threads=None):
+    """Многошаговый рендер без временных файлов: процесс резки и кропа отдает три области
+    сырым видео в NUT через stdout, процесс склейки читает их из stdin"""
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads)
+    geometry = get_layout_geometry(clip_layout)
+    
+    # ШАГ 1: фрагмент и кропы - одним процессом, результат в stdout
+    crop_chains = ';'.join(
+        f"[{region['name']}_src]crop={region['area']['width']}:{region['area']['height']}:"
+        f"{region['area']['x']}:{region['area']['y']}[{region['name']}]"
+        for region in geometry
+    )
+    split_outputs = ''.join(f"[{region['name']}_src]" for region in geometry)
+    producer_cmd = [
+        get_ffmpeg_command(),
+        *global_thread_args,
+        *decoder_thread_args,
+        '-ss', str(start_time),
+        '-t', str(duration),
+        '-i', str(input_path),
+        '-filter_complex', f"[0:v]split={len(geometry)}{split_outputs};{crop_chains}",
+    ]
+    for region in geometry:
+        producer_cmd.extend(['-map', f"[{region['name']}]"])
+    producer_cmd.extend([
+        '-map', '0:a?',
+        '-c:v', 'rawvideo',
+        '-c:a', 'pcm_s16le',
+        '-f', 'nut',
+        'pipe:1'
+    ])
+    
+    # ШАГ 2: склейка вертикального видео из потоков NUT
+    bg_image = get_background()
+    cmd = [
+        'ffmpeg',
+        *global_thread_args,
+        '-f', 'nut',
+        '-i', 'pipe:0',
+    ]
+    if bg_image:
+        cmd.extend(['-i', str(bg_image)])   # Один кадр фона, зацикливается внутри графа
+    
+    parts = [build_layout_filter(
+        geometry,
+        region_inputs={region['name']: f"0:v:{index}" for index, region in enumerate(geometry)},
+        bg_input='1:v' if bg_image else None,
+        duration=duration,
+        bg_static=True
+    )]
+    final_label, sidecar_args = add_sidecar_branches(parts, 'final', output_path, duration) if clip_layout else ('final', [])
+    
+    cmd.extend([
+        '-filter_complex', ';'.join(parts),
+        '-map', f"[{final_label}]",
+        '-map', '0:a?',
+        '-c:v', ffmpeg_params['codec'],
+        '-c:a', 'aac',
+        '-preset', 'fast',
+        '-crf', str(ffmpeg_params['crf']),
+        '-r', str(output_config['fps']),
+        '-t', str(duration),
+        *encoder_thread_args,
+        '-y',
+        str(output_path),
+        *sidecar_args
+    ])
+    
+    if cmd[0] == 'ffmpeg':
+        cmd[0] = get_ffmpeg_command()
+    
+    # Оба процесса работают одновременно в одном event loop и связаны через pipe
+    read_fd, write_fd = os.pipe()
+    
+    async def run_pipeline():
+        return await asyncio.gather(
+            ffmpeg_runner.run_async(producer_cmd, "Резка и кроп фрагмента в pipe", stdout=write_fd,
+                                    progress=True, expected_duration=duration),
+            ffmpeg_runner.run_async(cmd, "Склейка вертикального видео из pipe", stdin=read_fd,
+                                    progress=True, expected_duration=duration)
+        )
+    
+    logging.info(f"Выполняется: Рендер через pipe ({duration:.2f}с с {start_time:.2f}с)")
+    logging.debug(f"Команды: {' '.join(producer_cmd)} | {' '.join(cmd)}")
+    try:
+        producer_result, result = asyncio.run(run_pipeline())
+    except Exception as e:
+        logging.error(f"Ошибка выполнения команды: {e}")
+        return False
+    
+    if producer_result['returncode'] != 0:
+        logging.error(f"Ошибка FFmpeg (резка и кроп): {producer_result['stderr']}")
+        return False
+    if result['returncode'] != 0:
+        logging.error(f"Ошибка FFmpeg (склейка): {result['stderr']}")
+        return False
+    
+    logging.info("Успешно: Рендер через pipe")
+    return True
+
+def get_background_frame(width, height):
+    """Кадр фона в формате компоновщика (сырые байты); без фонового изображения - серый"""
+    bg_image = get_background(width, height)
+    source = ['-i', str(bg_image)] if bg_image else ['-f', 'lavfi', '-i', f"color=c=#808080:size={width}x{height}"]
+    cmd = [
+        get_ffmpeg_command(),
+        *source,
+        '-vf', f"scale={width}:{height},format={compositor.PIXEL_FORMAT}",
+        '-frames:v', '1',
+        '-f', 'rawvideo',
+        'pipe:1'
+    ]
+    result = ffmpeg_runner.run(cmd, description="Кадр фона для компоновщика", capture_stdout=True)
+    if result['returncode'] != 0:
+        logging.error(f"Ошибка подготовки кадра фона: {result['stderr']}")
+        return None
+    return result['stdout']
+
+def render_fragment_composited(input_path, output_path, start_time, duration, clip_layout=False, threads=None):
+    """Рендер через компоновщик (compositor.py): декодер -> атлас областей -> numpy -> энкодер
+    
+    Два ffmpeg связаны через Python: первый режет и масштабирует области и отдает их одним
+    кадром rawvideo, Python собирает кадр результата, второй ffmpeg кодирует его со звуком источника.
+    """
+    if not compositor.is_available():
+        return False
+    
+    output_config = config.OUTPUT_VIDEO
+    ffmpeg_params = config.FFMPEG_PARAMS
+    global_thread_args, decoder_thread_args, encoder_thread_args = get_thread_args(threads)
+    canvas = (output_config['width'], output_config['height'])
+    geometry = camera_tracking.track_geometry(get_layout_geometry(clip_layout), input_path, start_time, duration)
+    _, atlas_size = compositor.get_atlas_layout(geometry)
+    
+    background = get_background_frame(*canvas)
+    if background is None:
+        return False
+    engine = compositor.load_engine()(
+        geometry, canvas,
+        compositor.np.frombuffer(background, dtype=compositor.np.uint8).reshape(compositor.PLANES, canvas[1], canvas[0])
+    )
+    
+    decoder_cmd = [
+        get_ffmpeg_command(),
+        *global_thread_args,
+        *decoder_thread_args,
+        '-ss', str(start_time),
+        '-t', str(duration),
+        '-i', str(input_path),
+        '-filter_complex', compositor.build_atlas_filter(geometry, '0:v', output_config['fps']),
+        '-map', '[atlas]',
+        '-f', 'rawvideo',
+        'pipe:1'
+    ]
+    
+    parts = ["[0:v]format=yuv420p[final]"]
+    final_label, sidecar_args = add_sidecar_branches(parts, 'final', output_path, duration) if clip_layout else ('final', [])
+    encoder_cmd = [
+        get_ffmpeg_command(),
+        *global_thread_args,
+        '-f', 'rawvideo',
+        '-pix_fmt', compositor.PIXEL_FORMAT,
+        '-s', f"{canvas[0]}x{canvas[1]}",
+        '-r', str(output_config['fps']),
+        '-i', 'pipe:0',
+        '-ss', str(start_time),             # Звук - прямо из источника
+        '-t', str(duration),
+        '-i', str(input_path),
+        '-filter_complex', ';'.join(parts),
+        '-map', f"[{final_label}]",
+        '-map', '1:a?',
+        '-c:v', ffmpeg_params['codec'],
+        '-c:a', 'aac',
+        '-preset', 'fast',
+        '-crf', str(ffmpeg_params['crf']),
+        '-r', str(output_config['fps']),
+        '-t', str(duration),
+        '-avoid_negative_ts', 'make_zero',
+        *encoder_thread_args,
+        '-y',
+        str(output_path),
+        *sidecar_args
+    ]
+    
+    atlas_read_fd, atlas_write_fd = os.pipe()
+    frame_read_fd, frame_write_fd = os.pipe()
+    
+    async def run_pipeline():
+        return await asyncio.gather(
+            ffmpeg_runner.run_async(decoder_cmd, "Декодирование областей в атлас", stdout=atlas_write_fd,
+                                    progress=True, expected_duration=duration),
+            asyncio.to_thread(compositor.run_compose_loop, atlas_read_fd, frame_write_fd, atlas_size, engine),
+            ffmpeg_runner.run_async(encoder_cmd, "Кодирование кадров компоновщика", stdin=frame_read_fd,
+                                    progress=True, expected_duration=duration)
+        )
+    
+    logging.info(f"Выполняется: Рендер через компоновщик ({duration:.2f}с с {start_time:.2f}с)")
+    logging.debug(f"Команды: {' '.join(decoder_cmd)} | python | {' '.join(encoder_cmd)}")
+    try:
+        decoder_result, frames, encoder_result = asyncio.run(run_pipeline())
+    except Exception as e:
+        logging.error(f"Ошибка рендера через компоновщик: {e}")
+        return False
+    
+    if decoder_result['returncode'] != 0:
+        logging.error(f"Ошибка FFmpeg (декодирование областей): {decoder_result['stderr']}")
+        return False
+    if encoder_result['returncode'] != 0:
+        logging.error(f"Ошибка FFmpeg (кодирование): {encoder_result['stderr']}")
+        return False
+    
+    logging.info(f"Успешно: Рендер через компоновщик ({frames} кадров)")
+    return True
+
+def get_render_settings(clip_layout=False, with_sidecars=True):
+    """Все, что влияет на картинку результата: области, раскладка, параметры вывода и фон
+
+    SIDECARS входят в ключ только для клипов, у которых рендер пишет sidecar-файлы (with_sidecars).
+    """
+    background = get_background()
+    return [
+        config.GAME_AREA, config.CAMERA_AREA, config.SUBTITLES_AREA, config.LAYOUT,
+        config.OUTPUT_VIDEO, config.FFMPEG_PARAMS, get_layout_geometry(clip_layout),
+        Path(background).name if background else None,  # В имени подготовленного фона - хэш содержимого
+        config.SIDECARS if clip_layout and with_sidecars else None,
+        config.RENDER['mode'],  # Способы рендера дают разные файлы (и сравниваются в benchmark.py)
+        camera_tracking.get_settings()
+    ]
+
+def render_fragment(input_path, output_path, start_time, duration, clip_layout=False, threads=None):
+    """Рендер фрагмента исходного видео в вертикальный формат; готовый результат берется из кэша"""
+    cache_key = render_cache.render_key(input_path, start_time, duration, get_render_settings(clip_layout))
+    sidecar_paths = get_sidecar_paths(output_path) if clip_layout else {}
+    if render_cache.fetch(cache_key, output_path, sidecar_paths):
+        return True
+    
+    if not render_fragment_uncached(input_path, output_path, start_time, duration, clip_layout, threads):
+        return False
+    render_cache.store(cache_key, output_path, sidecar_paths)
+    return True
+
+def render_fragment_uncached(input_path, output_path, start_time, duration, clip_layout=False, threads=None):
+    """Рендер фрагмента исходного видео в вертикальный формат (способ задается в config.RENDER)"""
+    render_config = config.RENDER
+    
+    if render_config['mode'] == 'compositor':
+        if render_fragment_composited(input_path, output_path, start_time, duration, clip_layout, threads):
+            return True
+        if not render_config['fallback_to_multi_step']:
+            return False
+        logging.warning("Рендер через компоновщик не удался, пробуем многошаговый")
+    
+    if render_config['mode'] == 'single_pass':
+        if create_vertical_video_single_pass(input_path, output_path, start_time, duration, clip_layout, threads):
+            return True
+        if not render_config['fallback_to_multi_step']:
             return False
+        logging.warning("Однопроходный рендер не удался, пробуем многошаговый")
+    
+    if config.INTERMEDIATE['transport'] == 'pipe':
+        if render_fragment_piped(input_path, output_path, start_time, duration, clip_layout, threads):
+            return True
+        logging.warning("Многошаговый рендер через pipe не удался, пробуем через временные файлы")
+    
+    return render_fragment_multi_step(input_path, output_path, start_time, duration, clip_layout, threads)
+
+def concat_segments(segment_paths, input_path, output_path, duration, temp_dir):
+    """Склейка видеосегментов без перекодирования и звук из источника одним непрерывным проходом"""
+    list_path = Path(temp_dir) / "segments.txt"
+    list_path.write_text(''.join(f"file '{Path(path).resolve()}'\n" for path in segment_paths))
+    
+    cmd = [
+        'ffmpeg',
+        '-f', 'concat', '-safe', '0', '-i', str(list_path),
+        '-i', str(input_path),
+        '-map', '0:v',
+        '-map', '1:a?',  # Звук не режется по сегментам - на стыках нет щелчков и сдвигов
+        '-c:v', 'copy',
+        '-c:a', 'aac',
+        '-t', str(duration),
+        '-y',
+        str(output_path)
+    ]
+    return run_ffmpeg_command(cmd, f"Склейка {len(segment_paths)} сегментов", duration)
+
+def render_segment(input_path, segment_path, start_time, duration, frames, work_dir, index, threads=None):
+    """Рендер одного сегмента с отметкой в журнале (файл появляется под своим именем только целиком)"""
+    part_path = segment_path.with_name(f"{segment_path.stem}.part{segment_path.suffix}")
+    if not create_vertical_video_single_pass(input_path, part_path, start_time, duration, threads=threads,
+                                             frames=frames, include_audio=False):
+        return False
+    os.replace(part_path, segment_path)
+    journal.mark_done(work_dir, index, segment_path)
+    return True
+
+def render_segmented(input_path, output_path, duration):
+    """Параллельный рендер полного видео: сегменты по ключевым кадрам на пуле задач, затем склейка копированием
+    
+    Готовые сегменты записываются в журнал: после падения повторный запуск рендерит только недостающие.
+    """
+    segments = planner.plan_segments(input_path, duration)
+    if not segments or len(segments) < 2:
+        logging.warning("Не удалось разбить видео на сегменты по ключевым кадрам")
+        return False
+    
+    fps = config.OUTPUT_VIDEO['fps']
+    # Смена настроек или фона делает старые сегменты непригодными - у них другая рабочая папка
+    work_dir = journal.get_work_dir(input_path, segments, get_render_settings())
+    work_dir.mkdir(parents=True, exist_ok=True)
+    done = journal.load(work_dir)
+    segment_paths = [work_dir / f"segment_{index:05d}.mp4" for index in range(len(segments))]
+    
+    jobs = []
+    for index, ((start, end), segment_path) in enumerate(zip(segments, segment_paths)):
+        if journal.is_done(done, index, segment_path):
+            continue
+        jobs.append({
+            'name': f"сегмент {index + 1}/{len(segments)} ({start:.2f}с - {end:.2f}с)",
+            'func': render_segment,
+            # Число кадров от общей сетки кадров результата: сумма по сегментам равна целому видео
+            'args': (input_path, segment_path, start, end - start, round(end * fps) - round(start * fps),
+                     work_dir, index),
+            'output_seconds': end - start
+        })
+    
+    if len(jobs) < len(segments):
+        logging.info(f"Продолжение рендера: готово {len(segments) - len(jobs)}/{len(segments)} сегментов ({work_dir})")
+    logging.info(f"Параллельный рендер: {len(jobs)} сегментов")
+    
+    results = scheduler.run_jobs(jobs)
+    if not all(results):
+        logging.error(f"Не удалось отрендерить сегментов: {results.count(False)}. "
+                      f"Готовые сохранены, повторный запуск продолжит с них: {work_dir}")
+        return False
+    
+    if not concat_segments(segment_paths, input_path, output_path, duration, work_dir):
+        return False
+    journal.remove(work_dir)
+    return True
+
+def render_full_video(input_path, output_path, duration):
+    """Рендер видео целиком: по сегментам параллельно (для длинных в single_pass), иначе или при ошибке - одним рендером"""
+    segmented = config.SEGMENTED
+    # Сегменты рендерятся однопроходным ffmpeg (точное число кадров, без звука): другие режимы - целиком своим способом
+    if segmented['enabled'] and config.RENDER['mode'] == 'single_pass' and duration >= segmented['min_duration']:
+        cache_key = render_cache.render_key(input_path, 0, duration, get_render_settings())
+        if render_cache.fetch(cache_key, output_path):
+            return True
+        if render_segmented(input_path, output_path, duration):
+            render_cache.store(cache_key, output_path)
+            return True
+        logging.warning("Параллельный рендер по сегментам не удался, рендерим целиком")
+    
+    return render_fragment(input_path, output_path, 0, duration)
+
+def process_video(input_path, test_mode=False):
+    """Основная функция обработки видео"""
+    logging.info(f"Начинается обработка видео: {input_path}")
+    
+    # Получаем информацию о видео
+    video_info = utils.get_video_info(input_path)
+    if not video_info:
+        logging.error("Не удалось получить информацию о видео")
+        return False
+    
+    # Проверяем координаты кропа и шаблон раскладки
+    if not utils.validate_crop_coordinates(video_info['width'], video_info['height']):
+        logging.error("Некорректные координаты кропа")
+        return False
+    if not layouts.validate_template('main', video_info['width'], video_info['height']):
+        return False
+    
+    try:
+        if test_mode:
+            start_time = utils.calculate_test_fragment_time(video_info['duration'])
+            duration = config.TEST_FRAGMENT['duration']
+            start_time = planner.snap_start_times(input_path, [start_time], duration, video_info['duration'])[0]
+        else:
+            start_time = 0
+            duration = video_info['duration']
         
-        # ШАГ 5: Создаем вертикальное видео из трех обрезанных частей
         suffix = "test" if test_mode else ""
+        profiles = config.RENDER['profiles']
+        if profiles:
+            # Все форматы одним ffmpeg: одно декодирование на все выходы
+            output_paths = {
+                name: utils.generate_output_filename(input_path, suffix=f"{suffix}_{name}".lstrip('_'))
+                for name in profiles
+            }
+            if not all(render_fragment_profiles(input_path, output_paths, start_time, duration)):
+                logging.error("Ошибка создания видео в нескольких форматах")
+                return False
+            logging.info(f"Обработка завершена! Результаты: {', '.join(str(path) for path in output_paths.values())}")
+            return True
+        
         output_path = utils.generate_output_filename(input_path, suffix=suffix)
         
-        if not create_vertical_video(game_temp_path, camera_temp_path, subtitles_temp_path, output_path):
+        if test_mode:
+            rendered = render_fragment(input_path, output_path, start_time, duration)
+        else:
+            rendered = render_full_video(input_path, output_path, duration)
+        
+        if not rendered:
             logging.error("Ошибка создания вертикального видео")
             return False
         
@@ -241,12 +1292,8 @@ def process_video(input_path, test_mode=False):
     except Exception as e:
         logging.error(f"Ошибка обработки видео: {e}")
         return False
-        
-    finally:
-        # Очищаем временные файлы
-        utils.cleanup_temp_files(temp_files)
 
-def create_multiple_clips(input_path, num_clips=20, clip_duration=15):
+def create_multiple_clips(input_path, num_clips=20, clip_duration=15, max_workers=None):
     """Создание множественных клипов из рандомных мест видео"""
     logging.info(f"Начинается создание {num_clips} клипов по {clip_duration}с каждый")
     
@@ -256,10 +1303,12 @@ def create_multiple_clips(input_path, num_clips=20, clip_duration=15):
         logging.error("Не удалось получить информацию о видео")
         return False
     
-    # Проверяем координаты кропа
+    # Проверяем координаты кропа и шаблон раскладки
     if not utils.validate_crop_coordinates(video_info['width'], video_info['height']):
         logging.error("Некорректные координаты кропа")
         return False
+    if not layouts.validate_template('clip', video_info['width'], video_info['height']):
+        return False
     
     total_duration = video_info['duration']
     
@@ -268,177 +1317,115 @@ def create_multiple_clips(input_path, num_clips=20, clip_duration=15):
         logging.error(f"Видео слишком короткое ({total_duration}с) для создания клипов по {clip_duration}с")
         return False
     
-    # Генерируем рандомные стартовые времена
-    max_start_time = total_duration - clip_duration
-    start_times = []
+    # Выбираем стартовые времена (с выравниванием по ключевым кадрам)
+    start_times = planner.plan_clip_windows(input_path, video_info, num_clips, clip_duration)
     
-    for i in range(num_clips):
-        start_time = random.uniform(0, max_start_time)
-        start_times.append(start_time)
+    logging.info(f"Сгенерированы стартовые времена: {[f'{t:.2f}' for t in start_times]}")
     
-    # Сортируем времена для удобства
-    start_times.sort()
+    profiles = config.RENDER['profiles']
+    if profiles:
+        # Клип во всех форматах - одна задача и один ffmpeg
+        output_paths = [
+            {name: utils.generate_output_filename(input_path, suffix=f"clip_{i:02d}_{name}") for name in profiles}
+            for i in range(1, num_clips + 1)
+        ]
+    else:
+        output_paths = [
+            utils.generate_output_filename(input_path, suffix=f"clip_{i:02d}")
+            for i in range(1, num_clips + 1)
+        ]
+    windows = [(start_time, clip_duration) for start_time in start_times]
     
-    logging.info(f"Сгенерированы стартовые времена: {[f'{t:.2f}' for t in start_times]}")
+    # Готовим задачи рендера - планировщик запустит их параллельно в пределах бюджета ядер
+    jobs = []
+    if profiles:
+        groups = [[index] for index in range(num_clips)]
+    elif config.RENDER['mode'] == 'single_pass' and config.MULTI_CLIP['single_decode']:
+        # Близкие окна режем из одного прохода по источнику
+        groups = group_clip_windows(windows)
+        logging.info(f"Клипы объединены в {len(groups)} проходов декодирования")
+    else:
+        groups = [[index] for index in range(num_clips)]
     
-    successful_clips = 0
+    for group in groups:
+        names = ', '.join(str(i + 1) for i in group)
+        if profiles:
+            start_time = windows[group[0]][0]
+            jobs.append({
+                'name': f"клип {names} из {num_clips} в форматах {', '.join(profiles)} (старт: {start_time:.2f}с)",
+                'func': render_clip_profiles,
+                'args': (input_path, start_time, clip_duration, output_paths[group[0]]),
+                'output_seconds': clip_duration * len(profiles)
+            })
+            continue
+        jobs.append({
+            'name': f"клипы {names} из {num_clips} (старт: {windows[group[0]][0]:.2f}с)",
+            'func': render_clip_group,
+            'args': (input_path, [windows[i] for i in group], [output_paths[i] for i in group]),
+            'kwargs': {'has_audio': video_info.get('has_audio', True)},
+            'output_seconds': clip_duration * len(group)
+        })
     
-    for i, start_time in enumerate(start_times, 1):
-        logging.info(f"Создание клипа {i}/{num_clips} (старт: {start_time:.2f}с)")
-        
-        # Создаем временные файлы для этого клипа
-        temp_files = []
-        try:
-            # Временный фрагмент по времени
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as time_fragment:
-                time_fragment_path = Path(time_fragment.name)
-                temp_files.append(time_fragment_path)
-            
-            # Обрезанная игровая область
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as game_temp:
-                game_temp_path = Path(game_temp.name)
-                temp_files.append(game_temp_path)
-            
-            # Обрезанная область камеры
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as camera_temp:
-                camera_temp_path = Path(camera_temp.name)
-                temp_files.append(camera_temp_path)
-            
-            # Обрезанная область субтитров
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as subtitles_temp:
-                subtitles_temp_path = Path(subtitles_temp.name)
-                temp_files.append(subtitles_temp_path)
-            
-            # ШАГ 1: Создаем временной фрагмент из оригинального видео
-            if not create_time_fragment(input_path, time_fragment_path, start_time, clip_duration):
-                logging.error(f"Ошибка создания временного фрагмента для клипа {i}")
-                continue
-            
-            # ШАГ 2: Обрезаем игровую область из временного фрагмента
-            if not crop_area(time_fragment_path, game_temp_path, config.GAME_AREA, "игровая"):
-                logging.error(f"Ошибка обрезки игровой области для клипа {i}")
-                continue
-            
-            # ШАГ 3: Обрезаем область с камерой из временного фрагмента
-            if not crop_area(time_fragment_path, camera_temp_path, config.CAMERA_AREA, "камера"):
-                logging.error(f"Ошибка обрезки области с камерой для клипа {i}")
-                continue
-            
-            # ШАГ 4: Обрезаем область субтитров из временного фрагмента
-            if not crop_area(time_fragment_path, subtitles_temp_path, config.SUBTITLES_AREA, "субтитры"):
-                logging.error(f"Ошибка обрезки области субтитров для клипа {i}")
-                continue
-            
-            # ШАГ 5: Создаем вертикальное видео из трех обрезанных частей
-            suffix = f"clip_{i:02d}"
-            output_path = utils.generate_output_filename(input_path, suffix=suffix)
-            
-            if not create_vertical_video_clip(game_temp_path, camera_temp_path, subtitles_temp_path, output_path, clip_duration):
-                logging.error(f"Ошибка создания вертикального видео для клипа {i}")
-                continue
-            
+    results = scheduler.run_jobs(jobs, max_workers=max_workers)
+    
+    clip_results = [False] * num_clips
+    for group, result in zip(groups, results):
+        for index, clip_result in zip(group, result or [False] * len(group)):
+            clip_results[index] = clip_result
+    
+    successful_clips = 0
+    for i, (output_path, result) in enumerate(zip(output_paths, clip_results), 1):
+        if result:
             successful_clips += 1
+            if isinstance(output_path, dict):
+                output_path = ', '.join(str(path) for path in output_path.values())
             logging.info(f"Клип {i} готов: {output_path}")
-            
-        except Exception as e:
-            logging.error(f"Ошибка создания клипа {i}: {e}")
-            continue
-            
-        finally:
-            # Очищаем временные файлы
-            utils.cleanup_temp_files(temp_files)
+        else:
+            logging.error(f"Ошибка создания вертикального видео для клипа {i}")
     
     logging.info(f"Создание клипов завершено! Успешно создано: {successful_clips}/{num_clips}")
     return successful_clips > 0
 
-def create_vertical_video_clip(game_path, camera_path, subtitles_path, output_path, duration):
-    """Создание вертикального видео из трех частей с фоном (для клипов)"""
-    output_config = config.OUTPUT_VIDEO
-    ffmpeg_params = config.FFMPEG_PARAMS
-    layout = config.LAYOUT
-    
-    # Размеры областей
-    camera_height = 800
-    game_original_height = config.GAME_AREA['height']  # 415px - оригинальный размер
-    subtitles_height = 290  # Как в области кропа
+def run_headless(args):
+    """Запуск без меню: манифест пакета или один режим для одного видео"""
+    if args.manifest:
+        import batch
+        summary = batch.run_manifest(args.manifest, args.results, args.max_workers)
+        return all(record['status'] in ('ok', 'duplicate') for record in summary['jobs'])
     
-    # Ширина всех областей - полная ширина экрана
-    camera_width = output_config['width']  # 1080px
-    subtitles_width = output_config['width']  # 1080px
-    
-    # Ищем фоновое изображение
-    bg_image = find_background_image()
-    
-    if bg_image:
-        # С фоновым изображением пушок
-        cmd = [
-            'ffmpeg',
-            '-i', str(game_path),               # Игра
-            '-i', str(camera_path),             # Камера
-            '-i', str(subtitles_path),          # Субтитры  
-            '-loop', '1', '-i', str(bg_image),  # Фоновое изображение
-            '-filter_complex', f"""
-            [3:v]scale={output_config['width']}:{output_config['height']}[bg];
-            [0:v]scale={output_config['width']}:{game_original_height}[game];
-            [1:v]scale={camera_width}:{camera_height}[camera];
-            [2:v]scale={subtitles_width}:{subtitles_height}[subtitles];
-            [bg][camera]overlay={layout['camera_position']['x']}:{layout['camera_position']['y']}[bg_with_camera];
-            [bg_with_camera][subtitles]overlay={layout['subtitles_position']['x']}:{layout['subtitles_position']['y']}[bg_with_camera_subs];
-            [bg_with_camera_subs][game]overlay={layout['game_position']['x']}:{layout['game_position']['y']}[final]
-            """.strip().replace('\n', '').replace('    ', ''),
-            '-map', '[final]',
-            '-map', '0:a',  # Аудио из игрового видео
-            '-c:v', ffmpeg_params['codec'],
-            '-c:a', 'copy',
-            '-preset', 'fast',
-            '-crf', str(ffmpeg_params['crf']),
-            '-r', str(output_config['fps']),
-            '-t', str(duration),
-            '-shortest',
-            '-y',
-            str(output_path)
-        ]
-    else:
-        # Без фонового изображения - серый фон с правильной длительностью
-        filter_complex = f"""
-        [0:v]scale={output_config['width']}:{game_original_height}[game];
-        [1:v]scale={camera_width}:{camera_height}[camera];
-        [2:v]scale={subtitles_width}:{subtitles_height}[subtitles];
-        color=c=#808080:size={output_config['width']}x{output_config['height']}:duration={duration}:rate={output_config['fps']}[bg];
-        [bg][camera]overlay={layout['camera_position']['x']}:{layout['camera_position']['y']}:shortest=1[bg_with_camera];
-        [bg_with_camera][subtitles]overlay={layout['subtitles_position']['x']}:{layout['subtitles_position']['y']}:shortest=1[bg_with_camera_subs];
-        [bg_with_camera_subs][game]overlay={layout['game_position']['x']}:{layout['game_position']['y']}:shortest=1[final]
-        """.strip().replace('\n', '').replace('    ', '')
-        
-        cmd = [
-            'ffmpeg',
-            '-i', str(game_path),
-            '-i', str(camera_path),
-            '-i', str(subtitles_path),
-            '-filter_complex', filter_complex,
-            '-map', '[final]',
-            '-map', '0:a',
-            '-c:v', ffmpeg_params['codec'],
-            '-c:a', 'aac',
-            '-preset', 'fast',
-            '-crf', str(ffmpeg_params['crf']),
-            '-r', str(output_config['fps']),
-            '-t', str(duration),
-            '-shortest',
-            '-y',
-            str(output_path)
-        ]
+    video_path = args.input or utils.find_latest_video()
+    if not video_path:
+        logging.error("Видео для обработки не найдено")
+        return False
     
-    return run_ffmpeg_command(cmd, f"Создание вертикального видео клипа ({duration}с)")
+    if args.mode == 'test':
+        return process_video(video_path, test_mode=True)
+    if args.mode == 'clips':
+        return create_multiple_clips(video_path, num_clips=args.num_clips, clip_duration=args.clip_duration,
+                                     max_workers=args.max_workers)
+    return process_video(video_path, test_mode=False)
 
 def main():
     """Главная функция"""
+    parser = argparse.ArgumentParser(description="Обработка видео в вертикальный формат (без аргументов - меню)")
+    parser.add_argument('--manifest', type=Path, help="Пакет задач из манифеста (JSON или JSONL), см. batch.py")
+    parser.add_argument('--results', type=Path, help="Файл результатов пакета (JSON)")
+    parser.add_argument('--mode', choices=['test', 'clips', 'full'], help="Режим без меню")
+    parser.add_argument('--input', type=Path, help="Исходное видео (по умолчанию - последнее в input/)")
+    parser.add_argument('--num-clips', type=int, default=20, help="Сколько клипов (режим clips)")
+    parser.add_argument('--clip-duration', type=float, default=15, help="Длительность клипа, сек (режим clips)")
+    parser.add_argument('--max-workers', type=int, help="Максимум одновременных ffmpeg")
+    args = parser.parse_args()
+    
     # Настройка логирования
     utils.setup_logging()
     
     # Создание необходимых папок
     utils.create_directories()
     
+    if args.manifest or args.mode:
+        sys.exit(0 if run_headless(args) else 1)
+    
     # Поиск последнего видео
     video_path = utils.find_latest_video()
     if not video_path:
@@ -450,8 +1437,9 @@ def main():
     print("1. Создать один тестовый клип (15 сек)")
     print("2. Создать 20 случайных клипов (по 15 сек каждый)")
     print("3. Обработать все видео целиком")
+    print("4. Быстрое превью областей кропа и раскладки")
     
-    choice = input("Ваш выбор (1-3): ").strip()
+    choice = input("Ваш выбор (1-4): ").strip()
     
     if choice == '1':
         # Обработка тестового фрагмента (15 секунд)
@@ -477,6 +1465,12 @@ def main():
         else:
             logging.error("Ошибка полной обработки видео")
     
+    elif choice == '4':
+        # Кадр с рамками областей и раскладка в уменьшенном размере
+        import preview
+        if not preview.preview_video(video_path):
+            logging.error("Ошибка создания превью")
+    
     else:
         print("Неверный выбор. Завершение.")
         return
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import config
+
+# Кэш готовых рендеров и кропов по содержимому: ключ - отпечаток источника, точное окно времени
+# и хэш всех настроек, влияющих на картинку. Повторный запуск с теми же настройками отдает
+# готовый файл сразу. Размер ограничен, вытесняются давно не использованные записи (LRU по индексу
+# кэша). Записи и файлы пользователя - всегда разные inode: правка или перезапись результата
+# не портит кэш, а вытеснение действительно освобождает место
+
+# Сколько байт читать из начала, середины и конца файла для отпечатка
+SAMPLE_BYTES = 1024 * 1024
+
+# ioctl FICLONE (Linux): копия файла без копирования данных на btrfs/xfs (copy-on-write)
+FICLONE = 0x40049409
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+_fingerprints = {}
+_evict_lock = threading.Lock()
+
+def source_fingerprint(video_path):
+    """Отпечаток содержимого источника: размер + sha256 трех кусков файла (без чтения всего видео)"""
+    video_path = Path(video_path).resolve()
+    stat = video_path.stat()
+    memo_key = (str(video_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _fingerprints:
+        return _fingerprints[memo_key]
+
+    digest = hashlib.sha256(str(stat.st_size).encode())
+    with open(video_path, 'rb') as source:
+        for offset in (0, max(0, stat.st_size // 2 - SAMPLE_BYTES // 2), max(0, stat.st_size - SAMPLE_BYTES)):
+            source.seek(offset)
+            digest.update(source.read(SAMPLE_BYTES))
+
+    _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+def make_key(kind, input_path, start_time, duration, settings):
+    """Ключ записи кэша"""
+    key = json.dumps(
+        [kind, source_fingerprint(input_path), round(start_time, 3), round(duration, 3), settings],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def render_key(input_path, start_time, duration, settings):
+    """Ключ готового вертикального видео (settings - настройки раскладки, вывода и фон)"""
+    return make_key('render', input_path, start_time, duration, settings)
+
+def crop_key(input_path, start_time, duration, area):
+    """Ключ кропа области: не зависит от раскладки, поэтому при ее смене кропы не режутся заново"""
+    return make_key('crop', input_path, start_time, duration, [area, config.FFMPEG_PARAMS, config.CUTTING['mode']])
+
+def get_entry_path(key, suffix='.mp4'):
+    """Файл записи кэша"""
+    return config.RENDER_CACHE['dir'] / key[:2] / f"{key}{suffix}"
+
+@contextmanager
+def connect_index():
+    """Индекс кэша (размер и время последнего использования записей) на блок with: commit и закрытие"""
+    cache_dir = config.RENDER_CACHE['dir']
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(cache_dir / "index.sqlite", timeout=30)
+    try:
+        connection.executescript(INDEX_SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def touch_entries(entry_paths):
+    """Отметить записи как использованные сейчас"""
+    now = time.time()
+    with connect_index() as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO entries (name, size, last_used) VALUES (?, ?, ?)",
+            [(entry_path.name, entry_path.stat().st_size, now) for entry_path in entry_paths]
+        )
+
+def clone_file(source_path, target_path):
+    """Отдельная копия файла через временный файл и переименование
+
+    На btrfs/xfs - клон copy-on-write (мгновенно, без места на диске), иначе обычная копия.
+    Жесткая ссылка не подходит: запись кэша и файл пользователя делили бы один inode.
+    """
+    target_path = Path(target_path)
+    temp_path = target_path.with_name(f".{target_path.name}.tmp")
+    temp_path.unlink(missing_ok=True)
+    try:
+        with open(source_path, 'rb') as source, open(temp_path, 'wb') as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            except OSError:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+def fetch(key, output_path, sidecar_paths=None):
+    """Отдать готовый файл (и его sidecar-файлы {вид: путь}) из кэша; False - промах"""
+    if not config.RENDER_CACHE['enabled']:
+        return False
+    entries = [(get_entry_path(key), output_path)]
+    for kind, path in (sidecar_paths or {}).items():
+        entries.append((get_entry_path(f"{key}_{kind}", Path(path).suffix), path))
+    # Запись без любого из sidecar-файлов - промах: рендер создаст все заново
+    if not all(entry_path.exists() for entry_path, _ in entries):
+        return False
+    try:
+        for entry_path, path in entries:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            clone_file(entry_path, path)
+        touch_entries([entry_path for entry_path, _ in entries])
+    except FileNotFoundError:
+        return False
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"Не удалось взять из кэша рендера {output_path}: {e}")
+        return False
+    logging.info(f"Из кэша рендера: {output_path}")
+    return True
+
+def store(key, output_path, sidecar_paths=None):
+    """Положить готовый файл (и его sidecar-файлы) в кэш и при необходимости вытеснить старые записи"""
+    if not config.RENDER_CACHE['enabled']:
+        return
+    entries = [(get_entry_path(key), output_path)]
+    for kind, path in (sidecar_paths or {}).items():
+        entries.append((get_entry_path(f"{key}_{kind}", Path(path).suffix), path))
+    try:
+        # На ext4 запись - полная копия: большие файлы удваивают запись на диск и вытеснили бы весь кэш
+        size = sum(Path(path).stat().st_size for _, path in entries)
+        max_entry_bytes = config.RENDER_CACHE['max_bytes'] * config.RENDER_CACHE['max_entry_fraction']
+        if size > max_entry_bytes:
+            logging.info(f"Кэш рендера: {output_path} не сохраняется - {size / 1024 ** 2:.0f} МБ "
+                         f"больше {max_entry_bytes / 1024 ** 2:.0f} МБ")
+            return
+        for entry_path, path in entries:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            clone_file(path, entry_path)
+        touch_entries([entry_path for entry_path, _ in entries])
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"Не удалось сохранить в кэш рендера {output_path}: {e}")
+        return
+    evict()
+
+def evict():
+    """Удаление давно не использованных записей, пока кэш больше RENDER_CACHE['max_bytes']
+
+    Размер - по файлам на диске, порядок - по индексу; файлы без записи в индексе уходят первыми.
+    """
+    cache_dir = config.RENDER_CACHE['dir']
+    with _evict_lock:
+        try:
+            with connect_index() as connection:
+                last_used = dict(connection.execute("SELECT name, last_used FROM entries"))
+        except sqlite3.Error as e:
+            logging.warning(f"Индекс кэша рендера недоступен, вытеснение пропущено: {e}")
+            return
+
+        entries = []
+        for entry_path in cache_dir.glob('*/*'):
+            if entry_path.name.startswith('.'):
+                continue  # Временный файл, который еще пишется
+            try:
+                size = entry_path.stat().st_size
+            except FileNotFoundError:
+                continue
+            entries.append((last_used.get(entry_path.name, 0.0), size, entry_path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, entry_path in sorted(entries):
+            if total <= config.RENDER_CACHE['max_bytes']:
+                break
+            entry_path.unlink(missing_ok=True)
+            evicted.append(entry_path.name)
+            total -= size
+            logging.info(f"Кэш рендера: вытеснена запись {entry_path.name}")
+
+        if evicted:
+            with connect_index() as connection:
+                connection.executemany("DELETE FROM entries WHERE name = ?", [(name,) for name in evicted])
@@ -0,0 +1,179 @@
+import os
+import math
+import time
+import logging
+import config
+import render_cache
+import ffmpeg_runner
+from ffmpeg_runner import get_ffmpeg_command
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Индекс сцен источника: ffmpeg отдает через pipe крошечные кадры в оттенках серого с низкой
+# частотой, по ним пакетно считаются яркость, разница соседних кадров и расстояние гистограмм.
+# По индексу планировщик сдвигает границы клипов на склейки и пропускает черные и статичные куски
+# (загрузочные экраны, паузы). Индекс кэшируется по отпечатку содержимого источника
+
+# Кадров за одно чтение из pipe
+CHUNK_FRAMES = 1200
+# Корзин гистограммы яркости
+HISTOGRAM_BINS = 16
+
+def is_available():
+    """Индекс возможен: включен в config и установлен numpy"""
+    return config.SCENE_INDEX['enabled'] and np is not None
+
+def get_cache_path(input_path):
+    """Файл кэша индекса: отпечаток источника и параметры выборки кадров"""
+    scenes = config.SCENE_INDEX
+    fingerprint = render_cache.source_fingerprint(input_path)
+    return scenes['cache_dir'] / f"{fingerprint}_{scenes['width']}x{scenes['height']}_{scenes['fps']}.npz"
+
+def frame_features(frames, previous):
+    """Яркость, разница с предыдущим кадром и расстояние гистограмм для пачки кадров (N, H, W)"""
+    count = len(frames)
+    pixels = frames.reshape(count, -1)
+    luma = pixels.mean(axis=1)
+
+    bins = (pixels >> (8 - int(math.log2(HISTOGRAM_BINS)))).astype(np.int64)
+    histograms = np.bincount(
+        (np.arange(count)[:, None] * HISTOGRAM_BINS + bins).ravel(), minlength=count * HISTOGRAM_BINS
+    ).reshape(count, HISTOGRAM_BINS) / pixels.shape[1]
+
+    if previous is None:
+        # У первого кадра нет предыдущего: не склейка и не статика
+        previous_pixels = pixels[:1]
+        previous_histograms = histograms[:1]
+    else:
+        previous_pixels = previous[0][None]
+        previous_histograms = previous[1][None]
+    previous_pixels = np.concatenate((previous_pixels, pixels[:-1]))
+    previous_histograms = np.concatenate((previous_histograms, histograms[:-1]))
+
+    diff = np.abs(pixels.astype(np.int16) - previous_pixels).mean(axis=1)
+    # Расстояние полной вариации: 0 - одинаковые гистограммы, 1 - непересекающиеся
+    hist_distance = np.abs(histograms - previous_histograms).sum(axis=1) / 2
+    if previous is None:
+        diff[0] = np.inf
+    return luma, diff, hist_distance, (pixels[-1], histograms[-1])
+
+def build_index(input_path):
+    """Признаки кадров источника через ffmpeg -> rawvideo gray в pipe; None - ошибка"""
+    scenes = config.SCENE_INDEX
+    cmd = [
+        get_ffmpeg_command(),
+        '-v', 'error',
+        # Деблокинг и кадры, на которые никто не ссылается, не нужны для картинки 64x36
+        '-skip_loop_filter', 'all',
+        '-skip_frame', 'noref',
+        '-an', '-sn', '-dn',
+        '-i', str(input_path),
+        '-map', '0:v:0',
+        '-vf', f"fps={scenes['fps']},scale={scenes['width']}:{scenes['height']}:flags=area,format=gray",
+        '-f', 'rawvideo',
+        'pipe:1'
+    ]
+
+    frame_bytes = scenes['width'] * scenes['height']
+    features = []
+    state = {'previous': None}
+
+    def handle_chunk(data):
+        count = len(data) // frame_bytes
+        if not count:
+            return
+        frames = np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, scenes['height'], scenes['width'])
+        luma, diff, hist_distance, state['previous'] = frame_features(frames, state['previous'])
+        features.append((luma, diff, hist_distance))
+
+    result = ffmpeg_runner.run(cmd, description="Индекс сцен", progress=True,
+                               stdout_handler=handle_chunk, stdout_chunk_size=frame_bytes * CHUNK_FRAMES)
+    if result['returncode'] != 0 or not features:
+        logging.error(f"Ошибка построения индекса сцен {input_path}: {result['timed_out'] or result['stderr'].strip()}")
+        return None
+    luma, diff, hist_distance = (np.concatenate(values).astype(np.float32) for values in zip(*features))
+    return {'luma': luma, 'diff': diff, 'hist_distance': hist_distance}
+
+def get_scene_index(input_path):
+    """Индекс сцен источника (из кэша или через ffmpeg); None - недоступен"""
+    if not is_available():
+        return None
+    cache_path = get_cache_path(input_path)
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                return {name: cached[name] for name in ('luma', 'diff', 'hist_distance')}
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Кэш индекса сцен поврежден, строим заново: {cache_path}: {e}")
+
+    logging.info(f"Строится индекс сцен: {input_path}")
+    build_start = time.monotonic()
+    index = build_index(input_path)
+    if index is None:
+        return None
+
+    elapsed = time.monotonic() - build_start
+    video_seconds = len(index['luma']) / config.SCENE_INDEX['fps']
+    logging.info(
+        f"Индекс сцен: {video_seconds:.0f}с видео за {elapsed:.2f}с "
+        f"({video_seconds / max(elapsed, 1e-6):.0f}x реального времени), склеек: {len(get_cut_frames(index))}"
+    )
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, **index)
+    os.replace(temp_path, cache_path)
+    return index
+
+def get_cut_frames(index):
+    """Номера первых кадров после склеек (из серии подряд идущих - только первый, это переход)"""
+    is_cut = index['hist_distance'] > config.SCENE_INDEX['cut_threshold']
+    return np.flatnonzero(is_cut & ~np.concatenate(([False], is_cut[:-1])))
+
+def usable_windows(index, start_times, duration):
+    """Для каждого старта: окно не состоит в основном из черных или статичных кадров"""
+    scenes = config.SCENE_INDEX
+    dead = (index['luma'] < scenes['black_luma']) | (index['diff'] < scenes['static_diff'])
+    cumulative = np.concatenate(([0], np.cumsum(dead)))
+
+    starts = np.clip(np.ceil(np.asarray(start_times) * scenes['fps']).astype(np.int64), 0, len(dead))
+    ends = np.clip(starts + int(round(duration * scenes['fps'])), 0, len(dead))
+    dead_fraction = (cumulative[ends] - cumulative[starts]) / np.maximum(ends - starts, 1)
+    return dead_fraction <= scenes['max_dead_fraction']
+
+def snap_to_cuts(index, start_times, duration, total_duration):
+    """Сдвиг окон на склейки в пределах max_snap_shift: сначала старт, иначе конец окна
+
+    Склейка лежит между кадрами выборки, поэтому старт ставится на кадр после нее, а конец -
+    на кадр до нее: в клип не попадает ни кадра соседней сцены. Возвращает (старты, сдвинуто ли).
+    """
+    scenes = config.SCENE_INDEX
+    cut_frames = get_cut_frames(index)
+    after_cut = cut_frames / scenes['fps']
+    before_cut = (cut_frames - 1) / scenes['fps']
+    latest_start = max(0, total_duration - duration)
+
+    snapped = []
+    on_cut = []
+    for start_time in start_times:
+        candidates = [cut for cut in after_cut if abs(cut - start_time) <= scenes['max_snap_shift'] and cut <= latest_start]
+        if not candidates:
+            # Старт без склейки рядом - пробуем закончить окно перед склейкой
+            end_time = start_time + duration
+            candidates = [
+                cut - duration for cut in before_cut
+                if abs(cut - end_time) <= scenes['max_snap_shift'] and 0 <= cut - duration <= latest_start
+            ]
+        if candidates:
+            snapped.append(round(float(min(candidates, key=lambda cut: abs(cut - start_time))), 3))
+            on_cut.append(True)
+        else:
+            snapped.append(start_time)
+            on_cut.append(False)
+
+    logging.info(f"Окна выровнены по склейкам: {sum(on_cut)}/{len(start_times)}")
+    return snapped, on_cut
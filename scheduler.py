@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import config
+import metrics
+
+# Потоки задачи пула: вложенный run_jobs внутри задачи делит их, а не весь бюджет машины
+job_budget = contextvars.ContextVar('job_budget', default=None)
+
+def get_cpu_budget():
+    """Число ядер, которые можно отдать под рендер"""
+    if job_budget.get():
+        return job_budget.get()
+    if config.PARALLEL['cpu_budget']:
+        return config.PARALLEL['cpu_budget']
+    try:
+        # Учитываем ограничения taskset/cgroup, а не все ядра машины
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def plan_workers(num_jobs, max_workers=None):
+    """Сколько задач запускать одновременно и сколько потоков ffmpeg дать каждой"""
+    cpu_budget = get_cpu_budget()
+
+    if max_workers is None:
+        max_workers = config.PARALLEL['max_workers']
+    if max_workers is None:
+        max_workers = max(1, cpu_budget // config.PARALLEL['min_threads_per_job'])
+
+    workers = max(1, min(num_jobs, max_workers))
+    # Делим ядра поровну с округлением вниз, чтобы N одновременных ffmpeg не перегружали машину
+    threads = max(1, cpu_budget // workers)
+
+    return workers, threads
+
+def run_jobs(jobs, max_workers=None):
+    """Параллельный запуск задач рендера
+
+    Каждая задача - словарь с ключами name, func, args, kwargs и output_seconds
+    (длительность результата для подсчета скорости). В func дополнительно передается threads.
+    Возвращает результаты в порядке задач.
+    """
+    if not jobs:
+        return []
+
+    workers, threads = plan_workers(len(jobs), max_workers)
+    logging.info(f"Планировщик: {len(jobs)} задач, одновременно {workers}, потоков ffmpeg на задачу: {threads} "
+                 f"(бюджет ядер: {get_cpu_budget()})")
+
+    job_times = [0.0] * len(jobs)
+
+    def run_job(index):
+        job = jobs[index]
+        logging.info(f"Старт задачи: {job['name']}")
+        # Имя задачи попадает в метрики всех ее вызовов ffmpeg
+        job_token = metrics.current_job.set(job['name'])
+        budget_token = job_budget.set(threads)
+        job_start = time.monotonic()
+        result = False
+        try:
+            result = job['func'](*job['args'], **job.get('kwargs', {}), threads=threads)
+            return result
+        except Exception as e:
+            logging.error(f"Ошибка задачи {job['name']}: {e}")
+            return False
+        finally:
+            job_times[index] = time.monotonic() - job_start
+            logging.info(f"Задача завершена за {job_times[index]:.1f}с: {job['name']}")
+            metrics.write_record({
+                'type': 'job',
+                'status': 'ok' if result and (not isinstance(result, list) or all(result)) else 'failed',
+                'wall_seconds': round(job_times[index], 3),
+                'output_seconds': job.get('output_seconds'),
+                'threads': threads
+            })
+            job_budget.reset(budget_token)
+            metrics.current_job.reset(job_token)
+
+    batch_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_job, range(len(jobs))))
+    wall_time = time.monotonic() - batch_start
+
+    log_throughput(jobs, results, job_times, wall_time)
+    return results
+
+def log_throughput(jobs, results, job_times, wall_time):
+    """Отчет о скорости пакета"""
+    done = sum(1 for result in results if result)
+    output_seconds = sum(job.get('output_seconds', 0) for job, result in zip(jobs, results) if result)
+    serial_time = sum(job_times)
+
+    wall_time = max(wall_time, 1e-6)
+    logging.info(
+        f"Пакет: {done}/{len(jobs)} задач за {wall_time:.1f}с, "
+        f"{done * 60 / wall_time:.2f} задач/мин, "
+        f"{output_seconds / wall_time:.2f}x реального времени, "
+        f"ускорение относительно последовательного запуска: {serial_time / wall_time:.2f}x, "
+        f"самая долгая задача: {max(job_times):.1f}с"
+    )
@@ -1,10 +1,17 @@
 import os
+import shutil
 import logging
-import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-import json
 import config
+import catalog
+
+# Сколько байт RAM-папки уже обещано работающим задачам
+_ram_reserved_bytes = 0
+_ram_lock = threading.Lock()
 
 def setup_logging():
     """Настройка логирования"""
@@ -36,18 +43,14 @@ def find_latest_video(directory=None):
     latest_time = 0
     
     for search_dir in search_dirs:
-        if not search_dir.exists():
-            continue
-            
-        for file_path in search_dir.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() in config.SUPPORTED_FORMATS:
-                # Исключаем обработанные файлы
-                if file_path.name.startswith('processed_'):
-                    continue
-                mtime = file_path.stat().st_mtime
-                if mtime > latest_time:
-                    latest_time = mtime
-                    latest_video = file_path
+        # Каталог заодно пробует новые файлы, чтобы get_video_info дальше не звал ffprobe
+        for file_path, mtime in catalog.sync_directory(search_dir):
+            # Исключаем обработанные файлы
+            if file_path.name.startswith('processed_'):
+                continue
+            if mtime > latest_time:
+                latest_time = mtime
+                latest_video = file_path
     
     if latest_video:
         logging.info(f"Найдено последнее видео: {latest_video}")
@@ -57,54 +60,14 @@ def find_latest_video(directory=None):
     return latest_video
 
 def get_video_info(video_path):
-    """Получение информации о видео через ffprobe"""
+    """Получение информации о видео (из каталога, ffprobe - только для новых файлов)"""
     try:
-        # Используем локальный ffprobe если он есть
-        ffprobe_path = Path(__file__).parent / 'ffprobe'
-        if ffprobe_path.exists():
-            ffprobe_cmd = str(ffprobe_path)
-        else:
-            ffprobe_cmd = 'ffprobe'
-        
-        cmd = [
-            ffprobe_cmd,
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_format',
-            '-show_streams',
-            str(video_path)
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.error(f"Ошибка ffprobe: {result.stderr}")
-            return None
-        
-        info = json.loads(result.stdout)
-        
-        # Ищем видео поток
-        video_stream = None
-        for stream in info['streams']:
-            if stream['codec_type'] == 'video':
-                video_stream = stream
-                break
-        
-        if not video_stream:
-            logging.error("Видео поток не найден")
+        info = catalog.get_video_info(video_path)
+        if not info:
             return None
         
-        duration = float(info['format']['duration'])
-        width = int(video_stream['width'])
-        height = int(video_stream['height'])
-        
-        logging.info(f"Видео: {width}x{height}, длительность: {duration:.2f}с")
-        
-        return {
-            'duration': duration,
-            'width': width,
-            'height': height,
-            'fps': video_stream.get('r_frame_rate', '30/1')
-        }
+        logging.info(f"Видео: {info['width']}x{info['height']}, длительность: {info['duration']:.2f}с")
+        return info
         
     except Exception as e:
         logging.error(f"Ошибка получения информации о видео: {e}")
@@ -126,21 +89,22 @@ def calculate_test_fragment_time(video_duration):
     logging.info(f"Случайный фрагмент: {start_time:.2f}с - {start_time + test_duration:.2f}с")
     return start_time
 
-def validate_crop_coordinates(video_width, video_height):
-    """Проверка корректности координат кропа"""
-    game_area = config.GAME_AREA
-    camera_area = config.CAMERA_AREA
+def validate_crop_coordinates(video_width, video_height, areas=None):
+    """Проверка корректности координат кропа (areas - {'game', 'camera', 'subtitles'}, по умолчанию из config)"""
+    if areas is None:
+        areas = {'game': config.GAME_AREA, 'camera': config.CAMERA_AREA, 'subtitles': config.SUBTITLES_AREA}
+    names = {'game': "Игровая область", 'camera': "Область камеры", 'subtitles': "Область субтитров"}
     
-    # Проверяем что координаты не выходят за границы видео
-    if (game_area['x'] + game_area['width'] > video_width or
-        game_area['y'] + game_area['height'] > video_height):
-        logging.error(f"Игровая область выходит за границы видео {video_width}x{video_height}")
-        return False
-    
-    if (camera_area['x'] + camera_area['width'] > video_width or
-        camera_area['y'] + camera_area['height'] > video_height):
-        logging.error(f"Область камеры выходит за границы видео {video_width}x{video_height}")
-        return False
+    for name, area in areas.items():
+        # Проверяем что область не пустая и не выходит за границы видео
+        if area['width'] <= 0 or area['height'] <= 0:
+            logging.error(f"{names[name]} пустая: {area['width']}x{area['height']}")
+            return False
+        if (area['x'] < 0 or area['y'] < 0 or
+            area['x'] + area['width'] > video_width or
+            area['y'] + area['height'] > video_height):
+            logging.error(f"{names[name]} выходит за границы видео {video_width}x{video_height}")
+            return False
     
     logging.info("Координаты кропа корректны")
     return True
@@ -165,4 +129,47 @@ def cleanup_temp_files(temp_files):
                 Path(temp_file).unlink()
                 logging.info(f"Удален временный файл: {temp_file}")
         except Exception as e:
-            logging.warning(f"Не удалось удалить временный файл {temp_file}: {e}") 
\ No newline at end of file
+            logging.warning(f"Не удалось удалить временный файл {temp_file}: {e}")
+
+def estimate_intermediate_size(video_path, duration):
+    """Оценка объема промежуточных файлов многошагового рендера для фрагмента"""
+    video_info = get_video_info(video_path)
+    if not video_info or not video_info.get('size') or not video_info['duration']:
+        return None
+    bytes_per_second = video_info['size'] / video_info['duration']
+    # Фрагмент копией + кропы crf 0, которые намного больше исходника
+    return int(bytes_per_second * duration * (1 + config.INTERMEDIATE['size_estimate_factor']))
+
+@contextmanager
+def intermediate_dir(estimated_bytes):
+    """Папка для промежуточных файлов: RAM-папка (tmpfs), если влезаем в бюджет, иначе системная временная"""
+    global _ram_reserved_bytes
+    settings = config.INTERMEDIATE
+    ram_dir = Path(settings['ram_dir'])
+    reserved = 0
+    
+    if settings['transport'] != 'disk' and estimated_bytes:
+        with _ram_lock:
+            try:
+                ram_dir.mkdir(parents=True, exist_ok=True)
+                fits_budget = _ram_reserved_bytes + estimated_bytes <= settings['ram_budget_bytes']
+                fits_free_space = estimated_bytes <= shutil.disk_usage(ram_dir).free
+            except OSError as e:
+                logging.warning(f"RAM-папка недоступна ({ram_dir}): {e}")
+                fits_budget = fits_free_space = False
+            if fits_budget and fits_free_space:
+                _ram_reserved_bytes += estimated_bytes
+                reserved = estimated_bytes
+    
+    if reserved:
+        logging.info(f"Промежуточные файлы в RAM: {ram_dir} (~{reserved / 1024 ** 2:.0f} МБ)")
+        directory = ram_dir
+    else:
+        directory = Path(tempfile.gettempdir())
+    
+    try:
+        yield directory
+    finally:
+        if reserved:
+            with _ram_lock:
+                _ram_reserved_bytes -= reserved
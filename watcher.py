@@ -0,0 +1,233 @@
+import os
+import time
+import heapq
+import fnmatch
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import logging
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import config
+import utils
+import catalog
+import process_video
+import detect_regions
+
+# Демон папки input/: новые записи рендерятся сами, как только файл дописан.
+# Процесс живет долго, поэтому каталог, индекс ключевых кадров и подготовленный фон
+# остаются теплыми между файлами
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+EVENT_HEADER = struct.Struct('iIII')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watched (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    finished_at REAL
+);
+"""
+
+class InotifyEvents:
+    """События папки через inotify (ctypes, без сторонних пакетов)"""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, str(directory).encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch")
+        self.directory = Path(directory)
+
+    def wait(self, timeout):
+        """Имена файлов, с которыми что-то произошло за timeout секунд"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 65536)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            if name:
+                names.add(self.directory / name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingEvents:
+    """Запасной вариант без inotify (другая ОС, сетевая папка): периодический просмотр папки"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return {Path(entry.path) for entry in os.scandir(self.directory) if entry.is_file()}
+
+    def close(self):
+        pass
+
+def open_events(directory):
+    """inotify, если доступен, иначе опрос папки"""
+    if config.WATCHER['use_inotify']:
+        try:
+            return InotifyEvents(directory)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify недоступен ({e}), используется опрос папки")
+    return PollingEvents(directory)
+
+def is_video(path):
+    """Поддерживаемое видео (не временный файл записи)"""
+    return path.suffix.lower() in config.SUPPORTED_FORMATS and not path.name.startswith('.')
+
+def get_priority(path):
+    """Приоритет файла: меньше - раньше (по шаблонам имени из WATCHER['priority_patterns'])"""
+    for pattern, priority in config.WATCHER['priority_patterns'].items():
+        if fnmatch.fnmatch(path.name, pattern):
+            return priority
+    return config.WATCHER['default_priority']
+
+def is_processed(path, stat):
+    """Файл с таким размером и mtime уже обработан (в том числе до перезапуска демона)"""
+    with catalog.connect() as connection:
+        connection.executescript(SCHEMA)
+        row = connection.execute(
+            "SELECT 1 FROM watched WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (str(path), stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+    return row is not None
+
+def mark_processed(path, stat, status):
+    """Запомнить результат обработки файла"""
+    with catalog.connect() as connection:
+        connection.executescript(SCHEMA)
+        connection.execute(
+            "INSERT OR REPLACE INTO watched (path, size, mtime_ns, status, finished_at) VALUES (?, ?, ?, ?, ?)",
+            (str(path), stat.st_size, stat.st_mtime_ns, status, time.time())
+        )
+
+def render_file(path):
+    """Рендер одного файла в режиме WATCHER['mode']"""
+    watcher = config.WATCHER
+    if watcher['mode'] == 'clips':
+        return process_video.create_multiple_clips(path, watcher['num_clips'], watcher['clip_duration'])
+    return process_video.process_video(path, test_mode=watcher['mode'] == 'test')
+
+def process_file(path, stat):
+    """Задача пула: рендер и отметка в каталоге (ошибка тоже отмечается - до изменения файла)"""
+    logging.info(f"Демон: обработка {path}")
+    try:
+        if config.REGION_DETECTION['on_ingest']:
+            # Раскладка стримера могла поменяться: предупреждение с предлагаемыми областями
+            detect_regions.check_regions(path)
+        success = render_file(path)
+    except Exception as e:
+        logging.error(f"Демон: ошибка обработки {path}: {e}")
+        success = False
+    mark_processed(path, stat, 'done' if success else 'failed')
+    logging.info(f"Демон: {'готово' if success else 'ошибка'}: {path}")
+
+def watch(directory=None):
+    """Основной цикл демона: события -> проверка, что файл дописан -> очередь с приоритетами -> пул"""
+    watcher = config.WATCHER
+    directory = Path(directory or config.INPUT_DIR).resolve()
+    directory.mkdir(parents=True, exist_ok=True)
+
+    stopping = []
+    def request_stop(signum, frame):
+        logging.info("Демон: остановка - новые файлы не берутся, текущие дорабатываются")
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    events = open_events(directory)
+    logging.info(f"Демон следит за {directory} ({type(events).__name__}), одновременно файлов: {watcher['max_jobs']}")
+
+    # Кандидаты: путь -> (размер, mtime, с какого момента не меняется)
+    pending = {}
+    # Уже поставленные в очередь или обработанные: путь -> (размер, mtime)
+    known = {}
+    queue = []
+    active = {}
+    sequence = 0
+
+    # Файлы, появившиеся пока демон не работал
+    candidates = {Path(entry.path) for entry in os.scandir(directory) if entry.is_file()}
+
+    with ThreadPoolExecutor(max_workers=watcher['max_jobs']) as executor:
+        while not stopping:
+            now = time.monotonic()
+            for path in candidates:
+                if not is_video(path) or path in active or path in pending:
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    pending[path] = (None, None, now)
+
+            # Файл готов, когда размер и mtime не меняются stable_seconds (запись или копирование закончены)
+            for path, (size, mtime_ns, since) in list(pending.items()):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    del pending[path]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                    pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif now - since >= watcher['stable_seconds']:
+                    del pending[path]
+                    known[path] = (stat.st_size, stat.st_mtime_ns)
+                    if is_processed(path, stat):
+                        continue
+                    sequence += 1
+                    heapq.heappush(queue, (get_priority(path), stat.st_mtime_ns, sequence, path, stat))
+                    logging.info(f"Демон: в очереди {path} (приоритет {get_priority(path)}, всего {len(queue)})")
+
+            for path, future in list(active.items()):
+                if future.done():
+                    del active[path]
+
+            while queue and len(active) < watcher['max_jobs']:
+                _, _, _, path, stat = heapq.heappop(queue)
+                active[path] = executor.submit(process_file, path, stat)
+
+            # Пока есть недописанные файлы - проверяем их каждую секунду
+            polling = isinstance(events, PollingEvents)
+            candidates = events.wait(1 if pending and not polling else watcher['poll_interval'])
+
+    events.close()
+    logging.info("Демон остановлен")
+
+def main():
+    parser = argparse.ArgumentParser(description="Демон: автоматическая обработка новых видео в папке")
+    parser.add_argument('--dir', type=Path, help="Папка для наблюдения (по умолчанию input/)")
+    parser.add_argument('--mode', choices=['test', 'clips', 'full'], help="Режим обработки")
+    args = parser.parse_args()
+
+    if args.mode:
+        config.WATCHER['mode'] = args.mode
+
+    utils.setup_logging()
+    utils.create_directories()
+    watch(args.dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+import config
+import utils
+import scheduler
+import ffmpeg_runner
+
+# Очередь задач для нескольких воркеров (процессы на одной или нескольких машинах с общей папкой).
+# Задача берется в аренду (lease) на lease_seconds и продлевается heartbeat-ом; если воркер умер,
+# аренда истекает и задачу берет другой. После max_attempts неудачных попыток задача уходит
+# в dead (dead letter) и ждет ручного разбора
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, id);
+"""
+
+# Виды задач: обертки над функциями process_video
+KINDS = ('process_video', 'clips')
+
+def connect():
+    """Подключение к базе очереди (без WAL - он не работает на сетевых файловых системах)"""
+    connection = sqlite3.connect(config.WORKQUEUE['db_path'], timeout=60, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+def get_worker_id():
+    """Имя воркера: хост и pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue(kind, payload, priority=0, max_attempts=None):
+    """Добавить задачу в очередь; возвращает ее id"""
+    if kind not in KINDS:
+        raise ValueError(f"неизвестный вид задачи {kind}")
+    now = time.time()
+    connection = connect()
+    try:
+        cursor = connection.execute(
+            "INSERT INTO jobs (kind, payload, priority, max_attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), priority, max_attempts or config.WORKQUEUE['max_attempts'], now, now)
+        )
+        return cursor.lastrowid
+    finally:
+        connection.close()
+
+def claim(worker_id):
+    """Взять следующую задачу в аренду (или None, если очередь пуста)
+
+    Все в одной транзакции BEGIN IMMEDIATE: два воркера не могут взять одну задачу.
+    """
+    now = time.time()
+    connection = connect()
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        # Аренды умерших воркеров: попытка уже засчитана, задача возвращается в очередь или в dead
+        connection.execute(
+            """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                   last_error = 'аренда истекла: ' || lease_owner, lease_owner = NULL, updated_at = ?
+               WHERE status = 'leased' AND lease_expires < ?""",
+            (now, now)
+        )
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, id LIMIT 1"
+        ).fetchone()
+        if row:
+            connection.execute(
+                """UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?,
+                       lease_expires = ?, updated_at = ? WHERE id = ?""",
+                (worker_id, now + config.WORKQUEUE['lease_seconds'], now, row['id'])
+            )
+        connection.execute("COMMIT")
+        return dict(row) if row else None
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+def heartbeat(job_id, worker_id):
+    """Продлить аренду; False - аренда потеряна (истекла и задачу взял другой воркер)"""
+    connection = connect()
+    try:
+        cursor = connection.execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (time.time() + config.WORKQUEUE['lease_seconds'], time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+    finally:
+        connection.close()
+
+def finish(job_id, worker_id, success, error=None):
+    """Итог задачи: done, повтор (queued) или dead после max_attempts"""
+    connection = connect()
+    try:
+        if success:
+            status_sql = "'done'"
+        else:
+            status_sql = "CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END"
+        cursor = connection.execute(
+            f"""UPDATE jobs SET status = {status_sql}, last_error = ?, lease_owner = NULL, lease_expires = NULL,
+                    updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+            (error, time.time(), job_id, worker_id)
+        )
+        if cursor.rowcount != 1:
+            logging.warning(f"Очередь: задача {job_id} уже не принадлежит воркеру {worker_id}, результат не записан")
+    finally:
+        connection.close()
+
+def execute(job):
+    """Выполнить задачу очереди (вызов process_video / create_multiple_clips)"""
+    import process_video
+
+    payload = json.loads(job['payload'])
+    if job['kind'] == 'clips':
+        return process_video.create_multiple_clips(
+            payload['input'], payload.get('num_clips', 20), payload.get('clip_duration', 15)
+        )
+    return process_video.process_video(payload['input'], test_mode=payload.get('test_mode', False))
+
+def run_job(job, worker_id):
+    """Выполнение задачи с heartbeat в фоне
+
+    Ошибка базы при продлении не останавливает heartbeat - повтор через heartbeat_retry секунд.
+    Если аренда потеряна (задачу взял другой воркер), запущенные ffmpeg останавливаются, а результат не пишется.
+    """
+    stop = threading.Event()
+    lease_lost = threading.Event()
+
+    def keep_lease():
+        delay = config.WORKQUEUE['heartbeat_interval']
+        while not stop.wait(delay):
+            try:
+                renewed = heartbeat(job['id'], worker_id)
+            except sqlite3.Error as e:
+                logging.warning(f"Очередь: не удалось продлить аренду задачи {job['id']}, повтор: {e}")
+                delay = config.WORKQUEUE['heartbeat_retry']
+                continue
+            if not renewed:
+                logging.error(f"Очередь: аренда задачи {job['id']} потеряна - задача останавливается")
+                lease_lost.set()
+                ffmpeg_runner.stop_all(f"аренда задачи {job['id']} потеряна")
+                return
+            delay = config.WORKQUEUE['heartbeat_interval']
+
+    heartbeat_thread = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat_thread.start()
+    try:
+        success = bool(execute(job))
+        error = None if success else "задача завершилась ошибкой"
+    except Exception as e:
+        success, error = False, str(e)
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+        ffmpeg_runner.resume_all()
+
+    if lease_lost.is_set():
+        # Задача уже у другого воркера: ее статус теперь пишет он
+        logging.info(f"Очередь: задача {job['id']} ({job['kind']}) остановлена - аренда потеряна")
+        return False
+    finish(job['id'], worker_id, success, error)
+    logging.info(f"Очередь: задача {job['id']} ({job['kind']}) - {'готово' if success else 'ошибка: ' + error}")
+    return success
+
+def run_worker(exit_when_empty=False):
+    """Цикл воркера: брать задачи, пока они есть (или ждать новые)"""
+    worker_id = get_worker_id()
+    logging.info(f"Воркер {worker_id} запущен, очередь: {config.WORKQUEUE['db_path']}")
+    while True:
+        job = claim(worker_id)
+        if not job:
+            # Арендованные задачи еще могут вернуться в очередь, если их воркер умер
+            if exit_when_empty and not count_unfinished():
+                break
+            time.sleep(config.WORKQUEUE['idle_sleep'])
+            continue
+        logging.info(f"Очередь: воркер {worker_id} взял задачу {job['id']} ({job['kind']}), попытка {job['attempts'] + 1}")
+        run_job(job, worker_id)
+    logging.info(f"Воркер {worker_id}: очередь пуста, завершение")
+
+def run_local_workers(count, exit_when_empty=False):
+    """Несколько воркеров-процессов на этой машине; бюджет ядер делится между ними поровну"""
+    cpu_budget = max(1, scheduler.get_cpu_budget() // count)
+    cmd = [sys.executable, str(Path(__file__).resolve()), 'worker', '--cpu-budget', str(cpu_budget)]
+    if exit_when_empty:
+        cmd.append('--exit-when-empty')
+    processes = [subprocess.Popen(cmd) for _ in range(count)]
+    return all(process.wait() == 0 for process in processes)
+
+def count_unfinished():
+    """Сколько задач еще не в done/dead"""
+    connection = connect()
+    try:
+        return connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')").fetchone()[0]
+    finally:
+        connection.close()
+
+def get_status():
+    """Число задач по статусам"""
+    connection = connect()
+    try:
+        return {row['status']: row['count'] for row in
+                connection.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")}
+    finally:
+        connection.close()
+
+def requeue_dead():
+    """Вернуть задачи из dead в очередь (после исправления причины)"""
+    connection = connect()
+    try:
+        cursor = connection.execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, updated_at = ? WHERE status = 'dead'", (time.time(),)
+        )
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Очередь задач рендера для нескольких воркеров")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('enqueue', help="Добавить задачу")
+    add.add_argument('--kind', choices=KINDS, default='clips')
+    add.add_argument('--input', type=Path, required=True, help="Исходное видео (путь, видимый всем воркерам)")
+    add.add_argument('--num-clips', type=int, default=20)
+    add.add_argument('--clip-duration', type=float, default=15)
+    add.add_argument('--test', action='store_true', help="process_video: только тестовый фрагмент")
+    add.add_argument('--priority', type=int, default=0, help="Меньше - раньше")
+
+    worker = commands.add_parser('worker', help="Запустить воркер(ы)")
+    worker.add_argument('--workers', type=int, default=1, help="Сколько воркеров-процессов запустить на этой машине")
+    worker.add_argument('--exit-when-empty', action='store_true', help="Завершиться, когда задачи кончатся")
+    worker.add_argument('--cpu-budget', type=int, help="Сколько ядер отдать воркеру (по умолчанию PARALLEL['cpu_budget'])")
+
+    commands.add_parser('status', help="Число задач по статусам")
+    commands.add_parser('requeue-dead', help="Вернуть задачи из dead в очередь")
+    args = parser.parse_args()
+
+    utils.setup_logging()
+
+    if args.command == 'enqueue':
+        if args.kind == 'clips':
+            payload = {'input': str(args.input.resolve()), 'num_clips': args.num_clips, 'clip_duration': args.clip_duration}
+        else:
+            payload = {'input': str(args.input.resolve()), 'test_mode': args.test}
+        job_id = enqueue(args.kind, payload, args.priority)
+        logging.info(f"Задача {job_id} добавлена в очередь")
+    elif args.command == 'worker':
+        utils.create_directories()
+        if args.cpu_budget:
+            config.PARALLEL['cpu_budget'] = args.cpu_budget
+        if args.workers > 1:
+            sys.exit(0 if run_local_workers(args.workers, args.exit_when_empty) else 1)
+        run_worker(args.exit_when_empty)
+    elif args.command == 'status':
+        print(json.dumps(get_status(), ensure_ascii=False))
+    else:
+        logging.info(f"Возвращено в очередь: {requeue_dead()}")
+
+if __name__ == "__main__":
+    main()